@@ -0,0 +1,171 @@
+from fun import *
+from raster import Raster
+from hsi_curve import HSICurve
+from create_hsi_rasters import check_hsi_weights, combine_hsi_arrays
+from uha_calculator import UHACalculator
+from time import perf_counter
+
+
+def get_stage_curves(json_file, life_stages, parameters, max_error=0.0):
+    """
+    Get HSICurve objects of all life stages and parameters from one fish json file (read only once)
+    :param json_file: string (directory and name of json file containing HSI curves)
+    :param life_stages: list of life stages (e.g., ["spawning", "fry", "juvenile", "adult"])
+    :param parameters: list (may contain "velocity", "depth", and/or "grain_size")
+    :param max_error: float of the max. HSI error of the curves' lookup tables (see HSICurve) - default=0.0 uses
+                        the exact interpolation of create_hsi_rasters (the same cHSI values and habitat pixels)
+    :return: dictionary of {life_stage: {parameter: HSICurve}} - life stages with incomplete curves are skipped
+    """
+    stage_curves = {}
+    for stage in life_stages:
+        # the json file is parsed once by the curve_registry (see hsi_curve.py)
+        curves = {par: HSICurve(json_file, par, stage, max_error=max_error) for par in parameters}
+        if any([curve.x_values.size < 2 for curve in curves.values()]):
+            print("WARNING: Skipping life stage %s (incomplete HSI curves)." % stage)
+            continue
+        stage_curves.update({stage: curves})
+    return stage_curves
+
+
+@geo.traced()
+def run_scenario(scenario, tif_dict, stage_curves, output_dir, method="geometric_mean", threshold=0.4,
+                 dtype_policy=None, profile=config_profile, overviews=False, weights=None):
+    """
+    Calculate cHSI rasters and usable habitat areas of all life stages for one discharge scenario, where
+        every hydraulic (parameter) raster is read only once tile-by-tile (the next tiles are read and
+        the cHSI tiles are written by background threads - see geo.io_buffers)
+    :param scenario: string of the scenario name (e.g., "Q050") used in the output file names
+    :param tif_dict: dictionary of parameter names and tif files (e.g., {"velocity": "C:/u.tif", "depth": ...})
+    :param stage_curves: dictionary of {life_stage: {parameter: HSICurve}} (see get_stage_curves)
+    :param output_dir: string of the directory where chsi_SCENARIO_LIFESTAGE.tif rasters are written
+    :param method: string of the cHSI combination method (default="geometric_mean", alt="product)
+    :param threshold: float of the min. cHSI value of usable habitat (default=0.4)
+    :param dtype_policy: STR of the dtype policy of the tiles and output rasters (e.g., "uint8" writes quantized
+                            cHSI values) - default=None uses raster_dtype (config.py)
+    :param profile: STR of a GeoTIFF creation option profile (e.g., "deflate", see geo.gtiff_profiles)
+                            default=config_profile uses gtiff_profile (config.py) and None writes striped and
+                            uncompressed GeoTIFFs
+    :param overviews: BOOL - if True, overviews are added to the cHSI GeoTIFFs - default=False
+    :param weights: dictionary of parameter names and FLOAT weights of the cHSI combination (e.g.,
+                            {"velocity": 2.0, "depth": 1.0}) - default=None (equal weights)
+    :return: dictionary of UHA results per life stage (see UHACalculator.get_results), without life stages
+                whose output raster cannot be created
+    :raises ValueError: if the weights are invalid (see check_hsi_weights)
+    """
+    par_weights = None if weights is None else [weights.get(par, np.nan) for par in tif_dict.keys()]
+    # invalid weights raise before any output raster is created
+    check_hsi_weights(par_weights, tif_dict.__len__())
+
+    par_rasters = {par: Raster(tif, streaming=True, dtype_policy=dtype_policy) for par, tif in tif_dict.items()}
+    template = list(par_rasters.values())[0]
+    gt = template.geo_transformation
+    pixel_area = abs(gt[1] * gt[5] - gt[2] * gt[4])
+
+    # create one (empty) output raster per life stage
+    out_bands = {}
+    out_rasters = {}
+    for stage in stage_curves.keys():
+        out_name = output_dir + "chsi_%s_%s.tif" % (scenario, stage)
+        print("Creating %s ..." % out_name)
+        out_rasters[stage] = geo.create_raster_dataset(out_name, template.shape[1], template.shape[0],
+                                                       epsg=template.epsg, nan_val=nan_value,
+                                                       geo_info=template.geo_transformation,
+                                                       dtype_policy=template.dtype_policy,
+                                                       profile=get_gtiff_profile(profile),
+                                                       mask_band=nodata_masks)
+        if out_rasters[stage] is None:
+            print("ERROR: Skipping life stage %s (cannot create %s)." % (stage, out_name))
+            del out_rasters[stage]
+            continue
+        out_bands[stage] = out_rasters[stage].GetRasterBand(1)
+    # only life stages with an output raster are calculated
+    stage_curves = {stage: curves for stage, curves in stage_curves.items() if stage in out_bands}
+    if not stage_curves:
+        return {}
+
+    uha = {stage: UHACalculator(pixel_area, threshold=threshold) for stage in stage_curves.keys()}
+    windows = template.get_windows()
+    # ring of cHSI buffers, where a buffer is only re-used after the write-behind thread wrote it; Float32 like
+    # the cHSI expression of the serial workflow (see RasterExpression._evaluate), which otherwise classifies
+    # pixels at the threshold differently
+    buffer_shape = (max([w[3] for w in windows]), max([w[2] for w in windows]))
+    chsi_buffers = [np.empty(buffer_shape, dtype=np.float32) for i in range(geo.io_buffers + 2)]
+    n_tiles = 0
+
+    def read_tiles(window):
+        return {par: ras.read_window(window) for par, ras in par_rasters.items()}
+
+    try:
+        # the write-behind thread writes all queued tiles and stops also if a tile calculation fails
+        with geo.WriteBehind() as writer:
+            # read every parameter tile once (the next tiles are read in the background) and evaluate the
+            # HSI curves of all life stages on it
+            for window, par_tiles in geo.prefetch(read_tiles, windows):
+                for stage, curves in stage_curves.items():
+                    chsi_buffer = chsi_buffers[n_tiles % chsi_buffers.__len__()]
+                    n_tiles += 1
+                    hsi_tiles = [curves[par].interpolate(par_tiles[par]) for par in par_tiles.keys()]
+                    chsi_tile = combine_hsi_arrays(hsi_tiles, method=method, weights=par_weights,
+                                                   out=chsi_buffer[:window[3], :window[2]])
+                    # same no-data definition as the HSIRaster / combine_hsi_rasters workflow
+                    valid_mask = None
+                    if nodata_masks:
+                        valid_mask = np.logical_and.reduce([curves[par].in_range(par_tiles[par])
+                                                            for par in par_tiles.keys()])
+                        chsi_tile[~valid_mask] = np.nan
+                    else:
+                        chsi_tile[chsi_tile == nan_value] = np.nan
+                    uha[stage].add(chsi_tile, valid_mask=valid_mask)
+                    writer.write(out_bands[stage], chsi_tile, window=window, nan_val=nan_value,
+                                 dtype_policy=template.dtype_policy, valid_mask=valid_mask)
+    finally:
+        # written tiles reach the files also if a tile calculation fails
+        for band in out_bands.values():
+            band.FlushCache()
+
+    if overviews:
+        for stage in out_rasters.keys():
+            geo.build_overviews(out_rasters[stage])
+    return {stage: calculator.get_results() for stage, calculator in uha.items()}
+
+
+@log_actions
+def main():
+    """
+    Calculate cHSI rasters and usable habitat areas for all life stages and discharge scenarios in one run
+    > uses fish_file, life_stages, parameters, scenarios, output_dir, and chsi_threshold
+    """
+    stage_curves = get_stage_curves(fish_file, life_stages, parameters)
+
+    uha_table = []
+    for scenario, tif_dict in scenarios.items():
+        uha = run_scenario(scenario, {par: tif_dict[par] for par in parameters}, stage_curves, output_dir,
+                           threshold=chsi_threshold, profile=gtiff_profile, overviews=gtiff_overviews)
+        for stage, results in uha.items():
+            uha_table.append({"scenario": scenario, "life_stage": stage, "uha_threshold": results["threshold"],
+                              "uha_weighted": results["weighted"], "valid_area": results["valid_area"]})
+
+    # write usable habitat areas (one row per scenario and life stage)
+    uha_df = pd.DataFrame(uha_table)
+    uha_df.to_csv(output_dir + "uha.csv", index=False)
+    print(uha_df)
+
+
+if __name__ == '__main__':
+    # define global variables for the main() function
+    fish_file = os.path.abspath("") + "\\habitat\\trout.json"
+    life_stages = ["spawning", "fry", "juvenile", "adult"]
+    parameters = ["velocity", "depth"]
+    # dictionary of discharge scenarios and their hydraulic rasters
+    scenarios = {"Q050": {"velocity": os.path.abspath("") + "\\basement\\flow_velocity.tif",
+                          "depth": os.path.abspath("") + "\\basement\\water_depth.tif"}}
+    output_dir = os.path.abspath("") + "\\habitat\\"
+    chsi_threshold = 0.4
+    gtiff_profile = "deflate"  # GeoTIFF creation options: None, "tiled", "deflate", "zstd", "lzw", or "bigtiff"
+    gtiff_overviews = False  # if True, overviews (pyramids) are added to the GeoTIFFs for fast display
+
+    # run code and evaluate performance
+    t0 = perf_counter()
+    main()
+    t1 = perf_counter()
+    print("Time elapsed: " + str(t1 - t0))
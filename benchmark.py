@@ -0,0 +1,233 @@
+from fun import *
+from raster import Raster
+from raster_hsi import HSIRaster
+from hsi_curve import HSICurve
+from create_hsi_rasters import combine_hsi_rasters
+from calculate_habitat_area import calculate_uha
+from time import perf_counter, strftime
+import platform
+
+
+def compare_results(reference_file, results, tolerance=0.1):
+    """
+    Compare benchmark results with a previous run and print throughput regressions
+    :param reference_file: string of a JSON file written by main() (previous run)
+    :param results: list of benchmark records (see run_benchmarks)
+    :param tolerance: float of the acceptable relative throughput loss (default=0.1 for 10 %)
+    :return: list of regressed records (tuples of size, stage, reference Mpx/s, current Mpx/s)
+    """
+    try:
+        reference = read_json(reference_file)["results"]
+    except (FileNotFoundError, KeyError, ValueError):
+        print("WARNING: Cannot read reference benchmark results from %s." % str(reference_file))
+        return []
+    # streaming and in-memory stages measure different work (records of older runs have no "streaming")
+    ref_speed = {(record["size"], record["stage"], record.get("streaming")): record["mpx_per_s"]
+                 for record in reference}
+
+    regressions = []
+    for record in results:
+        key = (record["size"], record["stage"], record.get("streaming"))
+        if key not in ref_speed:
+            continue
+        if record["mpx_per_s"] < ref_speed[key] * (1.0 - tolerance):
+            regressions.append((record["size"], record["stage"], ref_speed[key], record["mpx_per_s"]))
+            print("WARNING: {0} ({1}x{1}) dropped from {2:.2f} to {3:.2f} Mpx/s.".format(
+                record["stage"], record["size"], ref_speed[key], record["mpx_per_s"]))
+    return regressions
+
+
+def create_synthetic_rasters(directory, size, epsg=2056, pixel_size=1.0, seed=0):
+    """
+    Create synthetic flow velocity and water depth GeoTIFFs (a meandering channel with noise),
+        written row-block-by-row-block to limit the memory of large rasters (e.g., 20000x20000)
+    :param directory: string of the output directory
+    :param size: int of the number of rows and columns
+    :param epsg: int (Authority code) - default=2056
+    :param pixel_size: float of the pixel width and height - default=1.0
+    :param seed: int of the random number generator seed (reproducible rasters)
+    :return: dictionary of {"velocity": velocity tif, "depth": depth tif}
+    """
+    tifs = {"velocity": directory + "u_%i.tif" % size, "depth": directory + "h_%i.tif" % size}
+    geo_info = (2600000.0, pixel_size, 0.0, 1200000.0 + size * pixel_size, 0.0, -pixel_size)
+    datasets = {par: geo.create_raster_dataset(tif, size, size, epsg=epsg, nan_val=nan_value, geo_info=geo_info)
+                for par, tif in tifs.items()}
+    bands = {par: ds.GetRasterBand(1) for par, ds in datasets.items()}
+
+    rng = np.random.default_rng(seed)
+    cols = np.arange(size, dtype=np.float32)
+    n_rows = max(1, int(tile_budget // size))
+    for y_offset in range(0, size, n_rows):
+        rows = np.arange(y_offset, min(size, y_offset + n_rows), dtype=np.float32)[:, np.newaxis]
+        # distance from a sine-shaped channel axis relative to the channel half width
+        axis = 0.5 * size + 0.15 * size * np.sin(rows / size * 4.0 * np.pi)
+        distance = np.abs(cols - axis) / (0.2 * size)
+        depth = np.clip(1.8 * (1.0 - distance ** 2) + rng.normal(0.0, 0.05, distance.shape), 0.0, None)
+        velocity = np.clip(1.2 * np.sqrt(depth) + rng.normal(0.0, 0.05, distance.shape), 0.0, None) * (depth > 0)
+        geo.write_window(bands["depth"], depth.astype(np.float32), window=(0, y_offset, size, rows.size))
+        geo.write_window(bands["velocity"], velocity.astype(np.float32), window=(0, y_offset, size, rows.size))
+    for band in bands.values():
+        band.FlushCache()
+    return tifs
+
+
+def evaluate_windows(raster):
+    """
+    Read (and thereby evaluate) all windows of a Raster, which times the lazy tile-by-tile calculations of
+        streaming rasters (e.g., the HSI interpolation) without keeping the entire array in memory
+    :param raster: Raster
+    :return: Raster
+    """
+    for window in raster.get_windows():
+        raster.read_window(window)
+    return raster
+
+
+def measure(fun, n_pixels, *args, **kwargs):
+    """
+    Run a function and measure its duration, throughput, and resident set size (RSS, including GDAL block caches
+        and memory-mapped tiles that numpy allocations do not show)
+    :param fun: function to benchmark
+    :param n_pixels: int of the number of processed pixels (for the throughput)
+    :param args: arguments of fun
+    :param kwargs: keyword arguments of fun
+    :return: tuple of (return value of fun, dictionary of "seconds", "mpx_per_s", "rss_start_mb", "rss_end_mb",
+                and "peak_mb" (peak RSS of the stage above rss_start_mb, None if not available))
+    """
+    # without a reset (not Linux), the peak only grows if the stage raised the peak RSS of the process
+    peak_reset = geo.reset_peak_memory()
+    rss_start, peak_start = geo.get_memory_usage()
+    t0 = perf_counter()
+    result = fun(*args, **kwargs)
+    seconds = perf_counter() - t0
+    rss_end, peak_end = geo.get_memory_usage()
+    return result, {"seconds": seconds,
+                    "mpx_per_s": n_pixels / 1e6 / seconds if seconds > 0 else np.inf,
+                    "rss_start_mb": rss_start,
+                    "rss_end_mb": rss_end,
+                    "peak_mb": geo.get_difference(peak_end, rss_start if peak_reset else peak_start)}
+
+
+def run_benchmarks(tifs, size, curves, out_dir, threshold=0.4, polygonize=True, streaming=True):
+    """
+    Benchmark the stages of the HSI -> cHSI -> UHA pipeline for one raster size
+    :param tifs: dictionary of {"velocity": velocity tif, "depth": depth tif} (see create_synthetic_rasters)
+    :param size: int of the number of rows and columns of the rasters
+    :param curves: dictionary of {parameter: HSICurve}
+    :param out_dir: string of the directory where the cHSI (and habitat) rasters are written
+    :param threshold: float of the min. cHSI value of usable habitat (default=0.4)
+    :param polygonize: bool (if True, the habitat pixels are converted to polygons with geo.raster2polygon)
+    :param streaming: bool (if True, rasters are read and processed tile-by-tile, the interpolation functions
+                        are benchmarked with the first tile of the depth raster only, and the HSI and cHSI stages
+                        evaluate all windows, where the cHSI stage also interpolates the HSI tiles)
+    :return: list of benchmark records (dictionaries)
+    """
+    n_pixels = size * size
+    results = []
+
+    def add_record(stage, stats):
+        stats.update({"size": size, "stage": stage, "pixels": n_pixels, "streaming": streaming})
+        print(" * {0:>30s} ({1}x{1}): {2:8.3f} s | {3:8.2f} Mpx/s | {4:>8s} MB peak RSS".format(
+            stage, size, stats["seconds"], stats["mpx_per_s"],
+            "n/a" if stats["peak_mb"] is None else "%.1f" % stats["peak_mb"]))
+        results.append(stats)
+
+    if streaming:
+        # a full-size float64 array would need 8 bytes per pixel (3.2 GB for 20000x20000 pixels)
+        depth_raster = Raster(tifs["depth"], streaming=True)
+        depth_array = depth_raster.read_window(depth_raster.get_windows()[0])
+    else:
+        depth_array = Raster(tifs["depth"]).array
+    curve = curves["depth"]
+    add_record("interpolate_from_list", measure(interpolate_from_list, depth_array.size, list(curve.x_values),
+                                                list(curve.y_values), depth_array)[1])
+    add_record("HSICurve.interpolate", measure(curve.interpolate, depth_array.size, depth_array)[1])
+    del depth_array
+
+    # streaming: HSI and cHSI values are only calculated when windows are read (and again in Raster.save)
+    hsi_rasters = []
+    for par, tif in tifs.items():
+        hsi_raster, stats = measure(lambda: evaluate_windows(HSIRaster(tif, curves[par], streaming=True)) if streaming
+                                    else HSIRaster(tif, curves[par]), n_pixels)
+        add_record("HSIRaster.make_hsi (%s)" % par, stats)
+        hsi_rasters.append(hsi_raster)
+
+    chsi_raster, stats = measure(lambda: evaluate_windows(combine_hsi_rasters(hsi_rasters)) if streaming
+                                 else combine_hsi_rasters(hsi_rasters).compute(), n_pixels)
+    add_record("Raster operators (cHSI)", stats)
+
+    chsi_file = out_dir + "chsi_%i.tif" % size
+    add_record("Raster.save", measure(chsi_raster.save, n_pixels, chsi_file)[1])
+    del chsi_raster, hsi_rasters
+
+    chsi_raster = Raster(chsi_file, streaming=streaming)
+    add_record("calculate_uha", measure(calculate_uha, n_pixels, chsi_raster, threshold)[1])
+
+    if polygonize:
+        habitat_file = out_dir + "habitat_%i.tif" % size
+        # the habitat raster is written window-by-window (the cHSI raster is not loaded at once)
+        habitat_raster = geo.create_raster_dataset(habitat_file, chsi_raster.shape[1], chsi_raster.shape[0],
+                                                   epsg=chsi_raster.epsg, geo_info=chsi_raster.geo_transformation)
+        habitat_band = habitat_raster.GetRasterBand(1)
+        for window in chsi_raster.get_windows():
+            with np.errstate(invalid="ignore"):
+                habitat_pixels = np.greater_equal(chsi_raster.read_window(window), threshold) * 1.0
+            geo.write_window(habitat_band, habitat_pixels, window=window)
+        habitat_band.FlushCache()
+        habitat_raster = habitat_band = None
+        add_record("raster2polygon", measure(geo.raster2polygon, n_pixels, habitat_file,
+                                             out_dir + "habitat_%i.shp" % size)[1])
+    return results
+
+
+@log_actions
+@cache
+def main():
+    """
+    Benchmark the HSI -> cHSI -> UHA pipeline with synthetic rasters of several sizes
+    > uses sizes, bench_dir, fish_file, life_stage, polygonize_max_size, in_memory_max_size, reference_file, and
+      streaming
+    """
+    try:
+        os.makedirs(bench_dir)
+    except OSError:
+        pass
+    fish_data = read_json(fish_file)
+    curves = {par: HSICurve(fish_data, par, life_stage) for par in ["velocity", "depth"]}
+
+    results = []
+    for size in sizes:
+        print("Benchmarking %ix%i pixels ..." % (size, size))
+        tifs = create_synthetic_rasters(bench_dir, size)
+        results += run_benchmarks(tifs, size, curves, bench_dir, polygonize=size <= polygonize_max_size,
+                                  streaming=streaming or size > in_memory_max_size)
+
+    benchmark_info = {"time": strftime("%Y-%m-%d %H:%M:%S"),
+                      "platform": platform.platform(),
+                      "python": platform.python_version(),
+                      "numpy": np.__version__,
+                      "lazy_rasters": lazy_rasters,
+                      "raster_dtype": raster_dtype,
+                      "streaming": streaming,
+                      "in_memory_max_size": in_memory_max_size,
+                      "tile_budget": tile_budget,
+                      "results": results}
+    with open(bench_dir + "benchmark_%s.json" % strftime("%Y%m%d-%H%M%S"), mode="w") as file:
+        json.dump(benchmark_info, file, indent=2)
+
+    if reference_file:
+        compare_results(reference_file, results)
+
+
+if __name__ == '__main__':
+    # define global variables for the main() function
+    sizes = [1000, 5000, 10000, 20000]  # number of rows and columns of the synthetic rasters
+    bench_dir = os.path.abspath("") + "\\benchmark\\"
+    fish_file = os.path.abspath("") + "\\habitat\\trout.json"
+    life_stage = "juvenile"
+    polygonize_max_size = 5000  # raster2polygon is only benchmarked up to this size
+    reference_file = None  # JSON file of a previous run (e.g., bench_dir + "benchmark_20200101-120000.json")
+    streaming = True  # if True, rasters are read and processed tile-by-tile (see tile_budget in config.py)
+    in_memory_max_size = 5000  # larger rasters are always streamed (also if streaming is False)
+
+    main()
@@ -1,32 +1,99 @@
 from fun import *
 from raster import Raster
+from uha_calculator import UHACalculator
 
 
+@geo.traced()
 def calculate_habitat_area(layer, epsg):
     """
     Calculate the usable habitat area
     :param layer: osgeo.ogr.Layer
     :param epsg: int (Authority code drives area units)
-    :return: None
+    :return: float of the habitat area
     """
-    pass
+    # retrieve units
+    area_unit = get_area_unit(epsg)
 
-    
+    # write the areas and classes of all polygons to the area and class fields in one pass and sum the areas of
+    # polygons where the first field ("values") is one (determined by chsi_treshold)
+    value_field = layer.GetLayerDefn().GetFieldDefn(0).GetName()
+    habitat_area = geo.add_polygon_areas(layer, area_field="area", value_field=value_field,
+                                         class_labels={0: "no habitat", 1: "habitat"})[1]
+
+    # print habitat area
+    print("The total habitat area is {0} {1}.".format(str(habitat_area), area_unit))
+    return habitat_area
+
+
+@geo.traced()
+def calculate_uha(chsi_raster, threshold, bin_edges=np.linspace(0.0, 1.0, 11)):
+    """
+    Calculate the usable habitat area directly from the pixels of a cHSI raster (threshold and
+        cHSI-weighted method at once), window-by-window if the raster is in streaming mode
+    :param chsi_raster: Raster with cHSI values
+    :param threshold: float (min=0.0, max=1.0) of the min. cHSI value of usable habitat
+    :param bin_edges: numpy.ndarray of cHSI class edges for histograms - default=10 classes between 0.0 and 1.0
+    :return: dictionary of UHA values and cHSI class histograms (see UHACalculator.get_results)
+    """
+    # pixel area (determinant of the GeoTransformation also accounts for rotated rasters)
+    gt = chsi_raster.geo_transformation
+    uha = UHACalculator(abs(gt[1] * gt[5] - gt[2] * gt[4]), threshold=threshold, bin_edges=bin_edges)
+    for window in chsi_raster.get_windows():
+        chsi_array = chsi_raster.read_window(window)
+        # with nodata_masks (config.py), the valid pixels are known without checking for np.nan
+        uha.add(chsi_array, valid_mask=chsi_raster.get_valid_mask(window) if nodata_masks else None)
+    return uha.get_results()
+
+
+def get_area_unit(epsg):
+    """
+    Get the area unit of a spatial reference system
+    :param epsg: int (Authority code)
+    :return: string (e.g., "square metre")
+    """
+    srs = geo.osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    return "square %s" % str(srs.GetLinearUnitsName())
 
 
 def main():
     """
     Calculate the usable physical habitat area based on a previously created chsi raster.
     Use the create_hsi_rasters.py script first to create a chsi raster.
-    > uses chsi_ras_name: string (directory and file name ending on ".tif")
-    > uses chsi_threshold_value: float (min=0.0, max=1.0)
+    > uses chsi_raster_name: string (directory and file name ending on ".tif")
+    > uses chsi_threshold: float (min=0.0, max=1.0)
+    > uses streaming: bool (read the chsi raster tile-by-tile)
+    > uses export_polygons: bool (optional export of usable habitat polygons)
+    > uses polygon_connectedness: int (4 or 8 neighbour pixels forming one habitat polygon)
     """
-    pass
+    # open the chsi raster
+    chsi_raster = Raster(chsi_raster_name, streaming=streaming)
+    area_unit = get_area_unit(chsi_raster.epsg)
+
+    # calculate the usable habitat area directly from the raster pixels
+    uha = calculate_uha(chsi_raster, chsi_threshold)
+    print("The total habitat area is {0} {1} (threshold method).".format(str(uha["threshold"]), area_unit))
+    print("The total habitat area is {0} {1} (cHSI-weighted method).".format(str(uha["weighted"]), area_unit))
+    for i, class_area in enumerate(uha["class_area"]):
+        print(" * cHSI {0:.2f}-{1:.2f}: {2} {3}".format(uha["bin_edges"][i], uha["bin_edges"][i + 1],
+                                                        str(class_area), area_unit))
+
+    if export_polygons:
+        # optional: export usable habitat polygons, where only the in-memory habitat mask (cHSI >= chsi_threshold,
+        # built window-by-window) is polygonized
+        tar_shp_file_name = os.path.abspath("") + "\\habitat\\habitat-area.shp"
+        habitat_polygons = geo.raster2polygon(chsi_raster_name, tar_shp_file_name, mask_threshold=chsi_threshold,
+                                              connectedness=polygon_connectedness)
+        if habitat_polygons is not None:
+            calculate_habitat_area(habitat_polygons.GetLayer(), chsi_raster.epsg)
 
 
 if __name__ == '__main__':
     chsi_raster_name = os.path.abspath("") + "\\habitat\\chsi.tif"
     chsi_threshold = 0.4
+    streaming = False  # if True, the chsi raster is read tile-by-tile (see tile_budget in config.py)
+    export_polygons = False  # if True, usable habitat polygons are written to /habitat/habitat-area.shp
+    polygon_connectedness = 4  # 8 also merges diagonally neighbouring habitat pixels into one polygon
 
     # launch main function
     main()
@@ -28,3 +28,45 @@ par_dict = {"velocity": "u",
             "depth": "h",
             "grain_size": "d"}
 nan_value = 0.0
+
+# lookup table (LUT) settings for HSICurve objects (hsi_curve.py)
+lut_resolution = {"velocity": 0.001,  # LUT step size in m/s
+                  "depth": 0.001,  # LUT step size in m (1 mm)
+                  "grain_size": 0.001}  # LUT step size in m
+lut_max_error = 0.005  # max. HSI error of a LUT, otherwise exact interpolation is used
+lut_max_size = 10 ** 7  # max. number of LUT entries
+
+# Raster operators (+, -, *, /, **) build lazy expressions evaluated in one pass with Raster.compute or
+# Raster.save if True; if False, every operator writes an intermediate GeoTIFF to the cache_folder
+lazy_rasters = True
+
+# max. number of pixels per tile (block-aligned window) of Rasters in streaming mode (Raster(..., streaming=True))
+tile_budget = 2 ** 22
+
+# storage backend of intermediate (cached) rasters: "vsimem" keeps them in GDAL's in-memory file system
+# and only spills to the cache_folder on disk above cache_memory_limit (bytes); "disk" always uses the cache_folder
+cache_backend = "vsimem"
+cache_memory_limit = 2 * 1024 ** 3
+vsimem_cache_folder = "/vsimem/__cache__/"
+
+# default dtype policy of Raster arrays: "float64" (original), "float32" (half memory), or "uint8"/"uint16"
+# (HSI rasters are kept as quantized integer codes and written with scale/offset metadata - see geo.dtype_policies;
+# other rasters, e.g., water depth, are saved as float32 - see Raster.get_file_dtype_policy)
+raster_dtype = "float64"
+
+# GeoTIFF creation option profile of saved rasters (None, "tiled", "deflate", "zstd", "lzw", or "bigtiff" - see
+# geo.gtiff_profiles) and overviews (pyramids for fast display, e.g., in QGIS)
+gtiff_profile = None
+gtiff_overviews = False
+
+# no-data handling: if True, Rasters carry a bit-packed validity mask through all operators, HSI interpolation, and
+# cHSI combination, and saved GeoTIFFs get a GDAL mask band instead of a no-data value (HSI=0.0 remains valid);
+# if False, nan_value pixels are no-data (original behaviour)
+nodata_masks = False
+
+# persistent cache of HSI rasters (see hsi_cache.py): HSI GeoTIFFs are re-used if the parameter raster, the HSI
+# curve, the settings, and the code did not change; least recently used files are removed above hsi_cache_max_size
+# (bytes); parameter rasters are identified by "stat" (path, size, and modification time) or "content" (SHA-256)
+hsi_cache_folder = os.path.abspath("") + "\\__hsi_cache__\\"
+hsi_cache_max_size = 10 * 1024 ** 3
+hsi_cache_fingerprint = "stat"
@@ -1,16 +1,115 @@
 from fun import *
-from raster_hsi import HSIRaster, Raster
+from raster_hsi import HSIRaster, Raster, RasterExpression
+from hsi_cache import HSICache
+from hsi_curve import curve_registry
 from time import perf_counter
+from multiprocessing import Pool
+from functools import partial
 
+# HSI rasters, cHSI raster, and memory-mapped output of a process pool worker (see _init_worker)
+_worker_data = {}
 
-def combine_hsi_rasters(raster_list, method="geometric_mean"):
+
+@geo.traced()
+def combine_hsi_arrays(array_list, method="geometric_mean", weights=None, out=None, chunk_size=2 ** 16,
+                       log_space=None):
+    """
+    Combine HSI arrays (e.g., tiles of HSI rasters) into a combined Habitat Suitability Index (cHSI) array
+        in one fused pass over row chunks (all HSI arrays are combined per chunk while it is in the CPU cache)
+    :param array_list: list of numpy.ndarrays with HSI values (all of the same shape)
+    :param method: string (default="geometric_mean", alt="product)
+    :param weights: list of FLOAT weights (exponents) of the HSI arrays, which are normalized to a sum of 1.0
+                        with the geometric mean (zero weights ignore an array) - default=None (equal weights)
+    :param out: numpy.ndarray to write the cHSI values to (may also be one of the HSI arrays)
+                        default=None creates a new float64 array
+    :param chunk_size: INT of the max. number of pixels per chunk - default=2**16
+    :param log_space: BOOL - if True, the sum of weighted log(HSI) is accumulated rather than the product of HSI
+                        values, which cannot underflow (always used for weighted combinations) - default=None uses
+                        log space for more than 16 arrays (the plain product keeps exact ties, e.g., 0.16 ** 0.5 = 0.4)
+    :return: numpy.ndarray of cHSI values (np.nan where any HSI array is np.nan)
+    :raises ValueError: if the weights are invalid (see check_hsi_weights)
+    """
+    weights = check_hsi_weights(weights, array_list.__len__())
+    # weighted combinations are always accumulated in log space
+    weighted = np.any(weights != weights[0]) or (method != "geometric_mean" and np.any(weights != 1.0))
+    if log_space is None:
+        log_space = array_list.__len__() > 16
+    log_space = log_space or weighted
+    if method == "geometric_mean":
+        weights = weights / weights.sum()
+    # supposedly method is "product" otherwise (power of 1.0)
+    power = weights[0] if method == "geometric_mean" else 1.0
+    arrays = [array for array, weight in zip(array_list, weights) if weight > 0.0]
+    weights = weights[weights > 0.0]
+
+    shape = np.shape(arrays[0])
+    if out is None:
+        out = np.empty(shape, dtype=float)
+    n_rows = shape[0] if shape.__len__() > 0 else 1
+    chunk_rows = max(1, int(chunk_size // max(1, int(np.prod(shape[1:])))))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for start in range(0, n_rows, chunk_rows):
+            rows = slice(start, start + chunk_rows) if shape.__len__() > 0 else Ellipsis
+            chsi_chunk = np.array(arrays[0][rows], dtype=float)
+            if log_space:
+                # log(0.0) = -inf yields exp(-inf) = 0.0 and np.nan remains np.nan
+                np.log(chsi_chunk, out=chsi_chunk)
+                chsi_chunk *= weights[0]
+                for hsi_array, weight in zip(arrays[1:], weights[1:]):
+                    chsi_chunk += weight * np.log(hsi_array[rows])
+                np.exp(chsi_chunk, out=chsi_chunk)
+            else:
+                for hsi_array in arrays[1:]:
+                    chsi_chunk *= hsi_array[rows]
+                if power != 1.0:
+                    np.power(chsi_chunk, power, out=chsi_chunk)
+            out[rows] = chsi_chunk
+    return out
+
+
+def check_hsi_weights(weights, n_arrays):
+    """
+    Validate the weights of a cHSI combination (see combine_hsi_arrays)
+    :param weights: list of FLOAT weights of the HSI arrays (rasters) or None (equal weights)
+    :param n_arrays: INT of the number of HSI arrays (rasters)
+    :return: numpy.ndarray (float) of weights
+    :raises ValueError: if the number of weights is not n_arrays, a weight is negative or not finite,
+                        or all weights are zero
+    """
+    if weights is None:
+        return np.ones(n_arrays)
+    weights = np.asarray(weights, dtype=float).ravel()
+    if weights.size != n_arrays or not np.all(np.isfinite(weights)) or np.any(weights < 0.0) \
+            or not np.any(weights > 0.0):
+        raise ValueError("Provide one finite, non-negative weight per HSI array (at least one > 0) - provided: %s"
+                         % str(weights.tolist()))
+    return weights
+
+
+def combine_hsi_rasters(raster_list, method="geometric_mean", weights=None):
     """
     Combine HSI rasters into combined Habitat Suitability Index (cHSI) Rasters
     :param raster_list: list of HSIRasters (HSI)
     :param method: string (default="geometric_mean", alt="product)
-    :return HSIRaster: contains float pixel values
+    :param weights: list of FLOAT weights of the HSI rasters (see combine_hsi_arrays) - default=None
+    :return RasterExpression: cHSI values of all HSI rasters combined in one node (see combine_hsi_arrays),
+                                evaluated with compute() unless lazy_rasters (config.py) or streaming
+    :raises ValueError: if the weights are invalid (see check_hsi_weights)
     """
-    pass
+    # invalid weights raise before the (lazy) expression is built or evaluated
+    check_hsi_weights(weights, raster_list.__len__())
+    operator = partial(_combine_hsi_operands, method=method, weights=weights)
+    chsi_raster = RasterExpression("chsi", operator, list(raster_list))
+    if lazy_rasters or chsi_raster.streaming:
+        return chsi_raster
+    return chsi_raster.compute()
+
+
+def _combine_hsi_operands(*hsi_arrays, out=None, method="geometric_mean", weights=None):
+    """
+    RasterExpression operator of combine_hsi_rasters (same signature as numpy.ufuncs)
+    """
+    return combine_hsi_arrays(list(hsi_arrays), method=method, weights=weights, out=out)
 
 
 def get_hsi_curve(json_file, life_stage, parameters):
@@ -22,23 +121,225 @@ def get_hsi_curve(json_file, life_stage, parameters):
     :return curve_data: dictionary of life stage specific HSI curves as pd.DataFrame for requested parameters;
                         for example: curve_data["velocity"]["HSI"]
     """
-    pass
+    # the curve_registry parses the JSON file only once (and again if it changes)
+    curve_data = {}
+    for par in parameters:
+        x_values, y_values = curve_registry.get(json_file, par, life_stage)
+        if x_values is None:
+            print("ERROR: No HSI curve for %s-%s." % (par, life_stage))
+            x_values, y_values = np.array([]), np.array([])
+        # the DataFrame wraps the registry arrays (they are read-only and must not be modified)
+        curve_data.update({par: pd.DataFrame({par_dict[par]: x_values, "HSI": y_values}, copy=False)})
+    return curve_data
 
 
-def get_hsi_raster(tif_dir, hsi_curve):
+def get_hsi_raster(tif_dir, hsi_curve, streaming=False, dtype_policy=None, memmap=False):
     """
     Calculate and return Habitat Suitability Index Rasters
     :param tif_dir: string of directory and name of  a tif file with parameter values (e.g., depth in m)
     :param hsi_curve: nested list of [[par-values], [HSI-values]], where
                             [par-values] (e.g., velocity values) and
                             [HSI-values] must have the same length.
+    :param streaming: BOOL - if True, the raster is processed tile-by-tile (see tile_budget in config.py)
+    :param dtype_policy: STR of the array dtype policy ("float64", "float32", "uint8", or "uint16")
+                            default=None uses raster_dtype (config.py)
+    :param memmap: BOOL - if True, the parameter raster is memory-mapped rather than loaded (see Raster)
     :return hsi_raster: Raster with HSI values
     """
-    pass
+    return HSIRaster(tif_dir, hsi_curve, streaming=streaming, dtype_policy=dtype_policy, memmap=memmap)
 
 
+def make_chsi_parallel(tif_dict, hsi_curves, output_dir, method="geometric_mean", n_processes=None,
+                       dtype_policy=None, profile=config_profile, overviews=False):
+    """
+    Calculate HSI and cHSI rasters tile-by-tile on a process pool and write them to GeoTIFFs
+        (results are identical to the serial streaming HSIRaster / combine_hsi_rasters workflow with the same
+        dtype_policy)
+    :param tif_dict: dictionary of parameter names and tif files (e.g., {"velocity": "C:/u.tif", "depth": ...})
+    :param hsi_curves: dictionary of parameter names and nested lists of [[par-values], [HSI-values]]
+    :param output_dir: string of the directory where hsi_PARAMETER.tif and chsi.tif are written
+    :param method: string (default="geometric_mean", alt="product)
+    :param n_processes: INT of the number of processes - default=None uses os.cpu_count()
+    :param dtype_policy: STR of the dtype policy of the HSI rasters and output GeoTIFFs (e.g., "uint8" writes
+                            quantized HSI values) - default=None uses raster_dtype (config.py)
+    :param profile: STR of a GeoTIFF creation option profile (e.g., "deflate", see geo.gtiff_profiles)
+                            default=config_profile uses gtiff_profile (config.py) and None writes striped and
+                            uncompressed GeoTIFFs
+    :param overviews: BOOL - if True, overviews are added to the output GeoTIFFs - default=False
+    :return: 0 = success; -1 = failed
+    """
+    template = Raster(list(tif_dict.values())[0], streaming=True)
+    windows = template.get_windows()
+    out_names = [output_dir + "hsi_%s.tif" % par for par in tif_dict.keys()] + [output_dir + "chsi.tif"]
+
+    # workers read their own tiles from the GeoTIFFs and write results to a memory-mapped buffer (no pickled arrays)
+    check_cache()
+    buffer_name = cache_folder + "parallel_%s.dat" % create_random_string(6)
+    shape = (out_names.__len__(), template.shape[0], template.shape[1])
+    dtype_policy = dtype_policy or raster_dtype
+    buffer_dtype = _get_buffer_dtype(dtype_policy)
+    n_processes = n_processes or os.cpu_count()
+    chunk_size = max(1, windows.__len__() // (4 * n_processes))
+    out = None
+    try:
+        out = np.memmap(buffer_name, dtype=buffer_dtype, mode="w+", shape=shape)
+        out.flush()
+        with Pool(processes=n_processes, initializer=_init_worker,
+                  initargs=(tif_dict, hsi_curves, method, buffer_name, shape, dtype_policy)) as pool:
+            for window in pool.imap_unordered(_process_tile, windows, chunksize=chunk_size):
+                logging.debug("processed tile {0}".format(str(window)))
+
+        # reassemble every output GeoTIFF from the buffer (single writer)
+        status = 0
+        for i, out_name in enumerate(out_names):
+            print("Saving Raster as %s ..." % out_name)
+            new_raster = geo.create_raster_dataset(out_name, template.shape[1], template.shape[0],
+                                                   epsg=template.epsg, nan_val=nan_value,
+                                                   geo_info=template.geo_transformation, dtype_policy=dtype_policy,
+                                                   profile=get_gtiff_profile(profile), mask_band=nodata_masks)
+            if new_raster is None:
+                status = -1
+                continue
+            band = new_raster.GetRasterBand(1)
+            with geo.WriteBehind() as writer:
+                for window in windows:
+                    tile = np.array(out[i, window[1]:window[1] + window[3], window[0]:window[0] + window[2]])
+                    writer.write(band, tile, window=window, nan_val=nan_value, dtype_policy=dtype_policy,
+                                 valid_mask=_get_tile_mask(tile, dtype_policy))
+            band.FlushCache()
+            if overviews and geo.build_overviews(new_raster) < 0:
+                status = -1
+    finally:
+        # the buffer is removed also if a worker or a GeoTIFF fails
+        del out
+        try:
+            os.remove(buffer_name)
+        except OSError:
+            pass
+    return status
+
+
+def save_hsi_raster(hsi_raster, hsi_file, hsi_cache=None, cache_key=None, profile=config_profile,
+                    overviews=None):
+    """
+    Save an HSI raster and add it to the HSI cache, where a failed save removes the (outdated) file of a previous
+        run rather than caching it under the new key
+    :param hsi_raster: HSIRaster
+    :param hsi_file: STR of the target GeoTIFF
+    :param hsi_cache: HSICache - default=None does not cache the GeoTIFF
+    :param cache_key: STR of the cache key of hsi_raster (see HSICache.get_key)
+    :param profile: STR of a GeoTIFF creation option profile (see Raster.save)
+    :param overviews: BOOL - if True, overviews are added (see Raster.save)
+    :return: 0 = success; -1 = failed
+    """
+    if hsi_raster.save(hsi_file, profile=profile, overviews=overviews) != 0:
+        print("ERROR: Could not save %s (not cached)." % hsi_file)
+        for stale_file in (hsi_file, hsi_file + ".msk"):
+            try:
+                os.remove(stale_file)
+            except OSError:
+                pass
+        return -1
+    if hsi_cache is not None:
+        hsi_cache.put(cache_key, hsi_file)
+    return 0
+
+
+def _init_worker(tif_dict, hsi_curves, method, buffer_name, shape, dtype_policy):
+    """
+    Open streaming HSIRasters, the lazy cHSI raster, and the memory-mapped output buffer in a pool worker
+    """
+    _worker_data["rasters"] = [get_hsi_raster(tif_dict[par], hsi_curves[par], streaming=True,
+                                              dtype_policy=dtype_policy) for par in tif_dict]
+    _worker_data["rasters"].append(combine_hsi_rasters(_worker_data["rasters"], method=method))
+    _worker_data["dtype_policy"] = dtype_policy
+    _worker_data["out"] = np.memmap(buffer_name, dtype=_get_buffer_dtype(dtype_policy), mode="r+", shape=shape)
+
+
+def _get_buffer_dtype(dtype_policy):
+    """
+    Get the dtype of the output buffer of make_chsi_parallel, which is the dtype of the output GeoTIFFs
+        (Float32 or the integer codes of quantized dtype policies)
+    :param dtype_policy: STR of a dtype policy (see geo.dtype_policies)
+    :return: numpy dtype
+    """
+    policy = geo.get_dtype_policy(dtype_policy)
+    return policy["code_dtype"] if policy["quantized"] else np.float32
+
+
+def _get_tile_mask(tile, dtype_policy):
+    """
+    Get the valid pixels of a buffer tile of make_chsi_parallel if nodata_masks=True (config.py)
+    :param tile: numpy.ndarray of a buffer tile (np.nan or the no-data code mark no-data pixels)
+    :param dtype_policy: STR of a dtype policy (see geo.dtype_policies)
+    :return: numpy.ndarray (bool) or None
+    """
+    if not nodata_masks:
+        return None
+    if tile.dtype.kind == "f":
+        return ~np.isnan(tile)
+    return tile != geo.get_dtype_policy(dtype_policy)["nan_val"]
+
+
+def _process_tile(window):
+    """
+    Calculate the HSI and cHSI values of one tile in a pool worker
+    :param window: TUPLE of (x_offset, y_offset, x_size, y_size) in pixels
+    :return: window
+    """
+    x_off, y_off, x_size, y_size = window
+    dtype_policy = _worker_data["dtype_policy"]
+    quantized = geo.get_dtype_policy(dtype_policy)["quantized"]
+    for i, ras in enumerate(_worker_data["rasters"]):
+        tile = ras.read_window(window)
+        if quantized:
+            # same integer codes as write_window (with nodata_masks, only np.nan marks no-data pixels)
+            tile = geo.quantize(tile, dtype_policy, nan_val=np.nan if nodata_masks else nan_value)
+        _worker_data["out"][i, y_off:y_off + y_size, x_off:x_off + x_size] = tile
+    return window
+
+
+@log_actions
+@cache
 def main():
-    pass    
+    # get HSI curves as pandas DataFrames nested in a dictionary
+    hsi_curve = get_hsi_curve(fish_file, life_stage=life_stage, parameters=parameters)
+
+    if n_processes > 1:
+        # compute HSI and cHSI rasters tile-by-tile on a process pool
+        hsi_curves = {par: [list(hsi_curve[par][par_dict[par]]), list(hsi_curve[par]["HSI"])] for par in parameters}
+        make_chsi_parallel({par: tifs[par] for par in parameters}, hsi_curves, hsi_output_dir,
+                           method="geometric_mean", n_processes=n_processes, dtype_policy=dtype_policy,
+                           profile=gtiff_profile, overviews=gtiff_overviews)
+        return
+
+    # create HSI rasters for all parameters considered and store the Raster objects in a dictionary
+    eco_rasters = {}
+    hsi_cache = HSICache() if use_hsi_cache else None
+    for par in parameters:
+        hsi_par_curve = [list(hsi_curve[par][par_dict[par]]),
+                         list(hsi_curve[par]["HSI"])]
+        hsi_file = hsi_output_dir + "hsi_%s.tif" % par
+        cache_key = None
+        if hsi_cache is not None:
+            # re-use the HSI raster of an unchanged parameter raster and HSI curve
+            cache_key = hsi_cache.get_key(tifs[par], hsi_par_curve, dtype_policy=dtype_policy,
+                                          profile=gtiff_profile, overviews=gtiff_overviews)
+            if hsi_cache.restore(cache_key, hsi_file):
+                print("Restored %s from the HSI cache." % hsi_file)
+                eco_rasters.update({par: Raster(hsi_file, streaming=streaming, dtype_policy=dtype_policy)})
+                continue
+        eco_rasters.update({par: get_hsi_raster(tif_dir=tifs[par], hsi_curve=hsi_par_curve, streaming=streaming,
+                                                dtype_policy=dtype_policy)})
+        save_hsi_raster(eco_rasters[par], hsi_file, hsi_cache=hsi_cache, cache_key=cache_key, profile=gtiff_profile,
+                        overviews=gtiff_overviews)
+    if hsi_cache is not None:
+        logging.info("HSI cache statistics: {0}".format(str(hsi_cache.get_stats())))
+
+    # get and save chsi raster
+    chsi_raster = combine_hsi_rasters(raster_list=list(eco_rasters.values()),
+                                      method="geometric_mean")
+    chsi_raster.save(hsi_output_dir + "chsi.tif", profile=gtiff_profile, overviews=gtiff_overviews)
 
 
 if __name__ == '__main__':
@@ -49,6 +350,12 @@ if __name__ == '__main__':
     tifs = {"velocity": os.path.abspath("") + "\\basement\\flow_velocity.tif",
             "depth": os.path.abspath("") + "\\basement\\water_depth.tif"}
     hsi_output_dir = os.path.abspath("") + "\\habitat\\"
+    streaming = False  # if True, rasters are read, combined, and written tile-by-tile (see tile_budget in config.py)
+    n_processes = 1  # if > 1, HSI and cHSI rasters are calculated tile-by-tile on a pool of n_processes
+    dtype_policy = "float64"  # "float32" halves the memory, "uint8" or "uint16" quantize HSI values (scale/offset)
+    gtiff_profile = "deflate"  # GeoTIFF creation options: None, "tiled", "deflate", "zstd", "lzw", or "bigtiff"
+    gtiff_overviews = False  # if True, overviews (pyramids) are added to the GeoTIFFs for fast display
+    use_hsi_cache = True  # if True, unchanged HSI rasters are restored from the hsi_cache_folder (config.py)
 
     # run code and evaluate performance
     t0 = perf_counter()
@@ -1,12 +1,15 @@
 from config import *
-from bisect import bisect_left
+
+# default of profile arguments (e.g., Raster.save) that uses gtiff_profile (config.py), where profile=None
+# explicitly writes striped and uncompressed GeoTIFFs (see get_gtiff_profile)
+config_profile = object()
 
 
 def cache(fun):
     def wrapper(*args, **kwargs):
-        check_cache()
+        # the cache_folder on disk is only created if a file spills to disk (see get_cache_file_name)
         fun(*args, **kwargs)
-        remove_directory(cache_folder)
+        clear_cache()
     return wrapper
 
 
@@ -17,6 +20,17 @@ def check_cache():
         pass
 
 
+def clear_cache():
+    """
+    Remove all intermediate rasters from the in-memory (/vsimem/) cache and the cache_folder on disk
+        (only if it exists, i.e., if files were spilled to disk)
+    :return: None
+    """
+    geo.remove_vsi_files(vsimem_cache_folder)
+    if os.path.isdir(cache_folder):
+        remove_directory(cache_folder)
+
+
 def create_random_string(length):
     """
     Create a random alphabetic string with a given length
@@ -26,31 +40,71 @@ def create_random_string(length):
     return "".join(random.choice(string.ascii_lowercase) for i in range(length))
 
 
+def get_cache_file_name(file_name, n_bytes=0):
+    """
+    Get the directory and name of an intermediate raster file according to the cache_backend (config.py)
+    :param file_name: string of a file name without directory (e.g., "u__mul_abcd__.tif")
+    :param n_bytes: integer of the (expected) file size, which spills the file to disk if the in-memory
+                        cache would exceed the cache_memory_limit (config.py) - default=0
+    :return: string of a /vsimem/ (GDAL in-memory) or cache_folder (disk) file name
+    """
+    if cache_backend == "vsimem":
+        if geo.get_vsi_size(vsimem_cache_folder) + n_bytes <= cache_memory_limit:
+            return vsimem_cache_folder + file_name
+        logging.info("in-memory cache is full - writing {0} to {1}".format(file_name, cache_folder))
+    check_cache()
+    return cache_folder + file_name
+
+
+def get_gtiff_profile(profile=config_profile):
+    """
+    Get the GeoTIFF creation option profile of a profile argument
+    :param profile: STR of a geo.gtiff_profiles key, list of creation options, None (no profile), or config_profile
+    :return: gtiff_profile (config.py) if profile is config_profile, otherwise profile
+    """
+    if profile is config_profile:
+        return gtiff_profile
+    return profile
+
+
 def interpolate_from_list(x_values, y_values, xi_values):
     """
     Calculate y_i value from a list of x and y values for a list of given x_i
+        (vectorized: all xi_values are processed at once with np.searchsorted,
+        which corresponds to bisect_left applied to every xi)
     :param x_values: sorted list (smallest to largest)
     :param y_values: sorted list (smallest to largest, must match x_values)
-    :param xi_values: n x 1 numpy.ndarray of floats
-    :return: n x 1 numpy.ndarray of floats (yi_values)
-    """
-    yi_values = []
-    max_position = x_values.__len__()
-    for xi in xi_values:
-        position = bisect_left(x_values, xi)
-        try:
-            if position > 0:
-                if position < max_position:
-                    yi_values.append(interpolate_y(x1=x_values[position-1], x2=x_values[position],
-                                                   y1=y_values[position-1], y2=y_values[position],
-                                                   xi=xi))
-                else:
-                    yi_values.append(nan_value)
-            else:
-                yi_values.append(nan_value)
-        except TypeError:
-            yi_values.append(nan_value)
-    return np.array(yi_values)
+    :param xi_values: numpy.ndarray of floats (any shape)
+    :return: numpy.ndarray of floats (yi_values) with the same shape as xi_values, where
+                xi_values beyond the range of x_values, np.nan, and zero-width segments get nan_value
+    """
+    try:
+        x_values = np.asarray(x_values, dtype=float)
+        y_values = np.asarray(y_values, dtype=float)
+        xi_values = np.asarray(xi_values, dtype=float)
+    except (TypeError, ValueError):
+        print("ERROR: x_values, y_values, and xi_values must be numeric.")
+        return np.full(np.shape(xi_values), nan_value)
+
+    # position of the upper curve point (equals bisect_left) - np.nan is sorted to the end
+    positions = np.searchsorted(x_values, xi_values, side="left")
+    valid = (positions > 0) & (positions < x_values.size) & ~np.isnan(xi_values)
+
+    # lower (1) and upper (2) curve points of valid xi_values
+    upper = positions[valid]
+    x1 = x_values[upper - 1]
+    x2 = x_values[upper]
+    y1 = y_values[upper - 1]
+    y2 = y_values[upper]
+
+    # same operation order as interpolate_y; zero-width segments yield nan_value
+    with np.errstate(divide="ignore", invalid="ignore"):
+        yi_valid = y1 + ((xi_values[valid] - x1) / (x2 - x1) * (y2 - y1))
+    yi_valid[x2 == x1] = nan_value
+
+    yi_values = np.full(xi_values.shape, nan_value, dtype=float)
+    yi_values[valid] = yi_valid
+    return yi_values
 
 
 def interpolate_y(x1, x2, y1, y2, xi):
@@ -74,7 +128,9 @@ def interpolate_y(x1, x2, y1, y2, xi):
 def log_actions(fun):
     def wrapper(*args, **kwargs):
         start_logging()
-        fun(*args, **kwargs)
+        # the entire run is the root stage of the trace (if enabled with the HABITAT_TRACE environment variable)
+        with geo.trace_stage(fun.__name__):
+            fun(*args, **kwargs)
         logging.shutdown()
     return wrapper
 
@@ -7,26 +7,51 @@ def coords2offset(geo_transform, x_coord, y_coord):
     """
     Returns x-y pixel offset (inverse of offset2coords function)
     :param geo_transform: osgeo.gdal.Dataset.GetGeoTransform() object
-    :param x_coord: FLOAT of x-coordinate
-    :param y_coord: FLOAT of y-coordinate
-    :return: offset_x, offset_y (both integer of pixel numbers)
+    :param x_coord: FLOAT or numpy.ndarray of x-coordinate(s)
+    :param y_coord: FLOAT or numpy.ndarray of y-coordinate(s)
+    :return: offset_x, offset_y (both integer of pixel numbers, or numpy.ndarrays of integers for array input)
+    """
+    offsets = coords2pixel(geo_transform, x_coord, y_coord)
+    if offsets is None:
+        return None
+    offset_x, offset_y = offsets
+    if np.ndim(offset_x) == 0:
+        return int(offset_x), int(offset_y)
+    # truncate towards zero (like int)
+    return np.trunc(offset_x).astype(np.int64), np.trunc(offset_y).astype(np.int64)
+
+
+def coords2pixel(geo_transform, x_coord, y_coord):
+    """
+    Returns fractional x-y pixel positions of coordinates (considers rotated geo_transforms)
+    :param geo_transform: osgeo.gdal.Dataset.GetGeoTransform() object
+    :param x_coord: FLOAT or numpy.ndarray of x-coordinate(s)
+    :param y_coord: FLOAT or numpy.ndarray of y-coordinate(s)
+    :return: pixel_x, pixel_y (FLOATs or numpy.ndarrays of floats, where 0.0 is the upper-left pixel corner)
     """
     try:
-        origin_x = geo_transform[0]
-        origin_y = geo_transform[3]
-        pixel_width = geo_transform[1]
-        pixel_height = geo_transform[5]
-    except IndexError:
+        origin_x, pixel_width, rotation_x, origin_y, rotation_y, pixel_height = geo_transform[0:6]
+    except (IndexError, ValueError):
         print("ERROR: Invalid geo_transform object (%s)." % str(geo_transform))
         return None
 
     try:
-        offset_x = int((x_coord - origin_x) / pixel_width)
-        offset_y = int((y_coord - origin_y) / pixel_height)
-    except ValueError:
+        delta_x = np.asarray(x_coord, dtype=float) - origin_x
+        delta_y = np.asarray(y_coord, dtype=float) - origin_y
+        if rotation_x == 0 and rotation_y == 0:
+            pixel_x = delta_x / pixel_width
+            pixel_y = delta_y / pixel_height
+        else:
+            # invert the affine transformation of rotated rasters
+            determinant = pixel_width * pixel_height - rotation_x * rotation_y
+            pixel_x = (pixel_height * delta_x - rotation_x * delta_y) / determinant
+            pixel_y = (pixel_width * delta_y - rotation_y * delta_x) / determinant
+    except (TypeError, ValueError):
         print("ERROR: geo_transform tuple contains non-numeric data: %s" % str(geo_transform))
         return None
-    return offset_x, offset_y
+    if np.ndim(pixel_x) == 0:
+        return float(pixel_x), float(pixel_y)
+    return pixel_x, pixel_y
 
 
 def get_layer(dataset, band_number=1):
@@ -47,25 +72,26 @@ def offset2coords(geo_transform, offset_x, offset_y):
     """
     Returns x-y coordinates from pixel offset (inverse of coords2offset function)
     :param geo_transform: osgeo.gdal.Dataset.GetGeoTransform() object
-    :param offset_x: integer of x pixel numbers
-    :param offset_y: integer of y pixel numbers
-    :return: x_coord, y_coord (FLOATs of x-y-coordinates)
+    :param offset_x: integer or numpy.ndarray of x pixel numbers (e.g., column indices from np.where)
+    :param offset_y: integer or numpy.ndarray of y pixel numbers (e.g., row indices from np.where)
+    :return: x_coord, y_coord (FLOATs of x-y-coordinates of pixel centers, or numpy.ndarrays for array input)
     """
     try:
-        origin_x = geo_transform[0]
-        origin_y = geo_transform[3]
-        pixel_width = geo_transform[1]
-        pixel_height = geo_transform[5]
-    except IndexError:
+        origin_x, pixel_width, rotation_x, origin_y, rotation_y, pixel_height = geo_transform[0:6]
+    except (IndexError, ValueError):
         print("ERROR: Invalid geo_transform object (%s)." % str(geo_transform))
         return None
 
     try:
-        coord_x = origin_x + pixel_width * (offset_x + 0.5)
-        coord_y = origin_y + pixel_height * (offset_y + 0.5)
-    except ValueError:
+        center_x = np.asarray(offset_x, dtype=float) + 0.5
+        center_y = np.asarray(offset_y, dtype=float) + 0.5
+        coord_x = origin_x + pixel_width * center_x + rotation_x * center_y
+        coord_y = origin_y + pixel_height * center_y + rotation_y * center_x
+    except (TypeError, ValueError):
         print("ERROR: geo_transform tuple contains non-numeric data: %s" % str(geo_transform))
         return None
+    if np.ndim(coord_x) == 0:
+        return float(coord_x), float(coord_y)
     return coord_x, coord_y
 
 
@@ -1,12 +1,86 @@
 from .srs_mgmt import *
-import itertools
 gdal.UseExceptions()
 
 
-def float2int(raster_file_name, band_number=1):
+def add_polygon_areas(layer, area_field="area", value_field=None, class_field="class", class_labels=None):
+    """
+    Write the areas (and classes) of all polygons of a layer to attribute fields, where the areas of all polygons
+        are calculated at once from their WKB geometries (see get_polygon_areas) and written within one transaction
+        (only the area and class fields are updated with GDAL >= 3.7, without re-writing geometries)
+    :param layer: osgeo.ogr.Layer with (multi)polygon features
+    :param area_field: STR of the (new) field for polygon areas in the layer's unit system (default: "area")
+    :param value_field: STR of a field with polygon values (e.g., habitat 0/1) - default=None sums all areas
+    :param class_field: STR of the (new) field for polygon class labels (only with class_labels) - default="class"
+    :param class_labels: dictionary of {polygon value: STR class label} (e.g., {1: "habitat"}), where values
+                            without label get str(value) - default=None does not write a class field
+    :output: TUPLE of (numpy.ndarray of polygon areas, FLOAT of the summed area of polygons with non-zero values)
+    """
+    if class_labels is not None and value_field is None:
+        print("WARNING: Polygon classes require a value_field (no class field written).")
+        class_labels = None
+    field_indices = []
+    for field_name, field_type in ((area_field, ogr.OFTReal), (class_field, ogr.OFTString)):
+        if field_name == class_field and class_labels is None:
+            continue
+        if layer.GetLayerDefn().GetFieldIndex(field_name) < 0:
+            layer.CreateField(ogr.FieldDefn(field_name, field_type))
+        field_indices.append(layer.GetLayerDefn().GetFieldIndex(field_name))
+
+    # read all feature ids and geometries in one pass
+    fids = []
+    wkb_list = []
+    values = []
+    layer.ResetReading()
+    for feature in layer:
+        geometry = feature.GetGeometryRef()
+        wkb_list.append(None if geometry is None else geometry.ExportToIsoWkb(ogr.wkbNDR))
+        if value_field is not None:
+            values.append(feature.GetField(value_field) or 0)
+        fids.append(feature.GetFID())
+    areas = get_polygon_areas(wkb_list)
+    field_values = [areas.tolist()]
+    if class_labels is not None:
+        field_values.append([str(class_labels.get(value, value)) for value in values])
+
+    # without ogr.UseExceptions, OGR returns an error code (e.g., if the driver does not support transactions)
+    try:
+        transaction = layer.StartTransaction() == ogr.OGRERR_NONE
+    except RuntimeError:
+        transaction = False
+    if hasattr(layer, "UpdateFeature"):
+        # one re-used feature that only carries the fields (e.g., shapefiles only re-write the DBF records)
+        update_feature = ogr.Feature(layer.GetLayerDefn())
+        for fid, feature_values in zip(fids, zip(*field_values)):
+            update_feature.SetFID(fid)
+            for field_index, value in zip(field_indices, feature_values):
+                update_feature.SetField(field_index, value)
+            layer.UpdateFeature(update_feature, field_indices, [], False)
+    else:
+        # sequential read (same order as above) rather than random access with GetFeature
+        layer.ResetReading()
+        for feature, feature_values in zip(layer, zip(*field_values)):
+            for field_index, value in zip(field_indices, feature_values):
+                feature.SetField(field_index, value)
+            layer.SetFeature(feature)
+    if transaction:
+        try:
+            commit_status = layer.CommitTransaction()
+        except RuntimeError:
+            commit_status = None
+        if commit_status != ogr.OGRERR_NONE:
+            print("ERROR: Could not commit the polygon areas.")
+
+    if value_field is None:
+        return areas, float(np.sum(areas))
+    return areas, float(np.sum(areas[np.asarray(values) != 0]))
+
+
+def float2int(raster_file_name, band_number=1, new_name=None):
     """
     :param raster_file_name: STR of target file name, including directory; must end on ".tif"
     :param band_number: INT of the raster band number to open (default: 1)
+    :param new_name: STR of the integer raster file name, e.g., a "/vsimem/" (in-memory) file
+                        (default: None writes raster_file_name + "_int.tif")
     :output: new_raster_file_name (STR)
     """
     raster, array, geo_transform = raster2array(raster_file_name, band_number=band_number)
@@ -15,7 +89,8 @@ def float2int(raster_file_name, band_number=1):
     except ValueError:
         print("Error: Invalid raster pixel values.")
         return raster_file_name
-    new_name = raster_file_name.split(".tif")[0] + "_int.tif"
+    if not new_name:
+        new_name = raster_file_name.split(".tif")[0] + "_int.tif"
 
     # get source coordinate system and exit function if not possible
     src_srs = get_srs(raster)
@@ -30,6 +105,158 @@ def float2int(raster_file_name, band_number=1):
     return new_name
 
 
+def get_neighbour_offsets(geo_transform, max_distance):
+    """
+    Get the pixel offsets of all neighbours within a distance, where only offsets pointing forward in
+        row-major order are returned (every pair of pixels is found once)
+    :param geo_transform: osgeo.gdal.Dataset.GetGeoTransform() object
+    :param max_distance: FLOAT of the max. distance in the units of the geo_transform
+    :output: numpy.ndarray of shape (n, 2) with (row, column) offsets
+    """
+    # lengths of the pixel column and row vectors (also for rotated geo_transforms)
+    pixel_size = min(np.hypot(geo_transform[1], geo_transform[4]), np.hypot(geo_transform[2], geo_transform[5]))
+    reach = int(np.ceil(max_distance / pixel_size))
+    rows, cols = np.mgrid[0:reach + 1, -reach:reach + 1]
+    offsets = np.column_stack((rows.ravel(), cols.ravel()))
+    offsets = offsets[(offsets[:, 0] > 0) | (offsets[:, 1] > 0)]
+    # keep candidates within max_distance (+ a margin for floating point differences of the exact check)
+    dx = offsets[:, 1] * geo_transform[1] + offsets[:, 0] * geo_transform[2]
+    dy = offsets[:, 1] * geo_transform[4] + offsets[:, 0] * geo_transform[5]
+    return offsets[np.sqrt(dx ** 2 + dy ** 2) <= max_distance * (1.0 + 1e-6)]
+
+
+def get_neighbour_pairs(rows, cols, shape, offsets):
+    """
+    Find all pairs of pixels that are neighbours with a sorted grid index (no pairwise scan of all pixels)
+    :param rows: numpy.ndarray of row indices of the pixels in row-major order (e.g., from np.where)
+    :param cols: numpy.ndarray of column indices of the pixels in row-major order
+    :param shape: TUPLE of the raster (rows, cols)
+    :param offsets: numpy.ndarray of forward (row, column) neighbour offsets (see get_neighbour_offsets)
+    :output: numpy.ndarrays of start and end pixel indices, sorted like itertools.combinations of the pixels
+    """
+    flat_index = rows.astype(np.int64) * shape[1] + cols
+    start_ids = []
+    end_ids = []
+    for offset_row, offset_col in offsets:
+        target_rows = rows + offset_row
+        target_cols = cols + offset_col
+        inside = (target_rows < shape[0]) & (target_cols >= 0) & (target_cols < shape[1])
+        candidates = np.flatnonzero(inside)
+        targets = target_rows[candidates].astype(np.int64) * shape[1] + target_cols[candidates]
+        positions = np.minimum(np.searchsorted(flat_index, targets), flat_index.size - 1)
+        found = flat_index[positions] == targets
+        start_ids.append(candidates[found])
+        end_ids.append(positions[found])
+    start_ids = np.concatenate(start_ids)
+    end_ids = np.concatenate(end_ids)
+    order = np.lexsort((end_ids, start_ids))
+    return start_ids[order], end_ids[order]
+
+
+@traced()
+def mask2polygon(mask_array, out_shp_fn, epsg, geo_info, field_name="values", connectedness=4,
+                 add_area=False, simplify_tolerance=None, dissolve=False, class_labels=None):
+    """
+    Convert a boolean mask (e.g., cHSI >= threshold) to polygons of the True pixels only, where the mask is
+        polygonized from an in-memory raster that is its own GDAL mask band (no intermediate GeoTIFF and
+        no polygons of False or no-data pixels)
+    :param mask_array: numpy.ndarray (bool) of the pixels to polygonize (np.nan compares as False)
+    :param out_shp_fn: STR of a shapefile name (with directory e.g., "C:/temp/poly.shp")
+    :param epsg: INT of the EPSG authority code of the mask
+    :param geo_info: TUPLE defining a gdal.DataSet.GetGeoTransform object of the mask
+    :param field_name: STR of the field where the mask value (1) will be stored (default: "values")
+    :param connectedness: INT of 4 (edge neighbours) or 8 (also diagonal neighbours) pixels forming one
+                                polygon (default: 4 like raster2polygon)
+    :param add_area: BOOL (if True, an "area" field will be added, see add_polygon_areas - default: False)
+    :param simplify_tolerance: FLOAT of the tolerance of simplified polygons in the units of the epsg, where
+                                shared boundaries are only kept with dissolve=True (see modify_polygons)
+                                (default: None does not simplify)
+    :param dissolve: BOOL (if True, all polygons are merged into one multipolygon feature - default: False)
+    :param class_labels: dictionary of {mask value (1): STR class label} written to a "class" field with
+                                add_area=True (e.g., {1: "habitat"}, see add_polygon_areas) - default: None
+    :return: osgeo.ogr.DataSource or None if failed
+    """
+    if connectedness not in (4, 8):
+        print("ERROR: Invalid connectedness (%s) - use 4 or 8." % str(connectedness))
+        return None
+    mask_array = np.asarray(mask_array, dtype=bool)
+
+    # in-memory Byte raster of the mask (zeros are masked out by the raster itself as mask band)
+    try:
+        mask_raster = gdal.GetDriverByName("MEM").Create("", mask_array.shape[1], mask_array.shape[0], 1,
+                                                         gdal.GDT_Byte)
+    except RuntimeError:
+        print("ERROR: Could not create the in-memory mask raster.")
+        return None
+    mask_raster.SetGeoTransform(geo_info)
+    mask_band = mask_raster.GetRasterBand(1)
+    mask_band.WriteArray(mask_array.view(np.uint8))
+
+    new_shp = create_shp(out_shp_fn, layer_name="raster_data", layer_type="polygon")
+    dst_layer = new_shp.GetLayer()
+    dst_layer.CreateField(ogr.FieldDefn(field_name, ogr.OFTInteger))
+    options = ["8CONNECTED=8"] if connectedness == 8 else []
+    gdal.Polygonize(mask_band, mask_band, dst_layer, 0, options, callback=None)
+    mask_raster = None
+
+    if simplify_tolerance or dissolve:
+        modify_polygons(dst_layer, simplify_tolerance=simplify_tolerance, dissolve=dissolve)
+    if add_area:
+        total_area = add_polygon_areas(dst_layer, value_field=field_name, class_labels=class_labels)[1]
+        print(" * info: total area of mask polygons: %s" % str(total_area))
+
+    make_prj(out_shp_fn, int(epsg))
+    print(" * success (Polygonize mask): wrote %s" % str(out_shp_fn))
+    return new_shp
+
+
+def modify_polygons(layer, simplify_tolerance=None, dissolve=False):
+    """
+    Simplify and/or dissolve all polygons of a layer within one transaction, where features are read one-by-one
+        (only their FIDs are kept in memory)
+    :param layer: osgeo.ogr.Layer with (multi)polygon features
+    :param simplify_tolerance: FLOAT of the simplification tolerance - default=None
+                        every feature is simplified separately (SimplifyPreserveTopology keeps each polygon valid),
+                        where boundaries shared by neighbouring features may shift apart (gaps or overlaps) -
+                        with dissolve=True, the merged polygons are simplified as one geometry
+    :param dissolve: BOOL (if True, all polygons are merged into the first feature) - default=False
+    """
+    # without ogr.UseExceptions, OGR returns an error code (e.g., if the driver does not support transactions)
+    try:
+        transaction = layer.StartTransaction() == ogr.OGRERR_NONE
+    except RuntimeError:
+        transaction = False
+    layer.ResetReading()
+    fids = []
+    union = ogr.Geometry(ogr.wkbMultiPolygon) if dissolve else None
+    for feature in layer:
+        fids.append(feature.GetFID())
+        if dissolve:
+            # AddGeometry copies the geometry (the feature is released after this iteration)
+            union.AddGeometry(feature.GetGeometryRef())
+    if dissolve and fids:
+        feature = layer.GetFeature(fids[0])
+        geometry = union.UnionCascaded()
+        if simplify_tolerance:
+            geometry = geometry.SimplifyPreserveTopology(simplify_tolerance)
+        feature.SetGeometry(geometry)
+        layer.SetFeature(feature)
+        for fid in fids[1:]:
+            layer.DeleteFeature(fid)
+    elif simplify_tolerance:
+        for fid in fids:
+            feature = layer.GetFeature(fid)
+            feature.SetGeometry(feature.GetGeometryRef().SimplifyPreserveTopology(simplify_tolerance))
+            layer.SetFeature(feature)
+    if transaction:
+        try:
+            commit_status = layer.CommitTransaction()
+        except RuntimeError:
+            commit_status = None
+        if commit_status != ogr.OGRERR_NONE:
+            print("ERROR: Could not commit the modified polygons.")
+
+
 def raster2line(raster_file_name, out_shp_fn, pixel_value):
     """
     Convert a raster to a line shapefile, where pixel_value determines line start and end points
@@ -42,37 +269,26 @@ def raster2line(raster_file_name, out_shp_fn, pixel_value):
     # calculate max. distance between points
     # ensures correct neighbourhoods for start and end pts of lines
     raster, array, geo_transform = raster2array(raster_file_name)
-    pixel_width = geo_transform[1]
+    pixel_width = np.hypot(geo_transform[1], geo_transform[4])
     max_distance = np.ceil(np.sqrt(2 * pixel_width**2))
 
     # extract pixels with the user-defined pixel value from the raster array
     trajectory = np.where(array == pixel_value)
-    if np.count_nonzero(trajectory) is 0:
+    if trajectory[0].size == 0:
         print("Error: The defined pixel_value (%s) does not occur in the raster band." % str(pixel_value))
         return None
 
-    # convert pixel offset to coordinates and append to nested list of points
-    points = []
-    count = 0
-    for offset_y in trajectory[0]:
-        offset_x = trajectory[1][count]
-        points.append(offset2coords(geo_transform, offset_x, offset_y))
-        count += 1
+    # convert pixel offsets to coordinates (all points at once)
+    points = np.column_stack(offset2coords(geo_transform, trajectory[1], trajectory[0]))
+
+    # link neighbouring points only (grid neighbourhood index rather than all combinations of points)
+    start_ids, end_ids = get_neighbour_pairs(trajectory[0], trajectory[1], array.shape,
+                                             get_neighbour_offsets(geo_transform, max_distance))
+    distances = np.sqrt(np.sum((points[end_ids] - points[start_ids]) ** 2, axis=1))
+    linked = distances < max_distance
 
     # create multiline (write points dictionary to line geometry (wkbMultiLineString)
-    multi_line = ogr.Geometry(ogr.wkbMultiLineString)
-    for i in itertools.combinations(points, 2):
-        point1 = ogr.Geometry(ogr.wkbPoint)
-        point1.AddPoint(i[0][0], i[0][1])
-        point2 = ogr.Geometry(ogr.wkbPoint)
-        point2.AddPoint(i[1][0], i[1][1])
-
-        distance = point1.Distance(point2)
-        if distance < max_distance:
-            line = ogr.Geometry(ogr.wkbLineString)
-            line.AddPoint(i[0][0], i[0][1])
-            line.AddPoint(i[1][0], i[1][1])
-            multi_line.AddGeometry(line)
+    multi_line = multiline_from_points(points[start_ids[linked]], points[end_ids[linked]])
 
     # write multiline (wkbMultiLineString2shp) to shapefile
     new_shp = create_shp(out_shp_fn, layer_name="raster_pts", layer_type="line")
@@ -88,8 +304,10 @@ def raster2line(raster_file_name, out_shp_fn, pixel_value):
     print(" * success (raster2line): wrote %s" % str(out_shp_fn))
 
 
+@traced()
 def raster2polygon(file_name, out_shp_fn, band_number=1, field_name="values",
-                   add_area=False):
+                   add_area=False, int_file_name=None, mask_threshold=None, connectedness=4, class_labels=None,
+                   simplify_tolerance=None, dissolve=False):
     """
     Convert a raster to polygon
     :param file_name: STR of target file name, including directory; must end on ".tif"
@@ -97,11 +315,37 @@ def raster2polygon(file_name, out_shp_fn, band_number=1, field_name="values",
     :param band_number: INT of the raster band number to open (default: 1)
     :param field_name: STR of the field where raster pixel values will be stored (default: "values")
     :param add_area: BOOL (if True, an "area" field will be added, where the area
-                                in the shapefiles unit system is calculated - default: False)
+                                in the shapefiles unit system is calculated (see add_polygon_areas) - default: False)
+    :param int_file_name: STR of the intermediate integer raster (e.g., "/vsimem/poly_int.tif" keeps it
+                                in memory) - default: None writes file_name + "_int.tif" (see float2int)
+    :param mask_threshold: FLOAT - if provided, only pixels >= mask_threshold are polygonized from an in-memory
+                                mask without an intermediate integer raster (see mask2polygon) - default: None
+    :param connectedness: INT of 4 or 8 neighbour pixels forming one polygon (default: 4)
+    :param class_labels: dictionary of {pixel value: STR class label} written to a "class" field with
+                                add_area=True (see add_polygon_areas) - default: None
+    :param simplify_tolerance: FLOAT of the tolerance of simplified polygons (only with mask_threshold, see
+                                mask2polygon) - default: None does not simplify
+    :param dissolve: BOOL (if True, all polygons are merged into one multipolygon feature, only with
+                                mask_threshold, see mask2polygon) - default: False
     :return: osgeo.ogr.DataSource
     """
+    if mask_threshold is not None:
+        raster, raster_band = open_raster(file_name, band_number=band_number)
+        src_srs = get_srs(raster)
+        if not src_srs:
+            return None
+        # the mask (1 byte per pixel) is built block-by-block without reading the entire band into memory
+        mask_array = np.zeros((raster.RasterYSize, raster.RasterXSize), dtype=bool)
+        for x_off, y_off, x_size, y_size in get_block_windows(raster_band):
+            with np.errstate(invalid="ignore"):
+                np.greater_equal(band2array(raster_band, window=(x_off, y_off, x_size, y_size)), mask_threshold,
+                                 out=mask_array[y_off:y_off + y_size, x_off:x_off + x_size])
+        return mask2polygon(mask_array, out_shp_fn, int(src_srs.GetAuthorityCode(None)), raster.GetGeoTransform(),
+                            field_name=field_name, connectedness=connectedness, add_area=add_area,
+                            simplify_tolerance=simplify_tolerance, dissolve=dissolve, class_labels=class_labels)
+
     # ensure that the input raster contains integer values only and open the input raster
-    file_name = float2int(file_name)
+    file_name = float2int(file_name, new_name=int_file_name)
     raster, raster_band = open_raster(file_name, band_number=band_number)
 
     # create new shapefile with the create_shp function
@@ -113,7 +357,11 @@ def raster2polygon(file_name, out_shp_fn, band_number=1, field_name="values",
     dst_layer.CreateField(new_field)
 
     # Polygonize(band, hMaskBand[optional]=None, destination lyr, field ID, papszOptions=[], callback=None)
-    gdal.Polygonize(raster_band, None, dst_layer, 0, [], callback=None)
+    options = ["8CONNECTED=8"] if connectedness == 8 else []
+    gdal.Polygonize(raster_band, None, dst_layer, 0, options, callback=None)
+    if add_area:
+        total_area = add_polygon_areas(dst_layer, value_field=field_name, class_labels=class_labels)[1]
+        print(" * info: total area of polygons with non-zero values: %s" % str(total_area))
 
     # create projection file
     srs = get_srs(raster)
@@ -122,6 +370,45 @@ def raster2polygon(file_name, out_shp_fn, band_number=1, field_name="values",
     return new_shp
 
 
+def sample_raster(raster_file_name, x_coords, y_coords, band_number=1):
+    """
+    Get raster values at coordinates (e.g., gauge locations), where only the (natural) raster blocks that
+        contain points are read, one block at a time
+    :param raster_file_name: STR of input raster file name, including directory; must end on ".tif"
+    :param x_coords: FLOAT or numpy.ndarray of x-coordinates
+    :param y_coords: FLOAT or numpy.ndarray of y-coordinates
+    :param band_number: INT of the raster band number to open (default: 1)
+    :return: numpy.ndarray of raster values (np.nan for no-data values and coordinates outside of the raster)
+    """
+    raster, band = open_raster(raster_file_name, band_number=band_number)
+    pixels = coords2pixel(raster.GetGeoTransform(), np.atleast_1d(x_coords), np.atleast_1d(y_coords))
+    if pixels is None:
+        return None
+    cols = np.floor(pixels[0]).astype(np.int64)
+    rows = np.floor(pixels[1]).astype(np.int64)
+    inside = (cols >= 0) & (cols < raster.RasterXSize) & (rows >= 0) & (rows < raster.RasterYSize)
+
+    values = np.full(cols.shape, np.nan)
+    if not np.any(inside):
+        return values
+    cols, rows = cols[inside], rows[inside]
+    block_x, block_y = band.GetBlockSize()
+    n_block_cols = -(-raster.RasterXSize // block_x)
+    # group the points by block (a window around distant points could cover almost the entire raster)
+    block_ids = (rows // block_y) * n_block_cols + cols // block_x
+    order = np.argsort(block_ids, kind="stable")
+    block_list, starts = np.unique(block_ids[order], return_index=True)
+    inside_values = np.empty(cols.shape)
+    for block_id, point_ids in zip(block_list, np.split(order, starts[1:])):
+        x_off = int(block_id % n_block_cols) * block_x
+        y_off = int(block_id // n_block_cols) * block_y
+        window = (x_off, y_off, min(block_x, raster.RasterXSize - x_off), min(block_y, raster.RasterYSize - y_off))
+        block_array = band2array(band, window=window)
+        inside_values[point_ids] = block_array[rows[point_ids] - y_off, cols[point_ids] - x_off]
+    values[inside] = inside_values
+    return values
+
+
 def rasterize(in_shp_file_name, out_raster_file_name, pixel_size=10, no_data_value=-9999,
               rdtype=gdal.GDT_Float32, **kwargs):
     """
@@ -1,3 +1,36 @@
 import numpy as np
+import os
+import tempfile
 
 nan_value = 0.0
+
+# max. number of vertices per batched coordinate transformation (see reproject_shapefile)
+transform_batch_size = 2 ** 16
+
+# max. number of cached spatial references and on-disk registry of ESRI WKT strings (pre-warms the SRS cache)
+srs_cache_size = 256
+srs_registry_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "srs_registry.json")
+
+# working memory (MB) and number of threads of gdal.Warp (see reproject_raster)
+warp_memory_limit = 512
+warp_threads = "ALL_CPUS"
+
+# GeoTIFF creation option profiles (see get_creation_options), where compressed profiles get a predictor
+# that fits the raster data type (3 for floating point, 2 for integer rasters)
+gtiff_profiles = {"default": [],
+                  "tiled": ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256"],
+                  "deflate": ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "COMPRESS=DEFLATE", "ZLEVEL=6"],
+                  "zstd": ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "COMPRESS=ZSTD", "ZSTD_LEVEL=9"],
+                  "lzw": ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "COMPRESS=LZW"],
+                  "bigtiff": ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "COMPRESS=DEFLATE", "ZLEVEL=6",
+                              "BIGTIFF=YES"]}
+# overview (pyramid) levels and resampling method of GeoTIFFs written with overviews=True
+overview_levels = [2, 4, 8, 16, 32]
+overview_resampling = "AVERAGE"
+
+# max. number of raster windows (tiles) read ahead or waiting to be written by background threads
+# (see prefetch and WriteBehind) - 0 reads and writes synchronously
+io_buffers = 2
+
+# folder of memory-map sidecars (see band2memmap) of rasters whose directory is not writable
+memmap_cache_folder = os.path.join(tempfile.gettempdir(), "__memmap_cache__")
@@ -0,0 +1,238 @@
+import numpy as np
+import os
+import json
+import threading
+import time
+from functools import wraps
+
+try:
+    # peak resident set size of the process (not available on Windows)
+    import resource
+except ImportError:
+    resource = None
+
+# the trace is enabled by an environment variable with the output file name (e.g., HABITAT_TRACE=trace.jsonl),
+# where HABITAT_TRACE_FORMAT defines the format: "jsonl" (one JSON record per stage) or "chrome" (trace event
+# array for chrome://tracing or https://ui.perfetto.dev) - without HABITAT_TRACE, traced functions are not wrapped
+trace_file = os.environ.get("HABITAT_TRACE")
+trace_format = os.environ.get("HABITAT_TRACE_FORMAT", "jsonl").lower()
+if trace_file is not None:
+    # sub-processes (e.g., of make_chsi_parallel) inherit the process id of the main process and write to
+    # trace_file + ".PID" (see write_trace_record)
+    os.environ.setdefault("HABITAT_TRACE_PID", str(os.getpid()))
+
+_trace = {"file": None, "pid": None, "lock": threading.Lock(), "t0": time.perf_counter(), "depth": threading.local()}
+
+
+class TraceStage:
+    def __init__(self, name, pixels=0, **args):
+        """
+        Context manager that records the wall time, CPU time (of the calling thread), bytes read/written (Linux),
+            pixels, and resident set size (at entry and exit, and the growth of the process peak) of a processing
+            stage (e.g., with TraceStage("make_hsi", pixels=array.size): ...)
+        :param name: STR of the stage name
+        :param pixels: INT of the number of processed pixels (can be increased with add)
+        :param args: further (JSON serializable) information about the stage (e.g., file="u.tif")
+        """
+        self.name = name
+        self.pixels = int(pixels)
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.args = args
+
+    def __enter__(self):
+        self.depth = getattr(_trace["depth"], "value", 0)
+        _trace["depth"].value = self.depth + 1
+        self._io = get_io_counters()
+        self._memory = get_memory_usage()
+        # CPU time of this thread only (background I/O threads run concurrently, see prefetch and WriteBehind)
+        self._cpu = time.thread_time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_time = time.perf_counter() - self._start
+        cpu_time = time.thread_time() - self._cpu
+        io = get_io_counters()
+        memory = get_memory_usage()
+        _trace["depth"].value = self.depth
+        if io is not None and self._io is not None:
+            self.bytes_read += io[0] - self._io[0]
+            self.bytes_written += io[1] - self._io[1]
+        write_trace_record({"name": self.name,
+                            "start": self._start - _trace["t0"],
+                            "wall_time": wall_time,
+                            "cpu_time": cpu_time,
+                            "bytes_read": self.bytes_read,
+                            "bytes_written": self.bytes_written,
+                            "pixels": self.pixels,
+                            "rss_start_mb": self._memory[0],
+                            "rss_end_mb": memory[0],
+                            # > 0 if the stage raised the peak RSS of the process (by this amount)
+                            "peak_rss_increase_mb": get_difference(memory[1], self._memory[1]),
+                            "process_peak_rss_mb": memory[1],
+                            "depth": self.depth,
+                            "thread": threading.get_ident(),
+                            "error": None if exc_type is None else exc_type.__name__,
+                            "args": self.args})
+        return False
+
+    def add(self, pixels=0, bytes_read=0, bytes_written=0):
+        """
+        Add processed pixels (or bytes that are not counted by the operating system, e.g., /vsimem/ files)
+        """
+        self.pixels += int(pixels)
+        self.bytes_read += int(bytes_read)
+        self.bytes_written += int(bytes_written)
+
+
+class _NoStage:
+    """
+    Stage without recording (returned by trace_stage if tracing is disabled)
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def add(self, pixels=0, bytes_read=0, bytes_written=0):
+        pass
+
+
+_no_stage = _NoStage()
+
+
+def count_pixels(*objects):
+    """
+    Get the size of the first numpy.ndarray in objects (also within tuples and lists, e.g., of raster2array)
+    :param objects: any objects (e.g., function arguments and return values)
+    :output: INT of the number of pixels (0 if there is no array)
+    """
+    for obj in objects:
+        if isinstance(obj, np.ndarray):
+            return obj.size
+        if isinstance(obj, (tuple, list)):
+            for item in obj:
+                if isinstance(item, np.ndarray):
+                    return item.size
+    return 0
+
+
+def get_io_counters():
+    """
+    Get the bytes read and written by the process (storage layer, Linux only)
+    :output: TUPLE of (INT bytes read, INT bytes written) or None if not available
+    """
+    try:
+        with open("/proc/self/io", mode="r") as file:
+            counters = dict(line.split(": ") for line in file.read().splitlines())
+        return int(counters["read_bytes"]), int(counters["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def get_difference(end_value, start_value):
+    """
+    Get the difference of two values that may not be available
+    :output: FLOAT or None if a value is None
+    """
+    if end_value is None or start_value is None:
+        return None
+    return end_value - start_value
+
+
+def get_memory_usage():
+    """
+    Get the current and the peak (high-water mark) resident set size of the process
+    :output: TUPLE of (FLOAT current RSS, FLOAT peak RSS) in MB, where unavailable values are None
+    """
+    try:
+        with open("/proc/self/status", mode="r") as file:
+            status = dict(line.split(":", 1) for line in file.read().splitlines() if ":" in line)
+        # values are in kB (e.g., "VmRSS:    123456 kB")
+        return int(status["VmRSS"].split()[0]) / 1024.0, int(status["VmHWM"].split()[0]) / 1024.0
+    except (OSError, KeyError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None, None
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    return None, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def reset_peak_memory():
+    """
+    Reset the peak (high-water mark) resident set size of the process to the current RSS (Linux only), so that
+        get_memory_usage returns the peak of the following stage rather than the peak of the process
+    :output: BOOL (True if the peak was reset)
+    """
+    try:
+        with open("/proc/self/clear_refs", mode="w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def trace_stage(name, pixels=0, **args):
+    """
+    Get a TraceStage context manager if tracing is enabled (HABITAT_TRACE environment variable)
+    :param name: STR of the stage name
+    :param pixels: INT of the number of processed pixels
+    :param args: further (JSON serializable) information about the stage
+    :output: TraceStage or a stage that does not record anything
+    """
+    if trace_file is None:
+        return _no_stage
+    return TraceStage(name, pixels=pixels, **args)
+
+
+def traced(name=None):
+    """
+    Decorator that records every call of a function as TraceStage, where the processed pixels are the size
+        of the first numpy.ndarray returned (or passed as argument) - functions are not wrapped at all if
+        tracing is disabled (HABITAT_TRACE environment variable)
+    :param name: STR of the stage name - default=None uses the function name
+    :output: decorator
+    """
+    def decorator(fun):
+        if trace_file is None:
+            return fun
+
+        @wraps(fun)
+        def wrapper(*args, **kwargs):
+            with TraceStage(name or fun.__name__) as stage:
+                result = fun(*args, **kwargs)
+                stage.add(pixels=count_pixels(result) or count_pixels(*args, *kwargs.values()))
+            return result
+        return wrapper
+    return decorator
+
+
+def write_trace_record(record):
+    """
+    Append a stage record to the trace file (thread-safe, flushed after every record)
+    :param record: dictionary of stage information (see TraceStage.__exit__)
+    """
+    with _trace["lock"]:
+        if _trace["pid"] != os.getpid():
+            # first record of this process
+            file_name = trace_file
+            if os.environ.get("HABITAT_TRACE_PID") != str(os.getpid()):
+                file_name = "%s.%i" % (trace_file, os.getpid())
+            _trace["file"] = open(file_name, mode="w")
+            _trace["pid"] = os.getpid()
+            if trace_format == "chrome":
+                # the closing bracket of the JSON array is optional in the trace event format
+                _trace["file"].write("[\n")
+        if trace_format == "chrome":
+            args = {key: value for key, value in record.items()
+                    if key not in ("name", "start", "wall_time", "thread", "args")}
+            args.update(record["args"])
+            line = json.dumps({"name": record["name"], "ph": "X", "pid": os.getpid(), "tid": record["thread"],
+                               "ts": record["start"] * 1e6, "dur": record["wall_time"] * 1e6, "args": args},
+                              default=str) + ",\n"
+        else:
+            line = json.dumps(record, default=str) + "\n"
+        _trace["file"].write(line)
+        _trace["file"].flush()
@@ -1,6 +1,93 @@
 import gdal
 import osr
 from .geoconfig import *
+from .instrumentation import *
+import glob
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+
+# numpy dtypes of GDAL data types
+gdal2numpy_types = {gdal.GDT_Byte: np.uint8, gdal.GDT_UInt16: np.uint16, gdal.GDT_Int16: np.int16,
+                    gdal.GDT_UInt32: np.uint32, gdal.GDT_Int32: np.int32, gdal.GDT_Float32: np.float32,
+                    gdal.GDT_Float64: np.float64}
+
+# dtype policies of raster arrays: numpy dtype in memory, GDAL data type on disk, and quantization, where
+# uint8/uint16 store values between 0.0 and 1.0 (e.g., HSI) as integer codes with scale/offset metadata
+# and the highest code as no-data value (see quantize and dequantize)
+dtype_policies = {"float64": {"dtype": np.float64, "rdtype": gdal.GDT_Float32, "quantized": False},
+                  "float32": {"dtype": np.float32, "rdtype": gdal.GDT_Float32, "quantized": False},
+                  "uint8": {"dtype": np.float32, "rdtype": gdal.GDT_Byte, "quantized": True,
+                            "code_dtype": np.uint8, "nan_val": 255, "scale": 1.0 / 254.0, "offset": 0.0},
+                  "uint16": {"dtype": np.float32, "rdtype": gdal.GDT_UInt16, "quantized": True,
+                             "code_dtype": np.uint16, "nan_val": 65535, "scale": 1.0 / 65534.0, "offset": 0.0}}
+
+
+class WriteBehind:
+    def __init__(self, max_in_flight=io_buffers):
+        """
+        Write-behind queue of write_window calls, which are executed by a background thread while the next
+            window is calculated (use as context manager: with WriteBehind() as writer: writer.write(...))
+        :param max_in_flight: INT of the max. number of queued arrays (write blocks if the queue is full, which
+                                caps the memory) - default=io_buffers (geoconfig); 0 writes synchronously
+        """
+        self.max_in_flight = max_in_flight
+        self.error = None
+        self._queue = queue.Queue(maxsize=max(1, max_in_flight))
+        self._thread = None
+        if max_in_flight > 0:
+            self._thread = threading.Thread(target=self._work, daemon=True)
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        """
+        Write all queued windows and stop the background thread (raises errors of the background thread)
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+    def write(self, band, raster_array, window=None, **kwargs):
+        """
+        Queue a write_window call (raster_array must not be modified afterwards)
+        :param band: osgeo.gdal.Band
+        :param raster_array: np.array of values to write
+        :param window: TUPLE of (x_offset, y_offset, x_size, y_size) in pixels
+        :param kwargs: further arguments of write_window (nan_val, dtype_policy, valid_mask)
+        """
+        self._raise_error()
+        if self._thread is None:
+            write_window(band, raster_array, window=window, **kwargs)
+        else:
+            self._queue.put((band, raster_array, window, kwargs))
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if self.error is None:
+                try:
+                    write_window(job[0], job[1], window=job[2], **job[3])
+                except Exception as e:
+                    # the error is raised in the calling thread with the next write or close
+                    self.error = e
 
 
 def open_raster(file_name, band_number=1):
@@ -28,8 +115,147 @@ def open_raster(file_name, band_number=1):
     return raster, raster_band
 
 
+def band2array(band, window=None, dtype=None, use_mask=False):
+    """
+    Read a (windowed) numpy.array from a raster band
+    :param band: osgeo.gdal.Band
+    :param window: TUPLE of (x_offset, y_offset, x_size, y_size) in pixels - default=None reads the entire band
+    :param dtype: numpy float dtype of the output array (e.g., np.float32) - default=None uses np.float64
+    :param use_mask: BOOL - if True, no-data pixels are defined by the GDAL mask band (see get_valid_mask)
+                        rather than by the no-data value - default=False
+    :output: ndarray() of the band (window), where no-data values are replaced with np.nan and
+                scale/offset metadata (quantized rasters) are applied
+    """
+    try:
+        # read array data from band (ReadAsArray(xoff, yoff, xsize, ysize) if a window is provided)
+        if window is None:
+            band_array = band.ReadAsArray()
+        else:
+            band_array = band.ReadAsArray(*window)
+    except AttributeError:
+        print("ERROR: Could not read array of raster band type=%s." % str(type(band)))
+        return None
+    try:
+        valid_mask = get_valid_mask(band, window=window) if use_mask else None
+        return mask_nodata(band_array, band.GetNoDataValue(), scale=band.GetScale(), offset=band.GetOffset(),
+                           dtype=dtype, copy=False, valid_mask=valid_mask)
+    except AttributeError:
+        print("ERROR: Could not get NoDataValue of raster band type=%s." % str(type(band)))
+        return None
+
+
+def band2memmap(raster, band_number=1, sidecar=True):
+    """
+    Get a read-only numpy.memmap of the raw pixel values of a raster band without reading the band (zero-copy),
+        which works directly on single-band, uncompressed, and striped GeoTIFFs with contiguous strips, or
+        on a .npy sidecar file (written once next to the raster and renewed when the raster changes)
+    :param raster: osgeo.gdal.Dataset of a raster file on disk
+    :param band_number: INT of the raster band number to open (default: 1)
+    :param sidecar: BOOL - if True (default), a .npy sidecar is used if the GeoTIFF cannot be mapped directly
+    :output: numpy.memmap of raw band values (no-data values are not replaced, see mask_nodata) or None
+    """
+    file_name = raster.GetDescription()
+    band = raster.GetRasterBand(band_number)
+    try:
+        dtype = np.dtype(gdal2numpy_types[band.DataType])
+    except KeyError:
+        print("ERROR: Unsupported raster data type (%s)." % str(band.DataType))
+        return None
+    shape = (raster.RasterYSize, raster.RasterXSize)
+
+    data_offset = get_contiguous_data_offset(raster, band)
+    if data_offset is not None:
+        # the GeoTIFF header defines the byte order ("II" = little endian, "MM" = big endian)
+        with open(file_name, mode="rb") as file:
+            byte_order = "<" if file.read(2) == b"II" else ">"
+        return np.memmap(file_name, dtype=dtype.newbyteorder(byte_order), mode="r", offset=data_offset, shape=shape)
+    if not sidecar:
+        return None
+
+    # the sidecar file name contains a fingerprint (size and modification time) of the raster file
+    try:
+        stat = os.stat(file_name)
+        fingerprint = "%x%x" % (stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        print("WARNING: Cannot memory-map %s (not a file on disk)." % str(file_name))
+        return None
+    # sidecars are written next to the raster or, if its directory is not writable, to the memmap_cache_folder
+    sidecar_prefixes = [file_name, get_sidecar_cache_prefix(file_name)]
+    sidecar_names = ["{0}.b{1}_{2}.npy".format(prefix, band_number, fingerprint) for prefix in sidecar_prefixes]
+    for sidecar_name in sidecar_names:
+        if os.path.isfile(sidecar_name):
+            return np.load(sidecar_name, mmap_mode="r")
+
+    for prefix, sidecar_name in zip(sidecar_prefixes, sidecar_names):
+        try:
+            write_sidecar(band, sidecar_name, dtype, shape)
+        except OSError as e:
+            # the directory is not writable (or full) - try the next location
+            print("WARNING: Cannot write the memory-map sidecar %s (%s)." % (sidecar_name, str(e)))
+            continue
+        except RuntimeError as e:
+            print("WARNING: Cannot write the memory-map sidecar of %s." % str(file_name))
+            print(e)
+            return None
+        # remove outdated sidecars (other processes may still map them)
+        for old_sidecar in glob.glob(glob.escape(prefix) + ".b%i_*.npy" % band_number):
+            if old_sidecar != sidecar_name:
+                try:
+                    os.remove(old_sidecar)
+                except OSError:
+                    pass
+        return np.load(sidecar_name, mmap_mode="r")
+    return None
+
+
+def get_sidecar_cache_prefix(file_name):
+    """
+    Get the file name prefix of memory-map sidecars in the memmap_cache_folder (see band2memmap), which
+        contains a hash of the absolute raster file name (rasters with the same name in different directories)
+    :param file_name: STR of a raster file name
+    :output: STR of the sidecar prefix (directory and name without the band and fingerprint suffix)
+    """
+    path_hash = hashlib.sha1(os.path.abspath(file_name).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(memmap_cache_folder, "%s_%s" % (path_hash, os.path.basename(file_name)))
+
+
+def write_sidecar(band, sidecar_name, dtype, shape):
+    """
+    Write a raster band window-by-window to a .npy sidecar file through a unique temporary file in the same
+        directory, which replaces the sidecar only when it is complete (interrupted runs and concurrent
+        processes never map partial files)
+    :param band: osgeo.gdal.Band
+    :param sidecar_name: STR of the .npy file name (the directory is created if required)
+    :param dtype: numpy.dtype of the raw band values
+    :param shape: TUPLE of (rows, cols)
+    :raises OSError: if the sidecar cannot be written (e.g., read-only directory)
+    :raises RuntimeError: if the band cannot be read
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(sidecar_name)), exist_ok=True)
+    temp_name = None
+    sidecar_array = None
+    try:
+        file_handle, temp_name = tempfile.mkstemp(suffix=".tmp", prefix=os.path.basename(sidecar_name) + ".",
+                                                  dir=os.path.dirname(os.path.abspath(sidecar_name)))
+        os.close(file_handle)
+        sidecar_array = np.lib.format.open_memmap(temp_name, mode="w+", dtype=dtype, shape=shape)
+        for window in get_block_windows(band):
+            sidecar_array[window[1]:window[1] + window[3],
+                          window[0]:window[0] + window[2]] = band.ReadAsArray(*window)
+        sidecar_array.flush()
+        sidecar_array = None
+        os.replace(temp_name, sidecar_name)
+    finally:
+        # release the memmap before the temporary file is removed (open maps cannot be removed on Windows)
+        sidecar_array = None
+        if temp_name is not None and os.path.isfile(temp_name):
+            os.remove(temp_name)
+
+
+@traced()
 def create_raster(file_name, raster_array, origin=None, epsg=4326, pixel_width=10, pixel_height=10,
-                  nan_val=nan_value, rdtype=gdal.GDT_Float32, geo_info=False):
+                  nan_val=nan_value, rdtype=gdal.GDT_Float32, geo_info=False, dtype_policy=None,
+                  profile=None, overviews=False, valid_mask=None):
     """
     Convert a numpy.array to a GeoTIFF raster with the following parameters
     :param file_name: STR of target file name, including directory; must end on ".tif"
@@ -43,52 +269,114 @@ def create_raster(file_name, raster_array, origin=None, epsg=4326, pixel_width=1
     :param rdtype: gdal.GDALDataType raster data type - default=gdal.GDT_Float32 (32 bit floating point)
     :param geo_info: TUPLE defining a gdal.DataSet.GetGeoTransform object (supersedes origin, pixel_width, pixel_height)
                         default=False
+    :param dtype_policy: STR of a dtype_policies key (supersedes rdtype) - "uint8" and "uint16" write quantized values
+                        with scale/offset metadata - default=None
+    :param profile: STR of a gtiff_profiles key (e.g., "deflate" for tiled and compressed GeoTIFFs) or list of
+                        GTiff creation options - default=None (striped and uncompressed)
+    :param overviews: BOOL - if True, overviews (overview_levels) are added to the GeoTIFF - default=False
+    :param valid_mask: np.array (bool) of valid pixels, which is written as GDAL mask band instead of
+                        setting a no-data value (nan_val pixels remain valid) - default=None
     :return new_raster: osgeo.gdal.Dataset (uses GTiff driver)
     """
-    gdal.UseExceptions()
-    # check out driver
-    driver = gdal.GetDriverByName("GTiff")
-
     # create raster dataset with number of cols and rows of the input array
     try:
         cols = raster_array.shape[1]
         rows = raster_array.shape[0]
-    except TypeError:
+    except (AttributeError, TypeError):
         print("ERROR: Provided array is not a numpy.ndarray.")
         return -1
 
+    new_raster = create_raster_dataset(file_name, cols, rows, origin=origin, epsg=epsg,
+                                       pixel_width=pixel_width, pixel_height=pixel_height,
+                                       nan_val=nan_val, rdtype=rdtype, geo_info=geo_info,
+                                       dtype_policy=dtype_policy, profile=profile,
+                                       mask_band=valid_mask is not None)
+    if new_raster is None:
+        return -1
+
+    # retrieve band number 1 and write the array (np.nan values are replaced with nan_val)
+    band = new_raster.GetRasterBand(1)
+    write_window(band, raster_array, nan_val=nan_val, dtype_policy=dtype_policy, valid_mask=valid_mask)
+
+    # release raster band
+    band.FlushCache()
+    if overviews:
+        return build_overviews(new_raster)
+    return 0
+
+
+def create_raster_dataset(file_name, cols, rows, origin=None, epsg=4326, pixel_width=10, pixel_height=10,
+                          nan_val=nan_value, rdtype=gdal.GDT_Float32, geo_info=False, dtype_policy=None,
+                          profile=None, mask_band=False):
+    """
+    Create an empty GeoTIFF raster (e.g., to write it window-by-window with write_window)
+    :param file_name: STR of target file name, including directory; must end on ".tif"
+    :param cols: INT of the number of columns
+    :param rows: INT of the number of rows
+    :param origin: TUPLE of (x, y) origin coordinates
+    :param epsg: INT of EPSG:XXXX projection to use - default=4326
+    :param pixel_height: INT of pixel height (multiple of unit defined with the EPSG number) - default=10m
+    :param pixel_width: INT of pixel width (multiple of unit defined with the EPSG number) - default=10m
+    :param nan_val: INT/FLOAT no-data value to be used in the raster - default=nan_value
+    :param rdtype: gdal.GDALDataType raster data type - default=gdal.GDT_Float32 (32 bit floating point)
+    :param geo_info: TUPLE defining a gdal.DataSet.GetGeoTransform object (supersedes origin, pixel_width, pixel_height)
+                        default=False
+    :param dtype_policy: STR of a dtype_policies key (supersedes rdtype) - "uint8" and "uint16" rasters get
+                        scale/offset metadata and the no-data value of the policy - default=None
+    :param profile: STR of a gtiff_profiles key (e.g., "deflate" for tiled and compressed GeoTIFFs) or list of
+                        GTiff creation options - default=None (striped and uncompressed)
+    :param mask_band: BOOL - if True, the raster gets a GDAL mask band (see write_window) instead of a
+                        no-data value, which keeps nan_val pixels (e.g., HSI=0.0) valid - default=False
+    :return new_raster: osgeo.gdal.Dataset (uses GTiff driver) or None if failed
+    """
+    gdal.UseExceptions()
+    policy = get_dtype_policy(dtype_policy)
+    if dtype_policy:
+        rdtype = policy["rdtype"]
+    # check out driver
+    driver = gdal.GetDriverByName("GTiff")
+
     try:
-        new_raster = driver.Create(file_name, cols, rows, 1, eType=rdtype)
+        new_raster = driver.Create(file_name, cols, rows, 1, eType=rdtype,
+                                   options=get_creation_options(profile, rdtype))
     except RuntimeError as e:
         print("ERROR: Could not create %s." % str(file_name))
-        return -1
-    # replace np.nan values
-    raster_array[np.isnan(raster_array)] = nan_val
+        return None
 
     # apply geo-origin and pixel dimensions
     if not geo_info:
         try:
             origin_x = origin[0]
             origin_y = origin[1]
-        except IndexError:
+        except (IndexError, TypeError):
             print("ERROR: Wrong origin format (required: (INT, INT) - provided: %s)." % str(origin))
-            return -1
+            return None
         try:
             new_raster.SetGeoTransform((origin_x, pixel_width, 0, origin_y, 0, pixel_height))
         except RuntimeError as e:
             print("ERROR: Invalid origin (must be INT) or pixel_height/pixel_width (must be INT) provided.")
-            return -1
+            return None
     else:
         try:
             new_raster.SetGeoTransform(geo_info)
         except RuntimeError as e:
             print(e)
-            return -1
+            return None
 
-    # retrieve band number 1
-    band = new_raster.GetRasterBand(1)
-    band.SetNoDataValue(nan_val)
-    band.WriteArray(raster_array)
+    # set the no-data value of band number 1 (and the scale/offset of quantized rasters)
+    if policy["quantized"]:
+        new_raster.GetRasterBand(1).SetNoDataValue(policy["nan_val"])
+        new_raster.GetRasterBand(1).SetScale(policy["scale"])
+        new_raster.GetRasterBand(1).SetOffset(policy["offset"])
+    elif not mask_band:
+        new_raster.GetRasterBand(1).SetNoDataValue(nan_val)
+    if mask_band:
+        try:
+            new_raster.CreateMaskBand(gdal.GMF_PER_DATASET)
+        except RuntimeError as e:
+            print("ERROR: Could not create the mask band of %s." % str(file_name))
+            print(e)
+            return None
 
     # create projection and assign to raster
     srs = osr.SpatialReference()
@@ -96,34 +384,258 @@ def create_raster(file_name, raster_array, origin=None, epsg=4326, pixel_width=1
         srs.ImportFromEPSG(epsg)
     except RuntimeError as e:
         print(e)
-        return -1
+        return None
     new_raster.SetProjection(srs.ExportToWkt())
+    return new_raster
 
-    # release raster band
-    band.FlushCache()
+
+def build_overviews(raster, levels=None, resampling=overview_resampling):
+    """
+    Add overviews (reduced resolution pyramids) to a raster dataset, e.g., for fast display in QGIS
+    :param raster: osgeo.gdal.Dataset (opened in update mode)
+    :param levels: list of INT overview levels - default=None uses overview_levels (geoconfig)
+    :param resampling: STR of the resampling method - default=overview_resampling (geoconfig)
+    :output: 0 = success; -1 = failed
+    """
+    try:
+        raster.BuildOverviews(resampling, levels or overview_levels)
+    except RuntimeError as e:
+        print("WARNING: Could not build overviews.")
+        print(e)
+        return -1
     return 0
 
 
-def raster2array(file_name, band_number=1):
+def dequantize(code_array, dtype_policy, dtype=np.float32):
+    """
+    Convert integer codes of a quantized dtype policy back to float values
+    :param code_array: numpy.ndarray of integer codes (see quantize)
+    :param dtype_policy: STR of a quantized dtype_policies key ("uint8" or "uint16")
+    :param dtype: numpy float dtype of the output array - default=np.float32
+    :output: numpy.ndarray of float values, where no-data codes are np.nan
+    """
+    policy = get_dtype_policy(dtype_policy)
+    float_array = code_array * dtype(policy["scale"]) + dtype(policy["offset"])
+    float_array = float_array.astype(dtype, copy=False)
+    float_array[code_array == policy["nan_val"]] = np.nan
+    return float_array
+
+
+def get_block_windows(band, max_pixels=2 ** 22):
+    """
+    Get GDAL block-aligned windows of a raster band for reading/writing the band tile-by-tile
+    :param band: osgeo.gdal.Band
+    :param max_pixels: INT of the max. number of pixels per window (tile budget) - default=2**22
+    :output: list of TUPLEs (x_offset, y_offset, x_size, y_size) that can be used with band2array and write_window
+    """
+    block_x, block_y = band.GetBlockSize()
+    cols, rows = band.XSize, band.YSize
+    # number of blocks fitting into one window (at least one block)
+    n_blocks = max(1, int(max_pixels // (block_x * block_y)))
+    blocks_x = max(1, min(int(np.ceil(cols / block_x)), n_blocks))
+    blocks_y = max(1, n_blocks // blocks_x)
+    window_x = blocks_x * block_x
+    window_y = blocks_y * block_y
+
+    windows = []
+    for y_offset in range(0, rows, window_y):
+        for x_offset in range(0, cols, window_x):
+            windows.append((x_offset, y_offset, min(window_x, cols - x_offset), min(window_y, rows - y_offset)))
+    return windows
+
+
+def get_contiguous_data_offset(raster, band):
+    """
+    Get the byte offset of the pixel data of a GeoTIFF that can be memory-mapped as a whole
+        (single band, uncompressed, striped, and all strips written one after another)
+    :param raster: osgeo.gdal.Dataset
+    :param band: osgeo.gdal.Band
+    :output: INT of the byte offset of the first strip (or None if the pixel data is not contiguous)
+    """
+    file_name = raster.GetDescription()
+    if not os.path.isfile(file_name) or raster.RasterCount != 1:
+        return None
+    if raster.GetMetadataItem("COMPRESSION", "IMAGE_STRUCTURE"):
+        return None
+    block_x, block_y = band.GetBlockSize()
+    if block_x != raster.RasterXSize:
+        # tiled GeoTIFF (tiles are not in row-major order)
+        return None
+    n_strips = int(np.ceil(raster.RasterYSize / float(block_y)))
+    first = band.GetMetadataItem("BLOCK_OFFSET_0_0", "TIFF")
+    last = band.GetMetadataItem("BLOCK_OFFSET_0_%i" % (n_strips - 1), "TIFF")
+    if not first or not last:
+        return None
+    strip_bytes = block_x * block_y * np.dtype(gdal2numpy_types.get(band.DataType, np.uint8)).itemsize
+    if int(last) != int(first) + (n_strips - 1) * strip_bytes:
+        return None
+    return int(first)
+
+
+def get_creation_options(profile=None, rdtype=gdal.GDT_Float32):
+    """
+    Get GTiff creation options of a profile
+    :param profile: STR of a gtiff_profiles key (geoconfig) or list of creation options - default=None
+    :param rdtype: gdal.GDALDataType raster data type (determines the predictor of compressed profiles)
+    :output: list of STR creation options (e.g., ["TILED=YES", "BLOCKXSIZE=256", ...])
+    """
+    if not profile:
+        return []
+    if isinstance(profile, str):
+        try:
+            options = list(gtiff_profiles[profile])
+        except KeyError:
+            print("WARNING: Invalid GeoTIFF profile %s (using default)." % str(profile))
+            return []
+    else:
+        options = list(profile)
+    if any([option.upper().startswith("COMPRESS=") for option in options]) and not any(
+            [option.upper().startswith("PREDICTOR=") for option in options]):
+        # floating point predictor for float rasters, horizontal differencing for integer rasters
+        options.append("PREDICTOR=3" if rdtype in (gdal.GDT_Float32, gdal.GDT_Float64) else "PREDICTOR=2")
+    return options
+
+
+def get_dtype_policy(dtype_policy=None):
+    """
+    Get the definitions of a dtype policy
+    :param dtype_policy: STR of a dtype_policies key ("float64", "float32", "uint8", or "uint16") - default=None
+    :output: dictionary of the dtype policy (default and invalid names: "float64")
+    """
+    try:
+        return dtype_policies[dtype_policy or "float64"]
+    except KeyError:
+        print("WARNING: Invalid dtype policy %s (using float64)." % str(dtype_policy))
+        return dtype_policies["float64"]
+
+
+def get_valid_mask(band, window=None):
+    """
+    Read the valid pixels of a (windowed) raster band from its GDAL mask band, which is an explicit
+        (per-dataset) mask band if available or otherwise derived from the no-data value of the band
+    :param band: osgeo.gdal.Band
+    :param window: TUPLE of (x_offset, y_offset, x_size, y_size) in pixels - default=None reads the entire band
+    :output: ndarray() (bool) that is True for valid pixels
+    """
+    mask_band = band.GetMaskBand()
+    if window is None:
+        return mask_band.ReadAsArray() > 0
+    return mask_band.ReadAsArray(*window) > 0
+
+
+def mask_nodata(raster_array, nodata, scale=None, offset=None, dtype=None, copy=True, valid_mask=None):
+    """
+    Convert raw raster values to float values, where no-data values become np.nan and scale/offset
+        metadata (quantized rasters) are applied
+    :param raster_array: numpy.ndarray of raw raster values (e.g., a window of band2memmap)
+    :param nodata: INT/FLOAT no-data value of the raster band (None if not defined)
+    :param scale: FLOAT of the band scale (default: None)
+    :param offset: FLOAT of the band offset (default: None)
+    :param dtype: numpy float dtype of the output array - default=None uses np.float64
+    :param copy: BOOL - if False, raster_array may be modified in place if it already has dtype
+    :param valid_mask: numpy.ndarray (bool) of valid pixels (supersedes nodata) - default=None
+    :output: numpy.ndarray of float values
+    """
+    no_data = raster_array == nodata if valid_mask is None else ~valid_mask
+    # convert to float (without a copy if allowed and the array already has the requested dtype)
+    float_array = raster_array.astype(dtype or np.float64, copy=copy)
+    if scale not in (None, 1.0) or offset not in (None, 0.0):
+        # unscale quantized values
+        float_array = float_array * (scale or 1.0) + (offset or 0.0)
+    # overwrite NoDataValues with np.nan
+    float_array[no_data] = np.nan
+    return float_array
+
+
+def pack_mask(valid_mask):
+    """
+    Pack a boolean mask (e.g., of valid pixels) row-by-row into bits (1 bit instead of 1 byte per pixel)
+    :param valid_mask: numpy.ndarray (bool, 2d)
+    :output: numpy.ndarray (uint8) with ceil(columns / 8) bytes per row (see unpack_mask)
+    """
+    return np.packbits(valid_mask, axis=1)
+
+
+def prefetch(read_function, items, max_in_flight=io_buffers):
+    """
+    Read items (e.g., raster windows or files) in a background thread ahead of their use, so that disk I/O
+        overlaps with calculations (e.g., for window, tile in prefetch(band2array_of_window, windows): ...)
+    :param read_function: function that reads one item (e.g., lambda window: band2array(band, window=window)),
+                            which must not access datasets that are used by the calling thread at the same time
+    :param items: list of items (arguments of read_function)
+    :param max_in_flight: INT of the max. number of items read ahead (caps the memory) - default=io_buffers
+                            (geoconfig); 0 reads synchronously
+    :output: generator of TUPLEs (item, read_function(item))
+    """
+    if max_in_flight < 1:
+        for item in items:
+            yield item, read_function(item)
+        return
+
+    results = queue.Queue(maxsize=max_in_flight)
+    stop = threading.Event()
+
+    def work():
+        for item in items:
+            try:
+                result = (item, read_function(item), None)
+            except Exception as e:
+                result = (item, None, e)
+            # wait for free buffers, but stop if the generator is closed
+            while not stop.is_set():
+                try:
+                    results.put(result, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set() or result[2] is not None:
+                return
+
+    thread = threading.Thread(target=work, daemon=True)
+    thread.start()
+    try:
+        for i in range(items.__len__()):
+            item, result, error = results.get()
+            if error is not None:
+                raise error
+            yield item, result
+    finally:
+        stop.set()
+        thread.join()
+
+
+def quantize(raster_array, dtype_policy, nan_val=nan_value):
+    """
+    Convert float values between 0.0 and 1.0 (e.g., HSI) to integer codes of a quantized dtype policy
+    :param raster_array: numpy.ndarray of float values (values beyond 0.0 and 1.0 are clipped)
+    :param dtype_policy: STR of a quantized dtype_policies key ("uint8" or "uint16")
+    :param nan_val: FLOAT of the (float) no-data value, which gets the no-data code like np.nan - default=nan_value
+    :output: numpy.ndarray of integer codes
+    """
+    policy = get_dtype_policy(dtype_policy)
+    no_data = np.isnan(raster_array) | (raster_array == nan_val)
+    with np.errstate(invalid="ignore"):
+        codes = np.rint((np.clip(raster_array, 0.0, 1.0) - policy["offset"]) / policy["scale"])
+    codes[no_data] = policy["nan_val"]
+    return codes.astype(policy["code_dtype"])
+
+
+@traced()
+def raster2array(file_name, band_number=1, window=None, dtype=None, use_mask=False):
     """
     :param file_name: STR of target file name, including directory; must end on ".tif"
     :param band_number: INT of the raster band number to open (default: 1)
+    :param window: TUPLE of (x_offset, y_offset, x_size, y_size) in pixels - default=None reads the entire band
+    :param dtype: numpy float dtype of the output array (e.g., np.float32) - default=None uses np.float64
+    :param use_mask: BOOL - if True, no-data pixels are defined by the GDAL mask band (see band2array)
     :output: (1) ndarray() of the indicated raster band, where no-data values are replaced with np.nan
              (2) the GeoTransformation used in the original raster
     """
     # open the raster and band (see above)
     raster, band = open_raster(file_name, band_number=band_number)
-    try:
-        # read array data from band
-        band_array = band.ReadAsArray()
-    except AttributeError:
-        print("ERROR: Could not read array of raster band type=%s." % str(type(band)))
-        return raster, band, nan_value
-    try:
-        # overwrite NoDataValues with np.nan
-        band_array = np.where(band_array == band.GetNoDataValue(), np.nan, band_array)
-    except AttributeError:
-        print("ERROR: Could not get NoDataValue of raster band type=%s." % str(type(band)))
+    # read the (windowed) array, where NoDataValues are replaced with np.nan
+    band_array = band2array(band, window=window, dtype=dtype, use_mask=use_mask)
+    if band_array is None:
         return raster, band, nan_value
     # return the array and GeoTransformation used in the original raster
     return raster, band_array, raster.GetGeoTransform()
@@ -137,3 +649,83 @@ def clip_raster(polygon, in_raster, out_raster):
     :output: saves raster on the selected dir
     """
     gdal.Warp(out_raster, in_raster, cutlineDSName=polygon)
+
+
+def unpack_mask(packed_mask, cols, window=None):
+    """
+    Unpack (a window of) a bit-packed mask (see pack_mask)
+    :param packed_mask: numpy.ndarray (uint8) of a bit-packed mask
+    :param cols: INT of the number of columns of the unpacked mask
+    :param window: TUPLE of (x_offset, y_offset, x_size, y_size) in pixels - default=None unpacks the entire mask
+    :output: numpy.ndarray (bool)
+    """
+    if window is None:
+        return np.unpackbits(packed_mask, axis=1, count=cols).view(bool)
+    # only the rows and bytes of the window are unpacked
+    first_byte = window[0] // 8
+    rows = packed_mask[window[1]:window[1] + window[3], first_byte:(window[0] + window[2] + 7) // 8]
+    shift = window[0] - first_byte * 8
+    return np.unpackbits(rows, axis=1, count=shift + window[2])[:, shift:].view(bool)
+
+
+def write_window(band, raster_array, window=None, nan_val=nan_value, dtype_policy=None, valid_mask=None):
+    """
+    Write a numpy.array to a (window of a) raster band (raster_array is not modified)
+    :param band: osgeo.gdal.Band
+    :param raster_array: np.array of values to write (np.nan values are replaced with nan_val)
+    :param window: TUPLE of (x_offset, y_offset, x_size, y_size) in pixels - default=None writes from the origin
+    :param nan_val: INT/FLOAT no-data value to be used in the raster - default=nan_value
+    :param dtype_policy: STR of a dtype_policies key - "uint8" and "uint16" quantize float arrays - default=None
+    :param valid_mask: np.array (bool) of valid pixels written to the mask band of the raster (see
+                        create_raster_dataset), where nan_val is a valid value - default=None
+    """
+    x_off, y_off = (0, 0) if window is None else window[:2]
+    if get_dtype_policy(dtype_policy)["quantized"] and raster_array.dtype.kind == "f":
+        # float values are written as integer codes (np.nan and nan_val get the no-data code of the policy)
+        raster_array = quantize(raster_array, dtype_policy, nan_val=np.nan if valid_mask is not None else nan_val)
+    elif raster_array.dtype.kind == "f":
+        # replace np.nan values in a copy (only if there are any)
+        no_data = np.isnan(raster_array)
+        if no_data.any():
+            raster_array = np.where(no_data, nan_val, raster_array)
+    band.WriteArray(raster_array, xoff=x_off, yoff=y_off)
+    if valid_mask is not None:
+        # GDAL mask bands use 0 (invalid) and 255 (valid)
+        band.GetMaskBand().WriteArray(valid_mask.astype(np.uint8) * np.uint8(255), xoff=x_off, yoff=y_off)
+
+
+def get_vsi_size(directory):
+    """
+    Get the total size of all files in a (virtual, e.g., "/vsimem/") directory
+    :param directory: STR of the directory (e.g., "/vsimem/__cache__/")
+    :output: INT of the size in bytes
+    """
+    size = 0
+    for file_name in gdal.ReadDirRecursive(directory) or []:
+        stat = gdal.VSIStatL(directory + file_name)
+        if stat is not None:
+            size += stat.size
+    return size
+
+
+def raster_exists(file_name):
+    """
+    Check if a raster file exists (also works with GDAL virtual file systems such as "/vsimem/")
+    :param file_name: STR of a raster file directory and name
+    :output: BOOL
+    """
+    return gdal.VSIStatL(file_name) is not None
+
+
+def remove_vsi_files(directory):
+    """
+    Remove all files in a GDAL virtual (e.g., "/vsimem/") directory without walking the disk
+    :param directory: STR of the directory (e.g., "/vsimem/__cache__/")
+    :output: INT of the number of removed files
+    """
+    count = 0
+    for file_name in gdal.ReadDirRecursive(directory) or []:
+        if not file_name.endswith("/"):
+            gdal.Unlink(directory + file_name)
+            count += 1
+    return count
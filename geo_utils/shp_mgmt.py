@@ -4,6 +4,7 @@ try:
     import numpy as np
     import os
     import alphashape
+    import struct
 except ModuleNotFoundError as e:
     print(e)
 
@@ -92,6 +93,114 @@ def get_geom_description(layer):
         return type_dict[0]
 
 
+def get_polygon_areas(wkb_list):
+    """
+    Calculate the areas of many (multi)polygon WKB geometries at once with the shoelace formula applied to
+        all rings in one vectorized pass, where holes are subtracted from exterior rings (like ogr.Geometry.GetArea)
+    :param wkb_list: list of bytes of WKB geometries (None for features without geometry)
+    :output: numpy.ndarray of areas (0.0 for geometries without polygons)
+    """
+    coord_arrays = []
+    ring_signs = []
+    owners = []
+    for i, wkb in enumerate(wkb_list):
+        if wkb is None:
+            continue
+        signs = []
+        for (offset, n_points, n_dims, dtype, has_z), sign in zip(get_wkb_coordinate_blocks(wkb, signs), signs):
+            if sign != 0 and n_points > 2:
+                coord_arrays.append(np.frombuffer(wkb, dtype, n_points * n_dims, offset).reshape(n_points, n_dims))
+                ring_signs.append(sign)
+                owners.append(i)
+    areas = np.zeros(len(wkb_list))
+    if not coord_arrays:
+        return areas
+
+    n_points = np.array([coords.shape[0] for coords in coord_arrays])
+    ring_ids = np.repeat(np.arange(n_points.size), n_points)
+    coords = np.concatenate([coords[:, 0:2] for coords in coord_arrays]).astype(float)
+    # coordinates relative to the first vertex of every ring (precision of large, e.g., LV95, coordinates)
+    # also makes the closing segment term zero for rings that are not explicitly closed
+    coords -= coords[np.cumsum(n_points) - n_points][ring_ids]
+    cross = coords[:-1, 0] * coords[1:, 1] - coords[1:, 0] * coords[:-1, 1]
+    same_ring = ring_ids[:-1] == ring_ids[1:]
+    ring_areas = 0.5 * np.abs(np.bincount(ring_ids[:-1][same_ring], weights=cross[same_ring], minlength=n_points.size))
+    return areas + np.bincount(owners, weights=ring_areas * ring_signs, minlength=areas.size)
+
+
+def get_wkb_coordinate_blocks(wkb, ring_signs=None):
+    """
+    Find the coordinate sequences of a WKB geometry (e.g., the rings of all polygons of a MultiPolygon)
+        to read or modify all vertices with numpy without creating OGR sub-geometries
+    :param wkb: bytes or bytearray of an (ISO or 2.5D) WKB geometry (e.g., ogr.Geometry.ExportToIsoWkb(ogr.wkbNDR))
+    :param ring_signs: list to append the role of every block to (1 = exterior ring, -1 = interior ring/hole,
+                        0 = point or line) - default=None
+    :output: list of TUPLEs (byte offset, number of points, number of dimensions, STR numpy dtype, BOOL has z), where
+                np.frombuffer(wkb, dtype, n_points * n_dims, offset).reshape(n_points, n_dims) gives the coordinates
+    """
+    blocks = []
+    read_wkb_geometry(wkb, 0, blocks, ring_signs)
+    return blocks
+
+
+def read_wkb_geometry(wkb, offset, blocks, ring_signs=None):
+    """
+    Read one (nested) WKB geometry and append its coordinate sequences (see get_wkb_coordinate_blocks)
+    :param wkb: bytes or bytearray of a WKB geometry
+    :param offset: INT of the byte offset where the geometry starts
+    :param blocks: list to append coordinate blocks to
+    :param ring_signs: list to append the role of every block to (see get_wkb_coordinate_blocks) - default=None
+    :output: INT of the byte offset where the geometry ends
+    """
+    endian = "<" if wkb[offset] == 1 else ">"
+    geom_type = struct.unpack_from(endian + "I", wkb, offset + 1)[0]
+    if geom_type & 0xC0000000:
+        # 2.5D (wkb25DBit) and measured geometry flags
+        has_z, has_m = bool(geom_type & 0x80000000), bool(geom_type & 0x40000000)
+        geom_type &= 0x0FFFFFFF
+    else:
+        # ISO WKB: 1000 = Z, 2000 = M, 3000 = ZM
+        has_z, has_m = geom_type // 1000 in (1, 3), geom_type // 1000 in (2, 3)
+        geom_type %= 1000
+    n_dims = 2 + has_z + has_m
+    dtype = endian + "f8"
+    offset += 5
+
+    if geom_type == 1:
+        # Point
+        blocks.append((offset, 1, n_dims, dtype, has_z))
+        if ring_signs is not None:
+            ring_signs.append(0)
+        return offset + 8 * n_dims
+    if geom_type == 2:
+        # LineString
+        n_points = struct.unpack_from(endian + "I", wkb, offset)[0]
+        blocks.append((offset + 4, n_points, n_dims, dtype, has_z))
+        if ring_signs is not None:
+            ring_signs.append(0)
+        return offset + 4 + 8 * n_dims * n_points
+    if geom_type == 3:
+        # Polygon (sequence of linear rings)
+        n_rings = struct.unpack_from(endian + "I", wkb, offset)[0]
+        offset += 4
+        for i in range(n_rings):
+            n_points = struct.unpack_from(endian + "I", wkb, offset)[0]
+            blocks.append((offset + 4, n_points, n_dims, dtype, has_z))
+            if ring_signs is not None:
+                # the first ring is the exterior ring, all further rings are holes
+                ring_signs.append(1 if i == 0 else -1)
+            offset += 4 + 8 * n_dims * n_points
+        return offset
+    if geom_type in (4, 5, 6, 7):
+        # MultiPoint, MultiLineString, MultiPolygon, GeometryCollection
+        n_geometries = struct.unpack_from(endian + "I", wkb, offset)[0]
+        offset += 4
+        for i in range(n_geometries):
+            offset = read_wkb_geometry(wkb, offset, blocks, ring_signs)
+        return offset
+    raise ValueError("Unsupported WKB geometry type (%s)." % str(geom_type))
+
+
 def get_geom_simplified(layer):
     """
     Get a simplified geometry description (either point, line, or polygon) as a function of
@@ -126,6 +235,26 @@ def verify_shp_name(shp_file_name, shorten_to=13):
         return shp_file_name
 
 
+def multiline_from_points(start_points, end_points):
+    """
+    Create a MultiLineString of two-point lines in one pass (WKB is built in bulk with numpy)
+    :param start_points: numpy.ndarray of shape (n, 2) with x-y coordinates of the line start points
+    :param end_points: numpy.ndarray of shape (n, 2) with x-y coordinates of the line end points
+    :output: osgeo.ogr.Geometry (wkbMultiLineString)
+    """
+    # little endian WKB LineString with 2 points: byte order (1), wkbLineString (2), number of points (2), coordinates
+    line_dtype = np.dtype([("byte_order", "u1"), ("geom_type", "<u4"), ("n_points", "<u4"), ("xy", "<f8", (4,))])
+    lines = np.empty(np.shape(start_points)[0], dtype=line_dtype)
+    lines["byte_order"] = 1
+    lines["geom_type"] = ogr.wkbLineString
+    lines["n_points"] = 2
+    lines["xy"][:, 0:2] = start_points
+    lines["xy"][:, 2:4] = end_points
+    header = np.array([(1, ogr.wkbMultiLineString, lines.size)],
+                      dtype=[("byte_order", "u1"), ("geom_type", "<u4"), ("n_lines", "<u4")])
+    return ogr.CreateGeometryFromWkb(header.tobytes() + lines.tobytes())
+
+
 def polygon_from_shapepoints(shapepoints, polygon, alpha=np.nan):
     """
     Create a polygon around a cloud of shapepoints
@@ -1,53 +1,64 @@
 from .dataset_mgmt import *
-import urllib
+from functools import lru_cache
+import json
+
+# default (fallback) spatial reference: EPSG:4326 as ESRI WKT
+wgs84_esriwkt = ('GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],'
+                 'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]')
 
 
 def get_esriwkt(epsg):
     """
-    Get esriwkt-formatted spatial references with epsg code online
+    Get esriwkt-formatted spatial references with epsg code (offline: from the srs registry or resolved with osr)
     Usage: get_esriwkt(4326)
     :param epsg: Int of epsg
     :output: str containing esriwkt (if error: default epsg=4326 is used)
     """
     try:
-        with urllib.request.urlopen("http://spatialreference.org/ref/epsg/{0}/esriwkt/".format(epsg)) as response:
-            return str(response.read()).strip("b").strip("'")
-    except Exception:
-        pass
-    try:
-        with urllib.request.urlopen(
-                "http://spatialreference.org/ref/sr-org/epsg{0}-wgs84-web-mercator-auxiliary-sphere/esriwkt/".format(
-                    epsg)) as response:
-            return str(response.read()).strip("b").strip("'")
-        # sr-org codes are available at "https://spatialreference.org/ref/sr-org/{0}/esriwkt/".format(epsg)
-        # for example EPSG:3857 = SR-ORG:6864 -> https://spatialreference.org/ref/sr-org/6864/esriwkt/ = EPSG:3857
-    except Exception as e:
-        print("ERROR: Could not find epsg code on spatialreference.org. Returning default WKT(epsg=4326).")
-        print(e)
-        return 'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137,298.257223563]],PRIMEM["Greenwich",0],UNIT["Degree",0.017453292519943295],UNIT["Meter",1]]'
+        return srs_registry[str(epsg)]["esriwkt"]
+    except KeyError:
+        return resolve_esriwkt(epsg)
 
 
 def get_srs(dataset):
     """
-    Get the spatial reference of any gdal.Dataset
+    Get the spatial reference of any gdal.Dataset (identified spatial references are cached by their WKT)
     :param dataset: gdal.Dataset (shapefile or raster)
-    :output: osr.SpatialReference
+    :output: osr.SpatialReference (a copy of the cached spatial reference, which can be modified)
     """
     gdal.UseExceptions()
 
     if verify_dataset(dataset) == "raster":
-        sr = osr.SpatialReference()
-        sr.ImportFromWkt(dataset.GetProjection())
+        sr = identify_srs(dataset.GetProjection(), from_layer=False)
     else:
         try:
-            sr = osr.SpatialReference(str(dataset.GetLayer().GetSpatialRef()))
+            sr = identify_srs(str(dataset.GetLayer().GetSpatialRef()), from_layer=True)
         except AttributeError:
             print("ERROR: Invalid source data (%s)." % str(dataset))
             return None
+    if sr is None:
+        return None
+    return sr.Clone()
+
+
+@lru_cache(maxsize=srs_cache_size)
+def identify_srs(wkt, from_layer=False):
+    """
+    Create a spatial reference from WKT and identify its EPSG code (preferably use through get_srs),
+        where the result is cached (process-wide) for every WKT string
+    :param wkt: STR of a WKT spatial reference (e.g., gdal.Dataset.GetProjection())
+    :param from_layer: BOOL - if True, wkt stems from an osgeo.ogr.Layer spatial reference
+    :output: osr.SpatialReference (do not modify - get_srs returns a copy)
+    """
+    if from_layer:
+        sr = osr.SpatialReference(wkt)
+    else:
+        sr = osr.SpatialReference()
+        sr.ImportFromWkt(wkt)
     # auto-detect epsg
     try:
         auto_detect = sr.AutoIdentifyEPSG()
-        if auto_detect is not 0:
+        if auto_detect != 0:
             sr = sr.FindMatches()[0][0]  # Find matches returns list of tuple of SpatialReferences
             sr.AutoIdentifyEPSG()
     except TypeError:
@@ -61,14 +72,15 @@ def get_srs(dataset):
     return sr
 
 
+@lru_cache(maxsize=srs_cache_size)
 def get_wkt(epsg, wkt_format="esriwkt"):
     """
-    Get WKT-formatted projection information for an epsg code using the osr library
+    Get WKT-formatted projection information for an epsg code using the osr library (cached)
     :param epsg: Int of epsg
     :param wkt_format: Str of wkt format (default is esriwkt for shapefile projections)
     :output: str containing WKT (if error: default epsg=4326 is used)
     """
-    default = 'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137,298.257223563]],PRIMEM["Greenwich",0],UNIT["Degree",0.017453292519943295],UNIT["Meter",1]]'
+    default = wgs84_esriwkt
     spatial_ref = osr.SpatialReference()
     try:
         spatial_ref.ImportFromEPSG(epsg)
@@ -83,16 +95,31 @@ def get_wkt(epsg, wkt_format="esriwkt"):
     return spatial_ref.ExportToPrettyWkt()
 
 
+def load_srs_registry(file_name=srs_registry_file):
+    """
+    Load the on-disk registry of ESRI WKT strings (pre-warms get_esriwkt without any osr or network calls)
+    :param file_name: STR of a JSON file of {"EPSG": {"esriwkt": WKT}} - default=srs_registry_file (geoconfig)
+    :output: dictionary of the registry (empty if the file is not available)
+    """
+    try:
+        with open(file_name, mode="r") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        print("WARNING: Cannot read the SRS registry %s." % str(file_name))
+        return {}
+
+
 def make_prj(shp_file_name, epsg):
     """
-    Generate a projection file for a shapefile
+    Generate a projection file for a shapefile (the ESRI WKT stems from the srs registry or is resolved with osr,
+        see get_esriwkt)
     :param shp_file_name: STR of a shapefile name (with directory e.g., "C:/temp/poly.shp")
     :param epsg: INT of epsg
     """
     shp_dir = shp_file_name.strip(shp_file_name.split("/")[-1].split("\\")[-1])
     shp_name = shp_file_name.split(".shp")[0].split("/")[-1].split("\\")[-1]
     with open(r"" + shp_dir + shp_name + ".prj", "w+") as prj:
-        prj.write(get_wkt(epsg))
+        prj.write(get_esriwkt(epsg))
 
 
 def reproject(source_dataset, new_projection_dataset):
@@ -118,13 +145,23 @@ def reproject(source_dataset, new_projection_dataset):
         reproject_shapefile(source_dataset, layer_dict["layer"], srs_src, srs_tar)
 
 
-def reproject_raster(source_dataset, source_srs, target_srs):
+def reproject_raster(source_dataset, source_srs, target_srs, warp=False, pixel_size=None):
     """
     Reproject a raster dataset (preferably use through reproject function)
-    :param source_dataset: osgeo.ogr.DataSource (instantiate with ogr.Open(SHP-FILE))
+    :param source_dataset: osgeo.gdal.Dataset (instantiate with gdal.Open(TIF-FILE))
     :param source_srs: osgeo.osr.SpatialReference (instantiate with get_srs(source_dataset))
     :param target_srs: osgeo.osr.SpatialReference (instantiate with get_srs(DATASET-WITH-TARGET-PROJECTION))
+    :param warp: BOOL - if False (default), the raster is reprojected in memory with gdal.ReprojectImage and an
+                    extent of two transformed corner points; if True, gdal.Warp computes the full output extent
+                    and writes the GeoTIFF directly (multithreaded, see warp_memory_limit and warp_threads in
+                    geoconfig), which can change the extent and pixel size of rotated or non-affine reprojections
+    :param pixel_size: FLOAT of the output pixel size in target units (only if warp=True)
+                    default=None lets gdal.Warp derive the pixel size from the source raster
+    :output: STR of the reprojected GeoTIFF (source file name + "_epsgXXXX.tif") or None if failed
     """
+    if warp:
+        return warp_raster(source_dataset, source_srs, target_srs, pixel_size=pixel_size)
+
     # READ THE SOURCE GEO TRANSFORMATION (ORIGIN_X, PIXEL_WIDTH, 0, ORIGIN_Y, 0, PIXEL_HEIGHT)
     src_geo_transform = source_dataset.GetGeoTransform()
 
@@ -167,19 +204,24 @@ def reproject_raster(source_dataset, source_srs, target_srs):
     # SAVE REPROJECTED DATASET AS GEOTIFF
     src_file_name = source_dataset.GetFileList()[0]
     tar_file_name = src_file_name.split(".tif")[0] + "_epsg" + target_srs.GetAuthorityCode(None) + ".tif"
-    create_raster(tar_file_name, raster_array=tar_dataset.ReadAsArray(),
-                  epsg=int(target_srs.GetAuthorityCode(None)),
-                  geo_info=tar_dataset.GetGeoTransform())
+    if create_raster(tar_file_name, raster_array=tar_dataset.ReadAsArray(),
+                     epsg=int(target_srs.GetAuthorityCode(None)),
+                     geo_info=tar_dataset.GetGeoTransform()) != 0:
+        return None
     print("Saved reprojected raster as %s" % tar_file_name)
+    return tar_file_name
 
 
-def reproject_shapefile(source_dataset, source_layer, source_srs, target_srs):
+def reproject_shapefile(source_dataset, source_layer, source_srs, target_srs, bulk=True):
     """
     Reproject a shapefile dataset (preferably use through reproject function)
     :param source_dataset: osgeo.ogr.DataSource (instantiate with ogr.Open(SHP-FILE))
     :param source_layer:  osgeo.ogr.Layer (instantiate with source_dataset.GetLayer())
     :param source_srs: osgeo.osr.SpatialReference (instantiate with get_srs(source_dataset))
     :param target_srs: osgeo.osr.SpatialReference (instantiate with get_srs(DATASET-WITH-TARGET-PROJECTION))
+    :param bulk: BOOL - if True (default), the vertices of many features are transformed in batches of
+                    transform_batch_size points and features are written in one transaction;
+                    if False, every geometry is transformed and every field is copied one-by-one
     """
     # make GeoTransformation
     coord_trans = osr.CoordinateTransformation(source_srs, target_srs)
@@ -187,7 +229,8 @@ def reproject_shapefile(source_dataset, source_layer, source_srs, target_srs):
     # make target shapefile
     tar_file_name = verify_shp_name(source_dataset.GetName(), shorten_to=4).split(".shp")[
                         0] + "_epsg" + target_srs.GetAuthorityCode(None) + ".shp"
-    tar_shp = create_shp(tar_file_name, layer_type=get_geom_simplified(source_layer))
+    tar_shp = create_shp(tar_file_name, layer_name=source_layer.GetName(),
+                         layer_type=get_geom_simplified(source_layer))
     tar_lyr = tar_shp.GetLayer()
 
     # look up layer (features) definitions in input shapefile
@@ -204,11 +247,17 @@ def reproject_shapefile(source_dataset, source_layer, source_srs, target_srs):
     except AttributeError:
         print("ERROR: Invalid or empty vector dataset.")
         return None
+
+    if bulk:
+        if write_transformed_features(source_layer, feature, tar_lyr, coord_trans) < 0:
+            return None
+        feature = None
     while feature:
         # get the input geometry
         geometry = feature.GetGeometryRef()
-        # re-project (transform) geometry to new system
-        geometry.Transform(coord_trans)
+        # re-project (transform) geometry to new system (features without geometry are copied)
+        if geometry is not None:
+            geometry.Transform(coord_trans)
         # create new output feature
         out_feature = ogr.Feature(tar_lyr_def)
         # assign in-geometry to output feature and copy field values
@@ -221,4 +270,187 @@ def reproject_shapefile(source_dataset, source_layer, source_srs, target_srs):
         feature = source_layer.GetNextFeature()
 
     # add projection file
-    make_prj(tar_file_name, int(source_srs.GetAuthorityCode(None)))
+    make_prj(tar_file_name, int(target_srs.GetAuthorityCode(None)))
+
+
+def resolve_esriwkt(epsg):
+    """
+    Resolve the ESRI WKT of an epsg code locally with osr (no network) - results are cached
+        (preferably use through get_esriwkt)
+    :param epsg: Int of epsg
+    :output: str containing esriwkt (if error: default epsg=4326 is used)
+    """
+    try:
+        return resolve_esriwkt_cached(int(epsg))
+    except (TypeError, ValueError):
+        print("ERROR: epsg must be integer. Returning default WKT(epsg=4326).")
+        return wgs84_esriwkt
+
+
+@lru_cache(maxsize=srs_cache_size)
+def resolve_esriwkt_cached(epsg):
+    """
+    Cached osr resolution of resolve_esriwkt
+    :param epsg: Int of epsg
+    :output: str containing esriwkt
+    """
+    spatial_ref = osr.SpatialReference()
+    try:
+        spatial_ref.ImportFromEPSG(epsg)
+    except Exception as e:
+        print("ERROR: Could not find epsg code %s. Returning default WKT(epsg=4326)." % str(epsg))
+        print(e)
+        return wgs84_esriwkt
+    spatial_ref.MorphToESRI()
+    return spatial_ref.ExportToWkt()
+
+
+def save_srs_registry(epsg_list, file_name=srs_registry_file):
+    """
+    Add the ESRI WKT strings of epsg codes to the on-disk registry (e.g., on a machine with a full PROJ
+        database, before copying geo_utils to offline compute nodes)
+    :param epsg_list: list of Int of epsg codes
+    :param file_name: STR of a JSON file - default=srs_registry_file (geoconfig)
+    :output: dictionary of the updated registry
+    """
+    registry = load_srs_registry(file_name)
+    for epsg in epsg_list:
+        registry[str(epsg)] = {"esriwkt": resolve_esriwkt(epsg)}
+    with open(file_name, mode="w") as file:
+        json.dump(registry, file, indent=2)
+    srs_registry.update(registry)
+    return registry
+
+
+def transform_wkb_batch(wkb_list, coord_trans):
+    """
+    Transform the vertices of many WKB geometries with one TransformPoints call (modifies wkb_list in place)
+    :param wkb_list: list of bytearrays of WKB geometries (None for features without geometry)
+    :param coord_trans: osgeo.osr.CoordinateTransformation
+    """
+    coord_arrays = []
+    z_values = []
+    for wkb in wkb_list:
+        if wkb is None:
+            continue
+        for offset, n_points, n_dims, dtype, has_z in get_wkb_coordinate_blocks(wkb):
+            coord_arrays.append(np.frombuffer(wkb, dtype, n_points * n_dims, offset).reshape(n_points, n_dims))
+            z_values.append(has_z)
+    if not coord_arrays:
+        return
+
+    # gather all (x, y, z) coordinates - geometries without z are transformed with z=0 (like ogr.Geometry.Transform)
+    points = np.zeros((sum([coords.shape[0] for coords in coord_arrays]), 3))
+    start = 0
+    for coords, has_z in zip(coord_arrays, z_values):
+        points[start:start + coords.shape[0], 0:2] = coords[:, 0:2]
+        if has_z:
+            points[start:start + coords.shape[0], 2] = coords[:, 2]
+        start += coords.shape[0]
+
+    new_points = np.array(coord_trans.TransformPoints(points.tolist()), dtype=float)
+
+    # write the transformed coordinates back into the WKB buffers (np.frombuffer views of the bytearrays)
+    start = 0
+    for coords, has_z in zip(coord_arrays, z_values):
+        coords[:, 0:2] = new_points[start:start + coords.shape[0], 0:2]
+        if has_z:
+            coords[:, 2] = new_points[start:start + coords.shape[0], 2]
+        start += coords.shape[0]
+
+
+def warp_raster(source_dataset, source_srs, target_srs, pixel_size=None):
+    """
+    Reproject a raster dataset with gdal.Warp (preferably use through reproject_raster), which streams
+        chunks of max. warp_memory_limit MB directly to the target GeoTIFF
+    :param source_dataset: osgeo.gdal.Dataset (instantiate with gdal.Open(TIF-FILE))
+    :param source_srs: osgeo.osr.SpatialReference (instantiate with get_srs(source_dataset))
+    :param target_srs: osgeo.osr.SpatialReference (instantiate with get_srs(DATASET-WITH-TARGET-PROJECTION))
+    :param pixel_size: FLOAT of the output pixel size in target units - default=None (derived by gdal.Warp)
+    :output: STR of the target file name (or None if failed)
+    """
+    src_file_name = source_dataset.GetFileList()[0]
+    tar_file_name = src_file_name.split(".tif")[0] + "_epsg" + target_srs.GetAuthorityCode(None) + ".tif"
+
+    # the output extent is derived from points along all raster edges (not only two corners)
+    warp_options = gdal.WarpOptions(format="GTiff",
+                                    srcSRS=source_srs.ExportToWkt(),
+                                    dstSRS=target_srs.ExportToWkt(),
+                                    xRes=pixel_size, yRes=pixel_size,
+                                    resampleAlg=gdal.GRA_Bilinear,
+                                    outputType=gdal.GDT_Float32,
+                                    dstNodata=nan_value,
+                                    multithread=True,
+                                    warpMemoryLimit=warp_memory_limit,
+                                    warpOptions=["NUM_THREADS=%s" % str(warp_threads)])
+    try:
+        tar_dataset = gdal.Warp(tar_file_name, source_dataset, options=warp_options)
+    except RuntimeError as e:
+        print("ERROR: Could not reproject %s." % str(src_file_name))
+        print(e)
+        return None
+    tar_dataset.FlushCache()
+    print("Saved reprojected raster as %s" % tar_file_name)
+    return tar_file_name
+
+
+def write_transformed_features(source_layer, first_feature, target_layer, coord_trans):
+    """
+    Copy all features of a layer with transformed geometries (batches of transform_batch_size vertices)
+        to another layer within one transaction, where fields are copied with SetFrom
+    :param source_layer: osgeo.ogr.Layer
+    :param first_feature: osgeo.ogr.Feature of the first (already read) feature of source_layer
+    :param target_layer: osgeo.ogr.Layer with the same fields as source_layer
+    :param coord_trans: osgeo.osr.CoordinateTransformation
+    :output: 0 = success; -1 = failed (the transaction could not be committed)
+    """
+    target_def = target_layer.GetLayerDefn()
+    # without ogr.UseExceptions, OGR returns an error code (e.g., if the driver does not support transactions)
+    try:
+        transaction = target_layer.StartTransaction() == ogr.OGRERR_NONE
+    except RuntimeError:
+        transaction = False
+
+    def flush(features, wkb_list):
+        transform_wkb_batch(wkb_list, coord_trans)
+        for feature, wkb in zip(features, wkb_list):
+            out_feature = ogr.Feature(target_def)
+            out_feature.SetFrom(feature)
+            if wkb is not None:
+                out_feature.SetGeometryDirectly(ogr.CreateGeometryFromWkb(bytes(wkb)))
+            target_layer.CreateFeature(out_feature)
+
+    features = []
+    wkb_list = []
+    n_points = 0
+    feature = first_feature
+    while feature:
+        geometry = feature.GetGeometryRef()
+        if geometry is None:
+            wkb_list.append(None)
+        else:
+            wkb_list.append(bytearray(geometry.ExportToIsoWkb(ogr.wkbNDR)))
+            # approximate number of vertices (16 bytes per x-y coordinate)
+            n_points += len(wkb_list[-1]) // 16
+        features.append(feature)
+        if n_points >= transform_batch_size:
+            flush(features, wkb_list)
+            features, wkb_list, n_points = [], [], 0
+        feature = source_layer.GetNextFeature()
+    flush(features, wkb_list)
+
+    if not transaction:
+        return 0
+    try:
+        commit_status = target_layer.CommitTransaction()
+    except RuntimeError as e:
+        print(e)
+        commit_status = None
+    if commit_status != ogr.OGRERR_NONE:
+        print("ERROR: Could not commit the transformed features of %s." % str(source_layer.GetName()))
+        return -1
+    return 0
+
+
+# process-wide registry of ESRI WKT strings (pre-warmed from srs_registry_file)
+srs_registry = load_srs_registry()
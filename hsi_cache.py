@@ -0,0 +1,211 @@
+from fun import *
+from hsi_curve import HSICurve
+import glob
+import hashlib
+
+# modules whose source code defines HSI values or the bytes of cached GeoTIFFs (part of every cache key,
+# see get_code_version)
+hsi_code_files = ["fun.py", "hsi_curve.py", "raster.py", "raster_hsi.py",
+                  os.path.join("geo_utils", "geoconfig.py"), os.path.join("geo_utils", "raster_mgmt.py")]
+
+
+class HSICache:
+    def __init__(self, folder=hsi_cache_folder, max_size=hsi_cache_max_size, fingerprint=hsi_cache_fingerprint):
+        """
+        Persistent, content-addressed cache of HSI GeoTIFFs with size-based least recently used (LRU) eviction
+        :param folder: STR of the cache directory (must not be the cache_folder, which is cleared after every run)
+        :param max_size: INT of the max. total size of cached files in bytes - default=hsi_cache_max_size
+        :param fingerprint: STR of the input raster identification - "stat" (path, size, and modification time)
+                            or "content" (SHA-256 of the file, independent of path and time stamps)
+        """
+        self.folder = folder
+        self.max_size = max_size
+        self.fingerprint = fingerprint
+        self.code_version = get_code_version()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        try:
+            os.makedirs(self.folder)
+        except OSError:
+            pass
+
+    def clear(self):
+        """
+        Remove all cached files
+        :return: INT of the number of removed files
+        """
+        count = 0
+        for cache_file in self._list_files():
+            os.remove(cache_file)
+            count += 1
+        return count
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache size is within max_size (the most recently used
+            entry is always kept)
+        :return: INT of the number of removed entries
+        """
+        entries = {}
+        for cache_file in self._list_files():
+            stat = os.stat(cache_file)
+            key = os.path.basename(cache_file).split(".")[0]
+            last_use, size = entries.get(key, (0, 0))
+            entries[key] = (max(last_use, stat.st_mtime), size + stat.st_size)
+        total_size = sum([size for last_use, size in entries.values()])
+        count = 0
+        for key in sorted(entries.keys(), key=lambda k: entries[k][0])[:-1]:
+            if total_size <= self.max_size:
+                break
+            for cache_file in self._list_files(key):
+                os.remove(cache_file)
+            total_size -= entries[key][1]
+            count += 1
+        self.evictions += count
+        return count
+
+    def get(self, key):
+        """
+        Look up a cached HSI GeoTIFF and mark it as recently used
+        :param key: STR of a cache key (see get_key)
+        :return: STR of the cached file or None (cache miss)
+        """
+        cache_file = self.folder + key + ".tif"
+        if not os.path.isfile(cache_file):
+            self.misses += 1
+            return None
+        for entry_file in self._list_files(key):
+            # the modification time is the time of the last use (LRU)
+            os.utime(entry_file, None)
+        self.hits += 1
+        return cache_file
+
+    def get_key(self, tif_name, hsi_curve, band=1, **options):
+        """
+        Get the cache key of an HSI raster
+        :param tif_name: STR of the parameter raster (e.g., water depth GeoTIFF)
+        :param hsi_curve: nested list of [[par-values], [HSI-values]] or HSICurve object
+        :param band: INT of the band number of the parameter raster
+        :param options: further settings that change the HSI GeoTIFF (e.g., dtype_policy="uint8", profile="deflate")
+        :return: STR of a SHA-256 hash (hexadecimal) or None if the parameter raster is not accessible
+        """
+        try:
+            if self.fingerprint == "content":
+                file_hash = hashlib.sha256()
+                with open(tif_name, mode="rb") as file:
+                    for block in iter(lambda: file.read(2 ** 20), b""):
+                        file_hash.update(block)
+                raster_id = file_hash.hexdigest()
+            else:
+                stat = os.stat(tif_name)
+                raster_id = "%s|%i|%i" % (os.path.abspath(tif_name), stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            print("WARNING: Cannot identify %s (HSI raster is not cached)." % str(tif_name))
+            return None
+
+        if isinstance(hsi_curve, HSICurve):
+            x_values, y_values = hsi_curve.x_values, hsi_curve.y_values
+            # LUT-based curves yield slightly different HSI values
+            options.update({"lut": [hsi_curve.use_lut, hsi_curve.resolution]})
+        else:
+            x_values, y_values = hsi_curve[0], hsi_curve[1]
+        options.update({"band": band, "nan_value": nan_value, "nodata_masks": nodata_masks})
+
+        key_hash = hashlib.sha256()
+        key_hash.update(raster_id.encode())
+        key_hash.update(np.ascontiguousarray(x_values, dtype=np.float64).tobytes())
+        key_hash.update(np.ascontiguousarray(y_values, dtype=np.float64).tobytes())
+        key_hash.update(json.dumps(options, sort_keys=True, default=str).encode())
+        key_hash.update(self.code_version.encode())
+        return key_hash.hexdigest()
+
+    def get_stats(self):
+        """
+        Get the cache statistics of this HSICache instance
+        :return: dictionary of "hits", "misses", "hit_rate", "evictions", "entries", and "size" (bytes)
+        """
+        cache_files = self._list_files()
+        n_requests = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / float(n_requests) if n_requests > 0 else 0.0,
+                "evictions": self.evictions,
+                "entries": len([f for f in cache_files if f.endswith(".tif")]),
+                "size": sum([os.path.getsize(f) for f in cache_files])}
+
+    def put(self, key, file_name):
+        """
+        Add an HSI GeoTIFF (and its .msk mask file if any) to the cache and evict least recently used entries
+        :param key: STR of a cache key (see get_key)
+        :param file_name: STR of the HSI GeoTIFF
+        :return: STR of the cached file or None if failed
+        """
+        if key is None:
+            return None
+        try:
+            for source, suffix in [(file_name, ".tif"), (file_name + ".msk", ".tif.msk")]:
+                if os.path.isfile(source):
+                    # copy to a temporary file first, so that interrupted copies are never used
+                    shutil.copyfile(source, self.folder + key + suffix + ".tmp")
+                    os.replace(self.folder + key + suffix + ".tmp", self.folder + key + suffix)
+        except OSError as e:
+            print("WARNING: Cannot add %s to the HSI cache." % str(file_name))
+            print(e)
+            return None
+        self.evict()
+        return self.folder + key + ".tif"
+
+    def restore(self, key, file_name):
+        """
+        Copy a cached HSI GeoTIFF (and its .msk mask file if any) to a target file, where an outdated .msk file
+            of the target is removed if the cached entry has none
+        :param key: STR of a cache key (see get_key)
+        :param file_name: STR of the target GeoTIFF
+        :return: BOOL (True if the file was restored from the cache)
+        """
+        if key is None:
+            return False
+        cache_file = self.get(key)
+        if cache_file is None:
+            return False
+        try:
+            shutil.copyfile(cache_file, file_name)
+            if os.path.isfile(cache_file + ".msk"):
+                shutil.copyfile(cache_file + ".msk", file_name + ".msk")
+            elif os.path.isfile(file_name + ".msk"):
+                os.remove(file_name + ".msk")
+        except OSError as e:
+            print("WARNING: Cannot restore %s from the HSI cache." % str(file_name))
+            print(e)
+            # the HSI raster has to be calculated
+            self.hits -= 1
+            self.misses += 1
+            return False
+        return True
+
+    def _list_files(self, key="*"):
+        """
+        List the (complete) files of one or all cache entries
+        :param key: STR of a cache key - default="*" lists all entries
+        :return: list of STR file names
+        """
+        pattern = glob.escape(self.folder) + key
+        return glob.glob(pattern + ".tif") + glob.glob(pattern + ".tif.msk")
+
+
+def get_code_version():
+    """
+    Get a hash of the source code that defines HSI values (hsi_code_files), which invalidates cached HSI
+        rasters after code changes
+    :return: STR of a SHA-256 hash (hexadecimal)
+    """
+    code_hash = hashlib.sha256()
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    for code_file in hsi_code_files:
+        try:
+            with open(os.path.join(code_dir, code_file), mode="rb") as file:
+                code_hash.update(file.read())
+        except OSError:
+            code_hash.update(code_file.encode())
+    return code_hash.hexdigest()
@@ -0,0 +1,232 @@
+from fun import *
+import threading
+
+
+class HSICurve:
+    def __init__(self, fish_data, parameter, life_stage, resolution=None, max_error=lut_max_error):
+        """
+        A Habitat Suitability Index curve with a precompiled lookup table (LUT) for fast evaluation
+        :param fish_data: JSON object returned by read_json (e.g., trout = read_json("habitat/trout.json")) or
+                            STR of a fish json file, whose curves are loaded once by the curve_registry
+        :param parameter: STR of the parameter (either "velocity", "depth", or "grain_size" - see par_dict)
+        :param life_stage: STR of the fish life stage (either "fry", "spawning", "juvenile", or "adult")
+        :param resolution: FLOAT of the LUT step size in parameter units (e.g., 0.001 m for 1 mm depth steps)
+                            default=None (uses lut_resolution[parameter] defined in config.py)
+        :param max_error: FLOAT of the max. acceptable HSI error of the LUT - if the LUT error is higher,
+                            the exact interpolation (interpolate_from_list) is used - default=lut_max_error
+        """
+        self.parameter = parameter
+        self.life_stage = life_stage
+        self.x_values, self.y_values = self._read_curve(fish_data)
+        if resolution is None:
+            resolution = lut_resolution[parameter]
+        self.resolution = float(resolution)
+        self.max_error = max_error
+
+        self.lut = np.array([])
+        self.lut_error = np.inf
+        self.use_lut = False
+        if self.x_values.size > 1:
+            self._make_lut()
+
+    def __call__(self, xi_values):
+        return self.interpolate(xi_values)
+
+    def get_curve(self):
+        """
+        Get the curve as nested list that can be used, for example, with HSIRaster.make_hsi
+        :return: nested list of [[par-values], [HSI-values]]
+        """
+        return [list(self.x_values), list(self.y_values)]
+
+    def interpolate(self, xi_values):
+        """
+        Get HSI values for parameter values, either from the LUT (if the LUT error is within max_error)
+            or through exact linear interpolation with interpolate_from_list
+        :param xi_values: numpy.ndarray of parameter values (any shape)
+        :return: numpy.ndarray of HSI values with the shape of xi_values (nan_value outside the curve range)
+        """
+        if not self.use_lut:
+            return interpolate_from_list(self.x_values, self.y_values, xi_values)
+
+        xi_values = np.asarray(xi_values, dtype=float)
+        # same range definition as interpolate_from_list: x_min < xi <= x_max (np.nan is never valid)
+        valid = (xi_values > self.x_values[0]) & (xi_values <= self.x_values[-1])
+        # direct index arithmetic (nearest LUT node) instead of a search
+        lut_index = np.rint((xi_values[valid] - self.x_values[0]) / self.resolution).astype(np.intp)
+
+        yi_values = np.full(xi_values.shape, nan_value, dtype=float)
+        yi_values[valid] = self.lut[lut_index]
+        return yi_values
+
+    def in_range(self, xi_values):
+        """
+        Check which parameter values are within the range of the curve (same definition as interpolate)
+        :param xi_values: numpy.ndarray of parameter values (any shape)
+        :return: numpy.ndarray (bool) - np.nan is never within the range
+        """
+        return curve_in_range(self.x_values, xi_values)
+
+    def _make_lut(self):
+        """
+        Precompute HSI values on a regular grid with self.resolution steps and evaluate the max. error
+            of looking up the nearest grid node (max. absolute curve slope x half a LUT step)
+        """
+        lut_size = int(np.ceil((self.x_values[-1] - self.x_values[0]) / self.resolution)) + 1
+        if lut_size > lut_max_size:
+            print("WARNING: LUT of %s-%s would have %i entries (using exact interpolation)." % (
+                self.parameter, self.life_stage, lut_size))
+            return
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slopes = np.diff(self.y_values) / np.diff(self.x_values)
+        if np.any(np.isnan(slopes)):
+            # zero-width segment without change in HSI
+            self.lut_error = np.inf
+        else:
+            self.lut_error = float(np.max(np.abs(slopes)) * self.resolution / 2.0)
+
+        self.lut = np.interp(self.x_values[0] + np.arange(lut_size) * self.resolution,
+                             self.x_values, self.y_values)
+        self.use_lut = self.lut_error <= self.max_error
+        if not self.use_lut:
+            logging.info("LUT error of {0}-{1} is {2} (using exact interpolation).".format(
+                self.parameter, self.life_stage, str(self.lut_error)))
+
+    def _read_curve(self, fish_data):
+        """
+        Extract valid (numeric) parameter-HSI pairs from the JSON object of a fish
+        :param fish_data: JSON object returned by read_json
+        :return: two numpy.ndarrays (parameter values and HSI values)
+        """
+        if isinstance(fish_data, str):
+            x_values, y_values = curve_registry.get(fish_data, self.parameter, self.life_stage)
+        else:
+            try:
+                x_values, y_values = read_curve_points(fish_data[self.parameter][self.life_stage], self.parameter,
+                                                         self.life_stage)
+            except KeyError:
+                x_values = None
+            if x_values is not None and not has_increasing_values(x_values):
+                # same rejection as for curves from fish json files (see CurveRegistry.load)
+                print("WARNING: Skipping the HSI curve of %s-%s (parameter values must increase)." % (
+                    self.parameter, self.life_stage))
+                x_values = None
+        if x_values is None:
+            print("ERROR: No HSI curve for %s-%s." % (self.parameter, self.life_stage))
+            return np.array([]), np.array([])
+        if x_values.size < 2:
+            print("WARNING: The HSI curve of %s-%s has less than two points." % (self.parameter, self.life_stage))
+        return x_values, y_values
+
+
+class CurveRegistry:
+    def __init__(self):
+        """
+        Store of pre-parsed HSI curves, where every fish json file is only parsed again if it changed
+            (modification time and size) and curves are contiguous float64 arrays per (parameter, life stage)
+        """
+        self.files = {}
+        self._lock = threading.Lock()
+
+    def get(self, json_file, parameter, life_stage):
+        """
+        Get the HSI curve of a parameter and life stage (the fish json file is loaded if required)
+        :param json_file: STR of a fish json file (e.g., "habitat/trout.json")
+        :param parameter: STR of the parameter (either "velocity", "depth", or "grain_size" - see par_dict)
+        :param life_stage: STR of the fish life stage (either "fry", "spawning", "juvenile", or "adult")
+        :return: TUPLE of two read-only numpy.ndarrays (parameter values and HSI values) or (None, None)
+        """
+        curves = self.load(json_file)
+        return curves.get((parameter, life_stage), (None, None))
+
+    def load(self, json_file):
+        """
+        Load (or re-use) all HSI curves of a fish json file, where curves with decreasing parameter
+            values are rejected
+        :param json_file: STR of a fish json file
+        :return: dictionary of {(parameter, life_stage): (parameter values, HSI values)}
+        """
+        json_file = os.path.abspath(json_file)
+        try:
+            stat = os.stat(json_file)
+        except OSError:
+            print("ERROR: Cannot access %s." % json_file)
+            return {}
+        fingerprint = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if json_file in self.files and self.files[json_file][0] == fingerprint:
+                return self.files[json_file][1]
+
+        try:
+            fish_data = read_json(json_file)
+        except (OSError, ValueError) as e:
+            # json.JSONDecodeError is a ValueError
+            print("ERROR: Cannot read HSI curves from %s (%s)." % (json_file, str(e)))
+            return {}
+        curves = {}
+        for parameter in par_dict.keys():
+            for life_stage, curve_points in fish_data.get(parameter, {}).items():
+                x_values, y_values = read_curve_points(curve_points, parameter, life_stage)
+                if not has_increasing_values(x_values):
+                    print("WARNING: Skipping the HSI curve of %s-%s in %s (parameter values must increase)." % (
+                        parameter, life_stage, json_file))
+                    continue
+                x_values.flags.writeable = False
+                y_values.flags.writeable = False
+                curves[(parameter, life_stage)] = (x_values, y_values)
+        with self._lock:
+            self.files[json_file] = (fingerprint, curves)
+        return curves
+
+    def load_many(self, json_files):
+        """
+        Load the HSI curves of many fish json files (e.g., all species of a basin study)
+        :param json_files: list of STR of fish json files or STR of a directory (all *.json files are loaded)
+        :return: dictionary of {json file name without directory and ending: {(parameter, life_stage): curve}}
+        """
+        if isinstance(json_files, str):
+            json_files = sorted([os.path.join(json_files, f) for f in os.listdir(json_files) if f.endswith(".json")])
+        return {os.path.basename(f).split(".json")[0]: self.load(f) for f in json_files}
+
+
+def curve_in_range(x_values, xi_values):
+    """
+    Check which parameter values are within the range of an HSI curve (same definition as interpolate_from_list)
+    :param x_values: numpy.ndarray or list of the (increasing) parameter values of the curve
+    :param xi_values: numpy.ndarray of parameter values (any shape)
+    :return: numpy.ndarray (bool) - np.nan is never within the range
+    """
+    with np.errstate(invalid="ignore"):
+        return (xi_values > x_values[0]) & (xi_values <= x_values[-1])
+
+
+def has_increasing_values(x_values):
+    """
+    Check if the parameter values of an HSI curve never decrease (required by interpolate_from_list)
+    :param x_values: numpy.ndarray or list of parameter values
+    :return: BOOL
+    """
+    return not np.any(np.diff(np.asarray(x_values, dtype=float)) < 0.0)
+
+
+def read_curve_points(curve_points, parameter, life_stage):
+    """
+    Extract valid (numeric) parameter-HSI pairs from the point records of an HSI curve
+    :param curve_points: list of dictionaries (e.g., trout["velocity"]["spawning"] = [{"u": 0.0198, "HSI": 0}, ...])
+    :param parameter: STR of the parameter (either "velocity", "depth", or "grain_size" - see par_dict)
+    :param life_stage: STR of the fish life stage (used in warnings)
+    :return: two contiguous numpy.ndarrays (float64) of parameter values and HSI values
+    """
+    par_pairs = []
+    for point in curve_points:
+        if str(point["HSI"]).__len__() > 0:
+            try:
+                par_pairs.append([float(point[par_dict[parameter]]), float(point["HSI"])])
+            except ValueError:
+                logging.warning("Invalid HSI curve entry for {0} in parameter {1}.".format(life_stage, parameter))
+    curve = np.array(par_pairs, dtype=np.float64).reshape(-1, 2)
+    return np.ascontiguousarray(curve[:, 0]), np.ascontiguousarray(curve[:, 1])
+
+
+# HSI curves of all fish json files used in this process
+curve_registry = CurveRegistry()
@@ -2,7 +2,12 @@ from fun import *
 
 
 class Raster:
-    def __init__(self, file_name, band=1, raster_array=None, epsg=4326, geo_info=False):
+    # quantized dtype policies ("uint8" or "uint16") only apply to HSI values between 0.0 and 1.0 when saved
+    # (see get_file_dtype_policy), which HSIRaster and cHSI expressions set to True
+    hsi_values = False
+
+    def __init__(self, file_name, band=1, raster_array=None, epsg=4326, geo_info=False, streaming=False,
+                 dtype_policy=None, memmap=False):
         """
         A GeoTiff Raster dataset (wrapped osgeo.gdal. Dataset)
         :param file_name: STR of a GeoTiff file name including directory (must end on ".tif")
@@ -11,37 +16,71 @@ class Raster:
         :param epsg: INT of EPSG:XXXX projection to use - default=4326
         :param geo_info: TUPLE defining a gdal.DataSet.GetGeoTransform object (supersedes origin, pixel_width, pixel_height)
                             default=False
+        :param streaming: BOOL - if True, the array is not loaded, but read (and written with save) in
+                            block-aligned windows of max. tile_budget pixels (config.py) - default=False
+        :param dtype_policy: STR of the array dtype policy ("float64", "float32", "uint8", or "uint16", see
+                            geo.dtype_policies), where "uint8" and "uint16" only quantize HSI values and other
+                            rasters are saved as float32 (see get_file_dtype_policy) - default=None uses
+                            raster_dtype (config.py)
+        :param memmap: BOOL - if True, the array is a read-only numpy.memmap of the raw pixel values (uncompressed
+                            GeoTIFF or .npy sidecar, see geo.band2memmap), where no-data values are only replaced
+                            with np.nan in read_window (see also nodata_mask) - default=False
+
+        If nodata_masks=True (config.py), valid pixels are defined by the GDAL mask band and kept as bit-packed
+            mask (see get_valid_mask), which is combined by operators and written as mask band by save.
         """
         # extract raster name and retrieve geospatial information
-        self.name = "" # EXTRACT FROM FILE NAME
+        self.name = file_name.split("/")[-1].split("\\")[-1].split(".")[0]
 
-        if not os.path.exists(file_name):
+        if not geo.raster_exists(file_name):
             # this creates a new Raster if the provided file name does not exist)
             if raster_array is None:
                 geo.create_raster(file_name, raster_array=np.zeros((100, 100)), epsg=epsg, geo_info=geo_info)
             else:
                 geo.create_raster(file_name, raster_array=raster_array, epsg=epsg, geo_info=geo_info)
 
-        self.dataset, self.array, self.geo_transformation = # USE GEO.RASTER2ARRAY FUNCTION TO LOAD RASTER DATA AND GEOTRANFORMATION
+        self.streaming = streaming
+        self.dtype_policy = dtype_policy or raster_dtype
+        self.dtype = geo.get_dtype_policy(self.dtype_policy)["dtype"]
+        self.memmap = False
+        self.nodata = None
+        self.mask = None
+        self._nodata_mask = None
+        if streaming:
+            # keep the band open and read tiles on demand (see read_window)
+            self.dataset, self.band = geo.open_raster(file_name, band_number=band)
+            self.array = None
+            self.geo_transformation = self.dataset.GetGeoTransform()
+        elif memmap:
+            # map the raw pixel values without reading (and copying) the band
+            self.dataset, raster_band = geo.open_raster(file_name, band_number=band)
+            self.array = geo.band2memmap(self.dataset, band_number=band)
+            self.memmap = self.array is not None
+            self.nodata = raster_band.GetNoDataValue()
+            self.scale_offset = (raster_band.GetScale(), raster_band.GetOffset())
+            self.geo_transformation = self.dataset.GetGeoTransform()
+            self.band = None
+            if self.memmap and nodata_masks:
+                self.mask = geo.pack_mask(geo.get_valid_mask(raster_band))
+        if not streaming and not self.memmap:
+            self.dataset, self.array, self.geo_transformation = geo.raster2array(file_name, band_number=band,
+                                                                                 dtype=self.dtype,
+                                                                                 use_mask=nodata_masks)
+            self.band = None
+            if nodata_masks:
+                self.mask = geo.pack_mask(~np.isnan(self.array))
+        self.shape = (self.dataset.RasterYSize, self.dataset.RasterXSize)
+
+        self.srs = geo.get_srs(self.dataset)
+        self.epsg = int(self.srs.GetAuthorityCode(None))
 
-        self.srs = # USE GEO.GET_SRS FUNCTION TO OPEN THE SPATIAL REFERENCE SYSTEM
-        self.epsg = # READ THE EPSG AUTHORITY CODE FROM SELF.SRS
-        
     def __truediv__(self, constant_or_raster):
         """
         Division of the input Raster by a constant or another Raster
         :param constant_or_raster: Constant (numeric) or Raster with the same number of rows and columns as the input Raster
         :return: Raster
         """
-        
-        # THIS IS AN EXAMPLE TO IMPLEMENT THE USAGE OF THE / OPERATOR BETWEEN TWO RASTER OBJECTS
-        
-        try:
-            self.array = np.divide(self.array, constant_or_raster.array)
-        except AttributeError:
-            self.array /= constant_or_raster
-        return self._make_raster("div")
-    
+        return self._make_raster("div", np.divide, constant_or_raster)
 
     def __add__(self, constant_or_raster):
         """
@@ -49,10 +88,7 @@ class Raster:
         :param constant_or_raster: Constant (numeric) or Raster with the same number of rows and columns as the input Raster
         :return: Raster
         """
-        
-        # WRITE MAGIC METHOD TO USE + OPERATOR
-        
-        pass
+        return self._make_raster("add", np.add, constant_or_raster)
 
     def __mul__(self, constant_or_raster):
         """
@@ -60,11 +96,7 @@ class Raster:
         :param constant_or_raster: Constant (numeric) or Raster with the same number of rows and columns as the input Raster
         :return: Raster
         """
-        
-        # WRITE MAGIC METHOD TO USE * OPERATOR
-        
-        pass
-
+        return self._make_raster("mul", np.multiply, constant_or_raster)
 
     def __pow__(self, constant_or_raster):
         """
@@ -72,11 +104,7 @@ class Raster:
         :param constant_or_raster:
         :return: Raster
         """
-        
-        # WRITE MAGIC METHOD TO USE ** (POWER) OPERATOR
-        
-        pass
-
+        return self._make_raster("pow", np.power, constant_or_raster)
 
     def __sub__(self, constant_or_raster):
         """
@@ -84,30 +112,336 @@ class Raster:
         :param constant_or_raster: Constant (numeric) or Raster with the same number of rows and columns as the input Raster
         :return: Raster
         """
-        # WRITE MAGIC METHOD TO USE - OPERATOR
-        
-        pass
+        return self._make_raster("sub", np.subtract, constant_or_raster)
+
+    def compute(self):
+        """
+        Evaluate the Raster (Rasters loaded from files are already evaluated, see RasterExpression)
+        :return: Raster
+        """
+        return self
+
+    def get_file_dtype_policy(self):
+        """
+        Get the dtype policy of saved GeoTIFFs, where quantized policies ("uint8" or "uint16") only apply to HSI
+            values (HSIRaster and cHSI) - other rasters (e.g., water depth) would be clipped to [0, 1] and are
+            saved as float32 instead
+        :return: STR of a dtype policy (see geo.dtype_policies)
+        """
+        if not self.hsi_values and geo.get_dtype_policy(self.dtype_policy)["quantized"]:
+            return "float32"
+        return self.dtype_policy
+
+    def get_windows(self):
+        """
+        Get the windows for reading and writing the raster tile-by-tile
+        :return: list of TUPLEs (x_offset, y_offset, x_size, y_size) - one window of the entire raster if not streaming
+        """
+        if self.streaming:
+            return geo.get_block_windows(self.band, max_pixels=tile_budget)
+        if self.memmap:
+            # row windows of max. tile_budget pixels (limits the memory of no-data replacement)
+            n_rows = max(1, int(tile_budget // self.shape[1]))
+            return [(0, y_off, self.shape[1], min(n_rows, self.shape[0] - y_off))
+                    for y_off in range(0, self.shape[0], n_rows)]
+        return [(0, 0, self.shape[1], self.shape[0])]
 
+    @property
+    def nodata_mask(self):
+        """
+        numpy.ndarray (bool) of no-data pixels of memory-mapped Rasters (computed on first access)
+            or of np.nan pixels (other Rasters)
+        """
+        if self._nodata_mask is None:
+            if self.mask is not None:
+                self._nodata_mask = ~self.get_valid_mask()
+            elif self.memmap:
+                self._nodata_mask = self.array == self.nodata
+            else:
+                self._nodata_mask = np.isnan(self.read_window())
+        return self._nodata_mask
+
+    def get_valid_mask(self, window=None):
+        """
+        Get the valid (not no-data) pixels of a raster window (tile)
+        :param window: TUPLE of (x_offset, y_offset, x_size, y_size) in pixels - default=None returns the entire mask
+        :return: numpy.ndarray (bool)
+        """
+        if self.mask is not None:
+            return geo.unpack_mask(self.mask, self.shape[1], window)
+        if nodata_masks and self.band is not None:
+            # streaming: read the window of the GDAL mask band
+            return geo.get_valid_mask(self.band, window=window)
+        return ~np.isnan(self.read_window(window))
 
-    def _make_raster(self, file_marker):
+    def read_window(self, window=None):
+        """
+        Get the array of a raster window (tile)
+        :param window: TUPLE of (x_offset, y_offset, x_size, y_size) in pixels - default=None returns the entire array
+        :return: numpy.ndarray
+        """
+        if self.band is None:
+            raster_array = self.array
+            if window is not None:
+                raster_array = raster_array[window[1]:window[1] + window[3], window[0]:window[0] + window[2]]
+            if self.memmap:
+                # copy of the (mapped) raw values, where no-data values become np.nan
+                valid_mask = None if self.mask is None else geo.unpack_mask(self.mask, self.shape[1], window)
+                return geo.mask_nodata(raster_array, self.nodata, scale=self.scale_offset[0],
+                                       offset=self.scale_offset[1], dtype=self.dtype, valid_mask=valid_mask)
+            if raster_array.dtype.kind == "u":
+                # quantized (e.g., HSIRaster with dtype_policy="uint8") arrays are converted tile-by-tile
+                return geo.dequantize(raster_array, self.dtype_policy)
+            return raster_array
+        return geo.band2array(self.band, window=window, dtype=self.dtype, use_mask=nodata_masks)
+
+    def _make_raster(self, file_marker, operator=None, constant_or_raster=None):
         """
         file_markers are string variables used in the magic methods
+        :param file_marker: STR added to the name of the (temporary) GeoTIFF file in the cache (see get_cache_file_name)
+        :param operator: numpy.ufunc to apply to self.array and constant_or_raster (None uses self.array as is)
+        :param constant_or_raster: Constant (numeric) or Raster (second operand of operator)
+        :return: RasterExpression (if lazy_rasters=True in config.py or streaming) or Raster of the temporary calculation
         """
-        
-        f_ending = # MAKE A VALID FILE NAME ENDING ON  ".TIF"
-        
-        # USE GEO.CREATE_RASTER(...) TO STORE THE TEMPORARY CALCULATION DATASET IN THE CACHE FOLDER
-        
-        return # RASTER OBJECT OF THE TEMPORARY CALCULATION
+        operands = [self] if operator is None else [self, constant_or_raster]
+        if lazy_rasters or self.streaming:
+            return RasterExpression(file_marker, operator, operands)
+
+        # intermediate GeoTIFFs are kept in memory (/vsimem/) or on disk according to cache_backend (config.py)
+        f_ending = "__{0}{1}__.tif".format(file_marker, create_random_string(4))
+        new_array = RasterExpression.apply(operator, operands)
+        valid_mask = RasterExpression.combine_masks(operands, new_array) if nodata_masks else None
+        cache_name = get_cache_file_name(self.name + f_ending, n_bytes=np.size(new_array) * 4)
+        geo.create_raster(cache_name, new_array, epsg=self.epsg, nan_val=nan_value,
+                          geo_info=self.geo_transformation, valid_mask=valid_mask)
+        return Raster(cache_name, dtype_policy=self.dtype_policy)
 
-    def save(self, file_name=str(os.path.abspath("") + "\\00_%s.tif" % create_random_string(7))):
+    def save(self, file_name=str(os.path.abspath("") + "\\00_%s.tif" % create_random_string(7)),
+             profile=config_profile, overviews=None):
         """
         Save raster to file (GeoTIFF format)
         :param file_name: string of file name including directory and must end on ".tif"
+        :param profile: string of a GeoTIFF creation option profile (e.g., "deflate" for tiled and compressed files,
+                            see geo.gtiff_profiles) - default=config_profile uses gtiff_profile (config.py)
+                            and None writes striped and uncompressed GeoTIFFs
+        :param overviews: bool - if True, overviews are added - default=None uses gtiff_overviews (config.py)
         :return: 0 = success; -1 = failed
         """
         print("Saving Raster as %s ..." % file_name)
-        
-        # USE THE GEO.CREATE_RASTER FUNCTION AND RETURN THE SAVE STATUS (0=SUCCESS)       
+        profile = get_gtiff_profile(profile)
+        overviews = gtiff_overviews if overviews is None else overviews
+        # lazy expressions (e.g., the cHSI combination) are evaluated in this stage
+        with geo.trace_stage("Raster.save", pixels=self.shape[0] * self.shape[1], raster=self.name):
+            if self.streaming or self.memmap:
+                return self._save_windows(file_name, profile=profile, overviews=overviews)
+            save_status = geo.create_raster(file_name, self.array, epsg=self.epsg, nan_val=nan_value,
+                                            geo_info=self.geo_transformation,
+                                            dtype_policy=self.get_file_dtype_policy(), profile=profile,
+                                            overviews=overviews,
+                                            valid_mask=self.get_valid_mask() if nodata_masks else None)
+        return save_status
+
+    def _save_windows(self, file_name, profile=None, overviews=False):
+        """
+        Evaluate and write the raster window-by-window (streaming mode), where peak memory is limited
+            by the tile_budget (config.py) rather than by the raster size (and geo.io_buffers windows
+            waiting to be written)
+        :param file_name: string of file name including directory and must end on ".tif"
+        :param profile: string of a GeoTIFF creation option profile (see save)
+        :param overviews: bool - if True, overviews are added after all windows are written
+        :return: 0 = success; -1 = failed
+        """
+        dtype_policy = self.get_file_dtype_policy()
+        new_raster = geo.create_raster_dataset(file_name, self.shape[1], self.shape[0], epsg=self.epsg,
+                                               nan_val=nan_value, geo_info=self.geo_transformation,
+                                               dtype_policy=dtype_policy, profile=profile,
+                                               mask_band=nodata_masks)
+        if new_raster is None:
+            return -1
+        band = new_raster.GetRasterBand(1)
+        # windows are written by a background thread while the next window is evaluated
+        with geo.WriteBehind() as writer:
+            for window in self.get_windows():
+                # the mask of the window is only available after reading (evaluating) it
+                window_array = self.read_window(window)
+                writer.write(band, window_array, window=window, nan_val=nan_value, dtype_policy=dtype_policy,
+                             valid_mask=self.get_valid_mask(window) if nodata_masks else None)
+        band.FlushCache()
+        if overviews:
+            return geo.build_overviews(new_raster)
+        return 0
+
+
+class RasterExpression(Raster):
+    def __init__(self, file_marker, operator, operands):
+        """
+        A lazy node of Raster operations (e.g., (hsi_u * hsi_h) ** 0.5), which is only evaluated with
+            compute() or save() in one pass without intermediate GeoTIFF files
+        :param file_marker: STR of the operation (e.g., "mul" - same as in Raster._make_raster)
+        :param operator: numpy.ufunc (e.g., np.multiply) or None to use the first operand as is
+        :param operands: list of Rasters (incl. RasterExpressions) and constants, where
+                            the first operand must be a Raster that defines the georeference
+        """
+        self.name = operands[0].name
+        self.streaming = any([isinstance(operand, Raster) and operand.streaming for operand in operands])
+        self.dtype_policy = operands[0].dtype_policy
+        self.dtype = operands[0].dtype
+        # the cHSI combination and the HSI values of an HSIRaster may be saved as quantized values
+        self.hsi_values = file_marker == "chsi" or (file_marker == "hsi" and operands[0].hsi_values)
+        self.memmap = False
+        self.mask = None
+        self._nodata_mask = None
+        self._last_valid = (None, None)
+        self.file_marker = file_marker
+        self.operator = operator
+        self.operands = operands
+        self.dataset = None
+        self.band = None
+        self.shape = operands[0].shape
+        self.srs = operands[0].srs
+        self.epsg = operands[0].epsg
+        self.geo_transformation = operands[0].geo_transformation
+        self._array = None
+
+    @property
+    def array(self):
+        """
+        numpy.ndarray of the expression (evaluated on first access)
+        """
+        if self._array is None:
+            self.compute()
+        return self._array
+
+    @array.setter
+    def array(self, raster_array):
+        self._array = raster_array
+
+    @staticmethod
+    def apply(operator, operands, out=None, dtype=None):
+        """
+        Apply an operator to the arrays of operands (Rasters) or constants
+        :param operator: numpy.ufunc or None (returns the first operand)
+        :param operands: list of numpy.ndarrays, Rasters, and/or constants
+        :param out: numpy.ndarray to write the result to (default: None creates a new array)
+        :param dtype: numpy dtype of the calculation with numpy.ufunc operators, which may differ from the dtype
+                        of out (default: None uses the dtype of the operands)
+        :return: numpy.ndarray
+        """
+        arrays = []
+        for operand in operands:
+            try:
+                # read_window returns float values also for quantized arrays
+                arrays.append(operand.read_window())
+            except AttributeError:
+                arrays.append(operand)
+        if operator is None:
+            if out is None:
+                return np.array(arrays[0])
+            out[...] = arrays[0]
+            return out
+        if dtype is None or not isinstance(operator, np.ufunc):
+            return operator(*arrays, out=out)
+        return operator(*arrays, out=out, dtype=dtype)
+
+    @staticmethod
+    def combine_masks(operands, out, window=None):
+        """
+        Combine the valid pixels of all Raster operands of an operator and its result (np.nan is never valid)
+        :param operands: list of Rasters and/or constants
+        :param out: numpy.ndarray of the operator result
+        :param window: TUPLE of (x_offset, y_offset, x_size, y_size) in pixels - default=None uses the entire rasters
+        :return: numpy.ndarray (bool)
+        """
+        valid_mask = ~np.isnan(out)
+        for operand in operands:
+            if isinstance(operand, Raster):
+                valid_mask &= operand.get_valid_mask(window)
+        return valid_mask
+
+    def compute(self):
+        """
+        Evaluate the expression (all nested operations in one pass) and keep the result in memory
+        :return: RasterExpression (with evaluated array)
+        """
+        if self._array is None:
+            self._array = self._evaluate()
+            if nodata_masks:
+                self.mask = geo.pack_mask(self._last_valid[1])
+                self._last_valid = (None, None)
+        return self
+
+    def get_valid_mask(self, window=None):
+        """
+        Get the valid pixels of the expression for a raster window (tile), where nodata_masks=True (config.py)
+            re-uses the mask of the last evaluated window
+        :param window: TUPLE of (x_offset, y_offset, x_size, y_size) in pixels - default=None returns the entire mask
+        :return: numpy.ndarray (bool)
+        """
+        if self._array is not None:
+            return Raster.get_valid_mask(self, window)
+        if not nodata_masks:
+            return ~np.isnan(self._evaluate(window))
+        if self._last_valid[1] is None or self._last_valid[0] != window:
+            self._evaluate(window)
+        return self._last_valid[1]
+
+    def get_windows(self):
+        """
+        Get the windows for evaluating the expression tile-by-tile (aligned with the first streaming operand)
+        :return: list of TUPLEs (x_offset, y_offset, x_size, y_size)
+        """
+        for operand in self.operands:
+            if isinstance(operand, Raster) and operand.streaming:
+                return operand.get_windows()
+        return Raster.get_windows(self)
+
+    def read_window(self, window=None):
+        """
+        Evaluate the expression for a raster window (tile) only
+        :param window: TUPLE of (x_offset, y_offset, x_size, y_size) in pixels - default=None evaluates the entire raster
+        :return: numpy.ndarray
+        """
+        if self._array is None:
+            return self._evaluate(window)
+        return Raster.read_window(self, window)
+
+    def _evaluate(self, window=None):
+        """
+        Evaluate the expression tree, where nested (not yet evaluated) expressions are calculated in
+            Float32 buffers that are re-used as output of the operator. Every node emulates the GeoTIFF
+            (Float32, nodata=nan_value) round trip of the eager path, where the operator is calculated
+            with the dtype that the eager path reads intermediate rasters with (float64 by default).
+            If nodata_masks=True (config.py), the valid pixels of the operands are combined instead
+            (see combine_masks) and nan_value remains a valid value.
+        :param window: TUPLE of (x_offset, y_offset, x_size, y_size) in pixels - default=None evaluates the entire raster
+        :return: numpy.ndarray (dtype=np.float32)
+        """
+        out = None
+        operands = []
+        calc_dtypes = []
+        for operand in self.operands:
+            if isinstance(operand, RasterExpression) and operand._array is None:
+                # the eager path reads the Float32 intermediate back with the dtype of the dtype policy
+                calc_dtypes.append(operand.dtype if np.dtype(operand.dtype).kind == "f" else np.float32)
+                operand = operand._evaluate(window)
+                if out is None:
+                    # re-use the buffer of the nested expression
+                    out = operand
+            elif isinstance(operand, Raster):
+                operand = operand.read_window(window)
+                calc_dtypes.append(operand.dtype)
+            else:
+                calc_dtypes.append(operand)
+            operands.append(operand)
+        if out is None:
+            out = np.empty(np.shape(operands[0]), dtype=np.float32)
 
-        return # SAVE_STATUS
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.apply(self.operator, operands, out=out, dtype=np.result_type(*calc_dtypes))
+        if nodata_masks:
+            valid_mask = self.combine_masks(self.operands, out, window=window)
+            out[~valid_mask] = np.nan
+            self._last_valid = (window, valid_mask)
+        else:
+            out[out == nan_value] = np.nan
+        return out
@@ -1,31 +1,113 @@
 from raster import *
+from hsi_curve import HSICurve, curve_in_range, has_increasing_values
 
 
 class HSIRaster(Raster):
-    def __init__(self, file_name, hsi_curve, band=1, raster_array=None, geo_info=False):
+    hsi_values = True
+
+    def __init__(self, file_name, hsi_curve, band=1, raster_array=None, geo_info=False, streaming=False,
+                 dtype_policy=None, memmap=False):
         """
         A GeoTiff Raster dataset (wrapped osgeo.gdal. Dataset)
         :param file_name: STR of a GeoTiff file name including directory (must end on ".tif")
         :param hsi_curve: nested list of [[par-values], [HSI-values]], where
                     [par-values] (e.g., velocity values) and
-                    [HSI-values] must have the same length.
+                    [HSI-values] must have the same length; or an HSICurve object (LUT-based)
         :param band: INT of the band number to use
+        :param streaming: BOOL - if True, HSI values are interpolated tile-by-tile when the raster is read
+                    or saved (see Raster) - default=False
+        :param dtype_policy: STR of the array dtype policy, where "uint8" or "uint16" keep HSI values as
+                    quantized integer codes (see Raster) - default=None uses raster_dtype (config.py)
+        :param memmap: BOOL - if True, parameter values are memory-mapped and HSI values are interpolated
+                    tile-by-tile like in streaming mode (see Raster) - default=False
         """
-        Raster.__init__(self, file_name=file_name, band=band, raster_array=raster_array, geo_info=geo_info)
+        Raster.__init__(self, file_name=file_name, band=band, raster_array=raster_array, geo_info=geo_info,
+                        streaming=streaming, dtype_policy=dtype_policy, memmap=memmap)
+        self.hsi_curve = hsi_curve
+        self._last_tile = (None, None, None)
         self.make_hsi(hsi_curve)
 
     def make_hsi(self, hsi_curve):
         """
         Turn array into hsi-value array based on a step function of a hsi curve that is used
             for linear interpolation of hsi values from parameter values.
+        :param hsi_curve: nested list of [[par-values], [HSI-values]] or HSICurve object
         :return: Raster
         """
-        par_values = hsi_curve[0]
-        hsi_values = hsi_curve[1]
-        try:
-            with np.nditer(self.array, flags=["external_loop"], op_flags=["readwrite"]) as it:
-                for x in it:
-                    x[...] = interpolate_from_list(par_values, hsi_values, x)
-        except AttributeError:
-            print("WARNING: np.array is one-dimensional.")
+        self.hsi_curve = hsi_curve
+        self._last_tile = (None, None, None)
+        if not isinstance(hsi_curve, HSICurve) and not has_increasing_values(hsi_curve[0]):
+            print("WARNING: The parameter values of the HSI curve of %s must increase." % self.name)
+        if not (self.streaming or self.memmap):
+            with geo.trace_stage("make_hsi", pixels=self.shape[0] * self.shape[1], raster=self.name):
+                hsi_array = self._interpolate(self.array)
+                nan_val = nan_value
+                if nodata_masks:
+                    # parameter values beyond the HSI curve are no-data, while HSI=0.0 remains valid
+                    valid_mask = self.get_valid_mask() & self._in_curve_range(self.array)
+                    hsi_array[~valid_mask] = np.nan
+                    self.mask = geo.pack_mask(valid_mask)
+                    nan_val = np.nan
+                if geo.get_dtype_policy(self.dtype_policy)["quantized"]:
+                    # HSI values (0.0 to 1.0) are stored as 8/16-bit integer codes
+                    self.array = geo.quantize(hsi_array, self.dtype_policy, nan_val=nan_val)
+                else:
+                    self.array[...] = hsi_array
+        # streaming and memmap: HSI values are interpolated in read_window
         return self._make_raster("hsi")
+
+    def read_window(self, window=None):
+        """
+        Get the HSI array of a raster window (tile)
+        :param window: TUPLE of (x_offset, y_offset, x_size, y_size) in pixels - default=None returns the entire array
+        :return: numpy.ndarray
+        """
+        if not (self.streaming or self.memmap):
+            return Raster.read_window(self, window)
+        if window is not None and self._last_tile[0] == window:
+            # the same tile is often requested twice (HSI output and cHSI combination)
+            return self._last_tile[1]
+        hsi_array = Raster.read_window(self, window)
+        valid_mask = None
+        if nodata_masks:
+            valid_mask = Raster.get_valid_mask(self, window) & self._in_curve_range(hsi_array)
+        hsi_array[...] = self._interpolate(hsi_array)
+        if valid_mask is not None:
+            hsi_array[~valid_mask] = np.nan
+        self._last_tile = (window, hsi_array, valid_mask)
+        return hsi_array
+
+    def get_valid_mask(self, window=None):
+        """
+        Get the valid pixels of a raster window (tile), which are valid parameter pixels within the range of
+            the HSI curve if nodata_masks=True (config.py)
+        :param window: TUPLE of (x_offset, y_offset, x_size, y_size) in pixels - default=None returns the entire mask
+        :return: numpy.ndarray (bool)
+        """
+        if nodata_masks and (self.streaming or self.memmap):
+            if window is None or self._last_tile[0] != window:
+                self.read_window(window)
+            return self._last_tile[2]
+        return Raster.get_valid_mask(self, window)
+
+    def _in_curve_range(self, par_array):
+        """
+        Get the parameter values within the range of self.hsi_curve (same definition as interpolate_from_list)
+        :param par_array: numpy.ndarray of parameter values (e.g., flow velocity)
+        :return: numpy.ndarray (bool) - np.nan is never within the range
+        """
+        if isinstance(self.hsi_curve, HSICurve):
+            return self.hsi_curve.in_range(par_array)
+        return curve_in_range(self.hsi_curve[0], par_array)
+
+    def _interpolate(self, par_array):
+        """
+        Interpolate HSI values from parameter values with self.hsi_curve
+        :param par_array: numpy.ndarray of parameter values (e.g., flow velocity)
+        :return: numpy.ndarray of HSI values
+        """
+        if isinstance(self.hsi_curve, HSICurve):
+            # HSICurve objects use their precompiled lookup table (if accurate enough)
+            return self.hsi_curve.interpolate(par_array)
+        # interpolate all pixels at once (vectorized) rather than row-by-row with np.nditer
+        return interpolate_from_list(self.hsi_curve[0], self.hsi_curve[1], par_array)
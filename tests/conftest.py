@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of this repository are imported from the repository root (like the scripts)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
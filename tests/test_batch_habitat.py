@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("gdal")
+
+import geo_utils as geo
+from batch_habitat import get_stage_curves, run_scenario
+from create_hsi_rasters import combine_hsi_rasters, get_hsi_curve, get_hsi_raster
+from fun import par_dict
+from uha_calculator import UHACalculator
+
+trout_json = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "habitat", "trout.json")
+life_stages = ["fry", "juvenile", "adult"]
+
+
+@pytest.fixture
+def par_tifs():
+    rng = np.random.default_rng(0)
+    tifs = {}
+    for par, high in (("velocity", 2.0), ("depth", 1.5)):
+        tifs[par] = "/vsimem/__test__/%s.tif" % par
+        geo.create_raster(tifs[par], rng.uniform(0.0, high, (61, 47)), epsg=2056, geo_info=(0, 1, 0, 0, 0, -1))
+    yield tifs
+    geo.remove_vsi_files("/vsimem/__test__/")
+
+
+def test_run_scenario_matches_create_hsi_rasters(par_tifs):
+    stage_curves = get_stage_curves(trout_json, life_stages, list(par_tifs.keys()))
+    assert not any([curve.use_lut for curves in stage_curves.values() for curve in curves.values()])
+    results = run_scenario("Q", par_tifs, stage_curves, "/vsimem/__test__/")
+    assert sorted(results.keys()) == sorted(stage_curves.keys())
+
+    for stage in stage_curves.keys():
+        # serial workflow of create_hsi_rasters.main (exact interpolation of the HSI curves)
+        hsi_curve = get_hsi_curve(trout_json, life_stage=stage, parameters=list(par_tifs.keys()))
+        hsi_rasters = [get_hsi_raster(tif, [list(hsi_curve[par][par_dict[par]]), list(hsi_curve[par]["HSI"])])
+                       for par, tif in par_tifs.items()]
+        combine_hsi_rasters(hsi_rasters).save("/vsimem/__test__/chsi_%s.tif" % stage)
+        np.testing.assert_array_equal(geo.raster2array("/vsimem/__test__/chsi_Q_%s.tif" % stage)[1],
+                                      geo.raster2array("/vsimem/__test__/chsi_%s.tif" % stage)[1])
+
+
+def test_run_scenario_uha_matches_serial_chsi(par_tifs):
+    stage_curves = get_stage_curves(trout_json, ["adult"], list(par_tifs.keys()))
+    hsi_curve = get_hsi_curve(trout_json, life_stage="adult", parameters=list(par_tifs.keys()))
+    hsi_rasters = [get_hsi_raster(tif, [list(hsi_curve[par][par_dict[par]]), list(hsi_curve[par]["HSI"])])
+                   for par, tif in par_tifs.items()]
+    chsi = combine_hsi_rasters(hsi_rasters).array
+    # a threshold that equals a (Float32) cHSI value of the serial workflow
+    valid_chsi = np.sort(chsi[~np.isnan(chsi)])
+    threshold = float(valid_chsi[valid_chsi.size // 2])
+    serial = UHACalculator(1.0, threshold=threshold)
+    serial.add(chsi)
+    results = run_scenario("Q", par_tifs, stage_curves, "/vsimem/__test__/", threshold=threshold)
+    assert results["adult"]["threshold"] == serial.get_results()["threshold"]
+    np.testing.assert_array_equal(results["adult"]["histogram"], serial.get_results()["histogram"])
+    assert results["adult"]["weighted"] == pytest.approx(serial.get_results()["weighted"])
+
+
+def test_run_scenario_skips_stages_without_output_raster(par_tifs, tmp_path):
+    stage_curves = get_stage_curves(trout_json, life_stages, list(par_tifs.keys()))
+    output_dir = str(tmp_path / "missing") + os.sep
+    assert run_scenario("Q", par_tifs, stage_curves, output_dir) == {}
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+gdal = pytest.importorskip("gdal")
+
+import fun
+
+
+@pytest.fixture
+def disk_cache(tmp_path, monkeypatch):
+    cache_folder = str(tmp_path / "__cache__") + os.sep
+    monkeypatch.setattr(fun, "cache_folder", cache_folder)
+    monkeypatch.setattr(fun, "cache_backend", "vsimem")
+    return cache_folder
+
+
+def test_cache_does_not_create_disk_folder(disk_cache):
+    @fun.cache
+    def run():
+        assert fun.get_cache_file_name("x.tif").startswith(fun.vsimem_cache_folder)
+
+    run()
+    assert not os.path.exists(disk_cache)
+
+
+def test_spilled_files_are_removed(disk_cache, monkeypatch):
+    monkeypatch.setattr(fun, "cache_memory_limit", 0)
+
+    @fun.cache
+    def run():
+        file_name = fun.get_cache_file_name("x.tif", n_bytes=1)
+        assert file_name == disk_cache + "x.tif"
+        open(file_name, "w").close()
+
+    run()
+    assert not os.path.exists(disk_cache)
@@ -0,0 +1,161 @@
+import os
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("gdal")
+
+import create_hsi_rasters
+import fun
+import geo_utils as geo
+import raster
+from create_hsi_rasters import combine_hsi_arrays, combine_hsi_rasters, get_hsi_raster, make_chsi_parallel, \
+    save_hsi_raster
+from hsi_cache import HSICache
+
+
+@pytest.fixture
+def hsi_arrays():
+    rng = np.random.default_rng(0)
+    arrays = [rng.uniform(0.0, 1.0, (37, 53)) for i in range(3)]
+    arrays[0][2, 3] = 0.0
+    arrays[1][4, 5] = np.nan
+    return arrays
+
+
+@pytest.mark.parametrize("method", ["geometric_mean", "product"])
+def test_log_space_matches_product(hsi_arrays, method):
+    product = combine_hsi_arrays(hsi_arrays, method=method, log_space=False)
+    log_sum = combine_hsi_arrays(hsi_arrays, method=method, log_space=True)
+    np.testing.assert_allclose(log_sum, product, rtol=1e-12, atol=0.0)
+    assert log_sum[2, 3] == 0.0
+    assert np.isnan(log_sum[4, 5])
+
+
+def test_weighted_geometric_mean(hsi_arrays):
+    weights = np.array([2.0, 1.0, 0.5])
+    expected = np.prod([hsi ** w for hsi, w in zip(hsi_arrays, weights / weights.sum())], axis=0)
+    result = combine_hsi_arrays(hsi_arrays, weights=weights)
+    np.testing.assert_allclose(result, expected, rtol=1e-12, atol=0.0)
+
+
+@pytest.mark.parametrize("log_space", [False, True])
+def test_chunks_smaller_than_one_row(hsi_arrays, log_space):
+    expected = combine_hsi_arrays(hsi_arrays, log_space=log_space)
+    result = combine_hsi_arrays(hsi_arrays, log_space=log_space, chunk_size=3)
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("log_space", [False, True])
+@pytest.mark.parametrize("out_index", [0, 2])
+def test_out_aliases_input(hsi_arrays, log_space, out_index):
+    expected = combine_hsi_arrays(hsi_arrays, log_space=log_space)
+    result = combine_hsi_arrays(hsi_arrays, log_space=log_space, out=hsi_arrays[out_index], chunk_size=53)
+    assert result is hsi_arrays[out_index]
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_zero_weights_ignore_arrays(hsi_arrays):
+    expected = combine_hsi_arrays([hsi_arrays[0], hsi_arrays[2]])
+    result = combine_hsi_arrays(hsi_arrays, weights=[1.0, 0.0, 1.0])
+    np.testing.assert_allclose(result, expected, rtol=1e-12, atol=0.0)
+    # the np.nan pixel of the ignored array does not become no-data
+    assert not np.isnan(result[4, 5])
+
+
+@pytest.mark.parametrize("weights", [[1.0, 1.0], [1.0, -1.0, 1.0], [0.0, 0.0, 0.0], [1.0, np.nan, 1.0]])
+def test_invalid_weights_raise(hsi_arrays, weights):
+    with pytest.raises(ValueError):
+        combine_hsi_arrays(hsi_arrays, weights=weights)
+    # combine_hsi_rasters raises before it builds or evaluates the cHSI raster
+    with pytest.raises(ValueError):
+        combine_hsi_rasters([None, None, None], weights=weights)
+
+
+@pytest.mark.parametrize("dtype_policy", ["float64", "float32", "uint8"])
+def test_parallel_chsi_matches_serial_chsi(tmp_path, monkeypatch, dtype_policy):
+    cache_folder = str(tmp_path / "cache") + "/"
+    monkeypatch.setattr(fun, "cache_folder", cache_folder)
+    monkeypatch.setattr(create_hsi_rasters, "cache_folder", cache_folder)
+    rng = np.random.default_rng(0)
+    tif_dict = {}
+    for par, high in (("velocity", 2.0), ("depth", 1.5)):
+        par_array = rng.uniform(0.0, high, (211, 157))
+        par_array[rng.integers(0, 211, 50), rng.integers(0, 157, 50)] = np.nan
+        tif_dict[par] = str(tmp_path / ("%s.tif" % par))
+        geo.create_raster(tif_dict[par], par_array, epsg=2056, geo_info=(2600000.0, 1.0, 0.0, 1200211.0, 0.0, -1.0))
+    hsi_curves = {"velocity": [[0.0, 0.3, 1.0, 2.5], [0.0, 1.0, 0.6, 0.0]],
+                  "depth": [[0.0, 0.2, 0.8, 2.0], [0.0, 0.7, 1.0, 0.1]]}
+    # several tiles per raster
+    monkeypatch.setattr(raster, "tile_budget", 157 * 16)
+
+    parallel_dir = str(tmp_path / "parallel") + "/"
+    os.makedirs(parallel_dir)
+    assert make_chsi_parallel(tif_dict, hsi_curves, parallel_dir, n_processes=2, dtype_policy=dtype_policy) == 0
+
+    serial_dir = str(tmp_path / "serial") + "/"
+    os.makedirs(serial_dir)
+    hsi_rasters = [get_hsi_raster(tif_dict[par], hsi_curves[par], streaming=True, dtype_policy=dtype_policy)
+                   for par in tif_dict]
+    for par, hsi_raster in zip(tif_dict, hsi_rasters):
+        hsi_raster.save(serial_dir + "hsi_%s.tif" % par)
+    combine_hsi_rasters(hsi_rasters).save(serial_dir + "chsi.tif")
+
+    for name in ["hsi_velocity.tif", "hsi_depth.tif", "chsi.tif"]:
+        parallel = gdal.Open(parallel_dir + name).GetRasterBand(1).ReadAsArray()
+        serial = gdal.Open(serial_dir + name).GetRasterBand(1).ReadAsArray()
+        assert parallel.dtype == serial.dtype
+        # bitwise identical (also no-data values)
+        np.testing.assert_array_equal(parallel.view(np.uint8), serial.view(np.uint8))
+    # the memory-mapped buffer is removed
+    assert not [f for f in os.listdir(cache_folder) if f.startswith("parallel_")]
+
+
+def test_parallel_chsi_removes_buffer_on_failure(tmp_path, monkeypatch):
+    cache_folder = str(tmp_path / "cache") + "/"
+    monkeypatch.setattr(fun, "cache_folder", cache_folder)
+    monkeypatch.setattr(create_hsi_rasters, "cache_folder", cache_folder)
+    par_tif = str(tmp_path / "depth.tif")
+    geo.create_raster(par_tif, np.ones((20, 30)), epsg=2056, geo_info=(0.0, 1.0, 0.0, 20.0, 0.0, -1.0))
+
+    def failing_pool(*args, **kwargs):
+        raise OSError("no processes")
+
+    monkeypatch.setattr(create_hsi_rasters, "Pool", failing_pool)
+    with pytest.raises(OSError):
+        make_chsi_parallel({"depth": par_tif}, {"depth": [[0.0, 2.0], [0.0, 1.0]]}, str(tmp_path) + "/",
+                           n_processes=2)
+    assert not os.listdir(cache_folder)
+
+
+class SavedRaster:
+    def __init__(self, status):
+        self.status = status
+
+    def save(self, file_name, profile=None, overviews=None):
+        if self.status == 0:
+            with open(file_name, "wb") as file:
+                file.write(b"new hsi")
+        return self.status
+
+
+def test_failed_hsi_save_is_not_cached(tmp_path):
+    cache = HSICache(folder=str(tmp_path / "cache") + os.sep, max_size=10 ** 6)
+    par_tif = str(tmp_path / "depth.tif")
+    with open(par_tif, "wb") as file:
+        file.write(b"depth")
+    key = cache.get_key(par_tif, [[0.0, 1.0], [0.0, 1.0]])
+    hsi_file = str(tmp_path / "hsi_depth.tif")
+    # outdated HSI raster (and mask) of a previous run
+    for file_name in (hsi_file, hsi_file + ".msk"):
+        with open(file_name, "wb") as file:
+            file.write(b"old hsi")
+
+    assert save_hsi_raster(SavedRaster(-1), hsi_file, hsi_cache=cache, cache_key=key) == -1
+    assert not os.path.exists(hsi_file)
+    assert not os.path.exists(hsi_file + ".msk")
+    assert cache.get(key) is None
+
+    assert save_hsi_raster(SavedRaster(0), hsi_file, hsi_cache=cache, cache_key=key) == 0
+    with open(cache.get(key), "rb") as file:
+        assert file.read() == b"new hsi"
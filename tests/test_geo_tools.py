@@ -0,0 +1,165 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("gdal")
+
+import geo_utils as geo
+
+
+def get_offset_distances(geo_transform, offsets):
+    dx = offsets[:, 1] * geo_transform[1] + offsets[:, 0] * geo_transform[2]
+    dy = offsets[:, 1] * geo_transform[4] + offsets[:, 0] * geo_transform[5]
+    return np.sqrt(dx ** 2 + dy ** 2)
+
+
+@pytest.mark.parametrize("geo_transform", [(0, 2, 0, 0, 0, -2), (0, 0, 2, 0, 2, 0), (0, 0, -2, 0, -2, 0),
+                                           (0, np.sqrt(2), np.sqrt(2), 0, np.sqrt(2), -np.sqrt(2))])
+def test_neighbour_offsets_of_rotated_geo_transforms(geo_transform):
+    # rotations of a 2 m grid have the same neighbourhood as the north-up grid
+    offsets = geo.get_neighbour_offsets(geo_transform, 3.0)
+    assert sorted(map(tuple, offsets)) == [(0, 1), (1, -1), (1, 0), (1, 1)]
+    assert np.all(get_offset_distances(geo_transform, offsets) <= 3.0 * (1.0 + 1e-6))
+
+
+def test_neighbour_pairs_match_all_combinations():
+    rng = np.random.default_rng(0)
+    shape = (30, 40)
+    rows, cols = np.where(rng.random(shape) > 0.7)
+    offsets = geo.get_neighbour_offsets((0, 1, 0, 0, 0, -1), 2.5)
+    start_ids, end_ids = geo.get_neighbour_pairs(rows, cols, shape, offsets)
+    points = np.column_stack((rows, cols)).astype(float)
+    expected = [(i, j) for i in range(rows.size) for j in range(i + 1, rows.size)
+                if np.hypot(*(points[i] - points[j])) <= 2.5]
+    assert list(zip(start_ids.tolist(), end_ids.tolist())) == expected
+
+
+@pytest.mark.parametrize("connectedness, n_polygons", [(4, 3), (8, 2)])
+def test_mask2polygon_connectedness(tmp_path, connectedness, n_polygons):
+    # two diagonal pixels and one separate pixel (False pixels do not become polygons)
+    mask_array = np.zeros((5, 6), dtype=bool)
+    mask_array[1, 1] = mask_array[2, 2] = mask_array[4, 5] = True
+    shp_file_name = str(tmp_path / "mask.shp")
+    polygons = geo.mask2polygon(mask_array, shp_file_name, 2056, (0, 2, 0, 10, 0, -2),
+                                connectedness=connectedness, add_area=True)
+    layer = polygons.GetLayer()
+    assert layer.GetFeatureCount() == n_polygons
+    assert sorted(feature.GetField("values") for feature in layer) == [1] * n_polygons
+    assert sum(feature.GetField("area") for feature in layer) == pytest.approx(12.0)
+
+
+def test_sample_raster_matches_pixel_reads(tmp_path):
+    rng = np.random.default_rng(0)
+    raster_array = rng.uniform(0.0, 2.0, (301, 257))
+    raster_array[10, 20] = np.nan
+    geo_info = (2600000.0, 2.0, 0.0, 1200602.0, 0.0, -2.0)
+    tif = str(tmp_path / "depth.tif")
+    geo.create_raster(tif, raster_array, epsg=2056, geo_info=geo_info)
+
+    # random points (also outside of the raster) and the center of the no-data pixel
+    x_coords = np.append(rng.uniform(geo_info[0] - 20.0, geo_info[0] + 534.0, 500), geo_info[0] + 41.0)
+    y_coords = np.append(rng.uniform(geo_info[3] - 622.0, geo_info[3] + 20.0, 500), geo_info[3] - 21.0)
+    values = geo.sample_raster(tif, x_coords, y_coords)
+
+    raster = gdal.Open(tif)
+    band = raster.GetRasterBand(1)
+    expected = np.full(x_coords.shape, np.nan)
+    for i, (x, y) in enumerate(zip(x_coords, y_coords)):
+        col, row = int(np.floor((x - geo_info[0]) / 2.0)), int(np.floor((y - geo_info[3]) / -2.0))
+        if 0 <= col < raster.RasterXSize and 0 <= row < raster.RasterYSize:
+            value = band.ReadAsArray(col, row, 1, 1)[0, 0]
+            expected[i] = np.nan if value == band.GetNoDataValue() else value
+    assert np.isnan(values[-1])
+    assert np.sum(np.isnan(expected)) < expected.size // 2
+    np.testing.assert_array_equal(values, expected)
+
+
+def test_mask2polygon_dissolve_and_simplify(tmp_path):
+    mask_array = np.zeros((6, 6), dtype=bool)
+    mask_array[1:3, 1:3] = mask_array[4, 4:6] = True
+    polygons = geo.mask2polygon(mask_array, str(tmp_path / "mask.shp"), 2056, (0, 2, 0, 12, 0, -2),
+                                add_area=True, simplify_tolerance=0.5, dissolve=True)
+    layer = polygons.GetLayer()
+    assert layer.GetFeatureCount() == 1
+    assert sum(feature.GetField("area") for feature in layer) == pytest.approx(24.0)
+
+
+def test_mask2polygon_simplify_keeps_features(tmp_path):
+    mask_array = np.zeros((6, 6), dtype=bool)
+    mask_array[1:3, 1:3] = mask_array[4, 4:6] = True
+    polygons = geo.mask2polygon(mask_array, str(tmp_path / "mask.shp"), 2056, (0, 2, 0, 12, 0, -2),
+                                add_area=True, simplify_tolerance=0.5)
+    layer = polygons.GetLayer()
+    assert layer.GetFeatureCount() == 2
+    # rectangles do not change with simplification
+    assert sorted(feature.GetField("area") for feature in layer) == pytest.approx([8.0, 16.0])
+
+
+def test_mask2polygon_writes_areas_and_classes(tmp_path):
+    mask_array = np.zeros((6, 6), dtype=bool)
+    mask_array[1:3, 1:3] = mask_array[4, 4:6] = True
+    polygons = geo.mask2polygon(mask_array, str(tmp_path / "mask.shp"), 2056, (0, 2, 0, 12, 0, -2),
+                                add_area=True, class_labels={1: "habitat"})
+    features = sorted((feature.GetField("area"), feature.GetField("class")) for feature in polygons.GetLayer())
+    assert features == [(8.0, "habitat"), (16.0, "habitat")]
+
+
+class SequentialLayer:
+    # layer of a GDAL version without UpdateFeature (< 3.7), where random access is not allowed
+    def __init__(self, layer):
+        self.layer = layer
+
+    def __iter__(self):
+        return iter(self.layer)
+
+    def __getattr__(self, name):
+        if name in ("UpdateFeature", "GetFeature"):
+            raise AttributeError(name)
+        return getattr(self.layer, name)
+
+
+def test_add_polygon_areas_without_update_feature(tmp_path):
+    mask_array = np.zeros((6, 6), dtype=bool)
+    mask_array[1:3, 1:3] = mask_array[4, 4:6] = True
+    polygons = geo.mask2polygon(mask_array, str(tmp_path / "mask.shp"), 2056, (0, 2, 0, 12, 0, -2))
+    layer = polygons.GetLayer()
+    areas, total_area = geo.add_polygon_areas(SequentialLayer(layer), value_field="values",
+                                              class_labels={1: "habitat"})
+    assert total_area == pytest.approx(24.0)
+    layer.ResetReading()
+    features = [(feature.GetField("area"), feature.GetField("class")) for feature in layer]
+    assert features == [(area, "habitat") for area in areas.tolist()]
+
+
+def test_raster2polygon_mask_threshold_forwards_dissolve(tmp_path):
+    chsi_array = np.full((6, 6), 0.1)
+    chsi_array[1:3, 1:3] = chsi_array[4, 4:6] = 0.8
+    chsi_array[0, 5] = np.nan
+    tif = str(tmp_path / "chsi.tif")
+    geo.create_raster(tif, chsi_array, epsg=2056, geo_info=(0, 2, 0, 12, 0, -2))
+    polygons = geo.raster2polygon(tif, str(tmp_path / "habitat.shp"), mask_threshold=0.4, add_area=True,
+                                  simplify_tolerance=0.5, dissolve=True)
+    layer = polygons.GetLayer()
+    assert layer.GetFeatureCount() == 1
+    assert sum(feature.GetField("area") for feature in layer) == pytest.approx(24.0)
+
+
+@pytest.mark.parametrize("geo_transform", [
+    (2600000.0, 1.5, 0.5, 1200000.0, 0.4, -1.2),  # rotated
+    (2600000.0, 2.0, 0.0, 1200000.0, 0.0, 2.0),  # south-up
+])
+def test_pixel_coordinate_round_trip(geo_transform):
+    rows, cols = np.meshgrid(np.arange(40), np.arange(30), indexing="ij")
+    x_coords, y_coords = geo.offset2coords(geo_transform, cols.ravel(), rows.ravel())
+    # pixel centers of the GDAL affine transformation
+    expected = [gdal.ApplyGeoTransform(geo_transform, col + 0.5, row + 0.5)
+                for col, row in zip(cols.ravel(), rows.ravel())]
+    np.testing.assert_allclose(np.column_stack((x_coords, y_coords)), expected, rtol=0.0, atol=1e-6)
+
+    offset_x, offset_y = geo.coords2offset(geo_transform, x_coords, y_coords)
+    np.testing.assert_array_equal(offset_x, cols.ravel())
+    np.testing.assert_array_equal(offset_y, rows.ravel())
+    pixel_x, pixel_y = geo.coords2pixel(geo_transform, x_coords, y_coords)
+    np.testing.assert_allclose(pixel_x, cols.ravel() + 0.5, rtol=0.0, atol=1e-9)
+    np.testing.assert_allclose(pixel_y, rows.ravel() + 0.5, rtol=0.0, atol=1e-9)
+    # scalar input
+    assert geo.coords2offset(geo_transform, *geo.offset2coords(geo_transform, 7, 11)) == (7, 11)
@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+import hsi_cache
+
+
+def test_code_files_exist():
+    # missing files would only contribute their name to the code version
+    code_dir = os.path.dirname(os.path.abspath(hsi_cache.__file__))
+    for code_file in hsi_cache.hsi_code_files:
+        assert os.path.isfile(os.path.join(code_dir, code_file)), code_file
+
+
+def test_code_version_covers_raster_writing():
+    assert os.path.join("geo_utils", "raster_mgmt.py") in hsi_cache.hsi_code_files
+    assert os.path.join("geo_utils", "geoconfig.py") in hsi_cache.hsi_code_files
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return hsi_cache.HSICache(folder=str(tmp_path / "cache") + os.sep, max_size=10 ** 6)
+
+
+@pytest.fixture
+def tif_name(tmp_path):
+    tif_name = str(tmp_path / "depth.tif")
+    with open(tif_name, "wb") as file:
+        file.write(b"depth")
+    return tif_name
+
+
+def write_file(file_name, content):
+    with open(file_name, "wb") as file:
+        file.write(content)
+    return file_name
+
+
+def read_file(file_name):
+    with open(file_name, "rb") as file:
+        return file.read()
+
+
+def test_key_changes_with_inputs(cache, tif_name):
+    curve = [[0.0, 1.0, 2.0], [0.0, 1.0, 0.5]]
+    key = cache.get_key(tif_name, curve, dtype_policy="float64")
+    assert cache.get_key(tif_name, curve, dtype_policy="float64") == key
+    # HSI curve and options
+    assert cache.get_key(tif_name, [[0.0, 1.0, 2.0], [0.0, 1.0, 0.6]], dtype_policy="float64") != key
+    assert cache.get_key(tif_name, curve, dtype_policy="uint8") != key
+    assert cache.get_key(tif_name, curve, dtype_policy="float64", profile="deflate") != key
+    # modification time of the parameter raster
+    stat = os.stat(tif_name)
+    os.utime(tif_name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.get_key(tif_name, curve, dtype_policy="float64") != key
+    assert cache.get_key(tif_name + ".missing", curve) is None
+
+
+def test_content_key_ignores_path_and_time(cache, tif_name, tmp_path):
+    cache.fingerprint = "content"
+    curve = [[0.0, 1.0], [0.0, 1.0]]
+    key = cache.get_key(tif_name, curve)
+    copy_name = write_file(str(tmp_path / "copy.tif"), read_file(tif_name))
+    os.utime(copy_name, ns=(0, 10 ** 9))
+    assert cache.get_key(copy_name, curve) == key
+    write_file(copy_name, b"changed")
+    assert cache.get_key(copy_name, curve) != key
+
+
+def test_put_get_restore(cache, tmp_path):
+    hsi_file = write_file(str(tmp_path / "hsi.tif"), b"hsi")
+    write_file(hsi_file + ".msk", b"mask")
+    assert cache.get("a" * 64) is None
+    cache_file = cache.put("a" * 64, hsi_file)
+    assert cache.get("a" * 64) == cache_file
+
+    target = str(tmp_path / "restored.tif")
+    assert cache.restore("a" * 64, target)
+    assert read_file(target) == b"hsi"
+    assert read_file(target + ".msk") == b"mask"
+    assert not cache.restore("b" * 64, target)
+    assert not cache.restore(None, target)
+
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["size"]) == (2, 2, 1, 7)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_restore_removes_outdated_mask(cache, tmp_path):
+    cache.put("a" * 64, write_file(str(tmp_path / "hsi.tif"), b"hsi"))
+    target = write_file(str(tmp_path / "restored.tif"), b"old")
+    write_file(target + ".msk", b"old mask")
+    assert cache.restore("a" * 64, target)
+    assert read_file(target) == b"hsi"
+    assert not os.path.exists(target + ".msk")
+
+
+def test_restore_to_missing_directory(cache, tmp_path):
+    cache.put("a" * 64, write_file(str(tmp_path / "hsi.tif"), b"hsi"))
+    assert not cache.restore("a" * 64, str(tmp_path / "missing" / "restored.tif"))
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"]) == (0, 1)
+
+
+def test_evict_least_recently_used(cache, tmp_path):
+    hsi_file = write_file(str(tmp_path / "hsi.tif"), b"x" * 100)
+    for key, last_use in (("a", 1000), ("b", 3000), ("c", 2000)):
+        cache.put(key * 64, hsi_file)
+        os.utime(cache.folder + key * 64 + ".tif", (last_use, last_use))
+    cache.max_size = 250
+    assert cache.evict() == 1
+    assert cache.get("a" * 64) is None
+    assert cache.get("c" * 64) is not None
+    # get marks an entry as recently used, and the most recently used entry is always kept
+    cache.max_size = 50
+    assert cache.evict() == 1
+    assert cache.get("c" * 64) is not None
+    assert cache.get_stats()["evictions"] == 2
@@ -0,0 +1,114 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from fun import interpolate_from_list, par_dict, read_json
+from hsi_curve import CurveRegistry, HSICurve
+
+trout_json = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "habitat", "trout.json")
+trout = read_json(trout_json)
+trout_curves = [(parameter, life_stage) for parameter in par_dict for life_stage in trout[parameter]]
+
+
+def get_test_values(curve):
+    rng = np.random.default_rng(0)
+    return np.concatenate((curve.x_values, rng.uniform(curve.x_values[0] - 0.1, curve.x_values[-1] + 0.1, 10000),
+                           [np.nan, np.inf, -np.inf]))
+
+
+@pytest.mark.parametrize("parameter, life_stage", trout_curves)
+def test_lut_error_is_within_max_error(parameter, life_stage):
+    curve = HSICurve(trout, parameter, life_stage)
+    xi_values = get_test_values(curve)
+    exact = interpolate_from_list(curve.x_values, curve.y_values, xi_values)
+    assert np.max(np.abs(curve.interpolate(xi_values) - exact)) <= curve.max_error + 1e-12
+
+    # the LUT (also if its error is beyond max_error) stays within its reported error
+    lut_curve = HSICurve(trout, parameter, life_stage, max_error=np.inf)
+    assert lut_curve.use_lut
+    assert np.max(np.abs(lut_curve.interpolate(xi_values) - exact)) <= lut_curve.lut_error + 1e-12
+
+
+def test_steep_curve_falls_back_to_exact_interpolation():
+    # a slope of 1000 HSI/m yields a LUT error of 0.5 with 1 mm steps
+    fish_data = {"depth": {"fry": [{"h": 0.0, "HSI": 0.0}, {"h": 0.001, "HSI": 1.0}, {"h": 1.0, "HSI": 0.5}]}}
+    curve = HSICurve(fish_data, "depth", "fry")
+    assert curve.lut_error > curve.max_error
+    assert not curve.use_lut
+    xi_values = get_test_values(curve)
+    np.testing.assert_array_equal(curve.interpolate(xi_values),
+                                  interpolate_from_list(curve.x_values, curve.y_values, xi_values))
+
+
+def write_fish_json(file_name, depth_values):
+    fish_data = {"depth": {"juvenile": [{"h": h, "HSI": hsi} for h, hsi in zip(depth_values, [0.0, 1.0, 0.5])]}}
+    with open(file_name, "w") as file:
+        json.dump(fish_data, file)
+    return file_name
+
+
+def test_registry_parses_again_after_changes(tmp_path):
+    registry = CurveRegistry()
+    json_file = write_fish_json(str(tmp_path / "fish.json"), [0.0, 1.0, 2.0])
+    x_values, y_values = registry.get(json_file, "depth", "juvenile")
+    np.testing.assert_array_equal(x_values, [0.0, 1.0, 2.0])
+    # unchanged files are not parsed again (the same arrays are returned)
+    assert registry.get(json_file, "depth", "juvenile")[0] is x_values
+
+    # a new modification time with the same size
+    write_fish_json(json_file, [0.0, 1.0, 3.0])
+    stat = os.stat(json_file)
+    os.utime(json_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    np.testing.assert_array_equal(registry.get(json_file, "depth", "juvenile")[0], [0.0, 1.0, 3.0])
+    # a new size with the same modification time
+    stat = os.stat(json_file)
+    write_fish_json(json_file, [0.0, 1.0, 30.0])
+    os.utime(json_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    np.testing.assert_array_equal(registry.get(json_file, "depth", "juvenile")[0], [0.0, 1.0, 30.0])
+
+
+def test_registry_rejects_decreasing_values(tmp_path):
+    json_file = write_fish_json(str(tmp_path / "fish.json"), [0.0, 2.0, 1.0])
+    assert CurveRegistry().get(json_file, "depth", "juvenile") == (None, None)
+
+
+def test_dict_curve_rejects_decreasing_values():
+    fish_data = {"depth": {"juvenile": [{"h": h, "HSI": hsi} for h, hsi in zip([0.0, 2.0, 1.0], [0.0, 1.0, 0.5])]}}
+    curve = HSICurve(fish_data, "depth", "juvenile")
+    assert curve.x_values.size == 0
+    assert not curve.use_lut
+
+
+def test_dict_and_file_curves_are_equal(tmp_path):
+    json_file = write_fish_json(str(tmp_path / "fish.json"), [0.0, 1.0, 2.0])
+    file_curve = HSICurve(json_file, "depth", "juvenile")
+    dict_curve = HSICurve(read_json(json_file), "depth", "juvenile")
+    np.testing.assert_array_equal(file_curve.x_values, dict_curve.x_values)
+    xi_values = np.array([-1.0, 0.0, 0.5, 2.0, 2.5, np.nan])
+    np.testing.assert_array_equal(dict_curve.in_range(xi_values), [False, False, True, True, False, False])
+
+
+def test_registry_arrays_are_read_only():
+    x_values, y_values = CurveRegistry().get(trout_json, "depth", "juvenile")
+    with pytest.raises(ValueError):
+        x_values[0] = 1.0
+    with pytest.raises(ValueError):
+        y_values[0] = 1.0
+
+
+def test_registry_loads_directory(tmp_path):
+    write_fish_json(str(tmp_path / "grayling.json"), [0.0, 1.0, 2.0])
+    write_fish_json(str(tmp_path / "trout.json"), [0.0, 0.5, 1.0])
+    (tmp_path / "notes.txt").write_text("not a fish")
+    fish_curves = CurveRegistry().load_many(str(tmp_path))
+    assert sorted(fish_curves.keys()) == ["grayling", "trout"]
+    np.testing.assert_array_equal(fish_curves["trout"][("depth", "juvenile")][0], [0.0, 0.5, 1.0])
+
+
+def test_registry_invalid_json(tmp_path):
+    json_file = str(tmp_path / "fish.json")
+    with open(json_file, "w") as file:
+        file.write("{\"depth\": ")
+    assert CurveRegistry().load(json_file) == {}
@@ -0,0 +1,57 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("gdal")
+
+from geo_utils import instrumentation
+
+
+@pytest.fixture
+def records(monkeypatch):
+    records = []
+    monkeypatch.setattr(instrumentation, "write_trace_record", records.append)
+    return records
+
+
+def test_cpu_time_excludes_other_threads(records):
+    stop = threading.Event()
+
+    def spin():
+        while not stop.is_set():
+            pass
+
+    thread = threading.Thread(target=spin)
+    thread.start()
+    try:
+        with instrumentation.TraceStage("sleep"):
+            time.sleep(0.3)
+    finally:
+        stop.set()
+        thread.join()
+    assert records[0]["wall_time"] >= 0.3
+    assert records[0]["cpu_time"] < 0.1
+
+
+def test_memory_of_stages(records):
+    if instrumentation.get_memory_usage()[0] is None:
+        pytest.skip("current RSS is not available")
+    with instrumentation.TraceStage("allocate"):
+        array = np.ones(64 * 1024 ** 2 // 8)
+    with instrumentation.TraceStage("small"):
+        pass
+    del array
+    allocate, small = records
+    assert allocate["rss_end_mb"] - allocate["rss_start_mb"] > 32
+    assert small["peak_rss_increase_mb"] < 1
+
+
+def test_reset_peak_memory():
+    array = np.ones(64 * 1024 ** 2 // 8)
+    del array
+    if not instrumentation.reset_peak_memory():
+        pytest.skip("the peak RSS cannot be reset")
+    current, peak = instrumentation.get_memory_usage()
+    assert peak - current < 32
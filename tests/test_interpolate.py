@@ -0,0 +1,71 @@
+import os
+from bisect import bisect_left
+
+import numpy as np
+import pytest
+
+from fun import interpolate_from_list, interpolate_y, nan_value, par_dict, read_json
+from hsi_curve import read_curve_points
+
+trout_json = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "habitat", "trout.json")
+
+
+def interpolate_from_list_scalar(x_values, y_values, xi_values):
+    """
+    Original (scalar) bisect implementation of interpolate_from_list
+    """
+    yi_values = []
+    max_position = x_values.__len__()
+    for xi in xi_values:
+        position = bisect_left(x_values, xi)
+        try:
+            if position > 0:
+                if position < max_position:
+                    yi_values.append(interpolate_y(x1=x_values[position-1], x2=x_values[position],
+                                                   y1=y_values[position-1], y2=y_values[position],
+                                                   xi=xi))
+                else:
+                    yi_values.append(nan_value)
+            else:
+                yi_values.append(nan_value)
+        except TypeError:
+            yi_values.append(nan_value)
+    return np.array(yi_values)
+
+
+def get_trout_curves():
+    trout = read_json(trout_json)
+    return [(parameter, life_stage) + read_curve_points(trout[parameter][life_stage], parameter, life_stage)
+            for parameter in par_dict for life_stage in trout[parameter]]
+
+
+def get_test_values(x_values):
+    """
+    Curve points (endpoints), segment midpoints, values next to and beyond the curve, np.nan, and +/-inf
+    """
+    x_values = np.asarray(x_values)
+    rng = np.random.default_rng(0)
+    return np.concatenate((x_values,
+                           (x_values[:-1] + x_values[1:]) / 2.0,
+                           np.nextafter(x_values, -np.inf),
+                           np.nextafter(x_values, np.inf),
+                           [x_values[0] - 1.0, x_values[-1] + 1.0, -1e300, 1e300, 0.0, -0.0],
+                           [np.nan, np.inf, -np.inf],
+                           rng.uniform(x_values[0] - 0.5, x_values[-1] + 0.5, 1000)))
+
+
+@pytest.mark.parametrize("parameter, life_stage, x_values, y_values", get_trout_curves())
+def test_interpolate_from_list_matches_scalar(parameter, life_stage, x_values, y_values):
+    xi_values = get_test_values(x_values)
+    expected = interpolate_from_list_scalar(x_values.tolist(), y_values.tolist(), xi_values)
+    result = interpolate_from_list(x_values, y_values, xi_values)
+    # bitwise identical (also the no-data values of np.nan, inf, and out-of-range inputs)
+    np.testing.assert_array_equal(result.view(np.uint64), expected.astype(float).view(np.uint64))
+
+
+def test_interpolate_from_list_keeps_shape():
+    x_values, y_values = [0.0, 1.0, 2.0], [0.0, 1.0, 0.5]
+    xi_values = np.array([[0.5, 1.5], [np.nan, 3.0]])
+    result = interpolate_from_list(x_values, y_values, xi_values)
+    assert result.shape == xi_values.shape
+    np.testing.assert_array_equal(result.ravel(), interpolate_from_list_scalar(x_values, y_values, xi_values.ravel()))
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("gdal")
+
+import raster
+from raster import Raster
+import geo_utils as geo
+
+
+@pytest.fixture
+def operand_rasters():
+    rng = np.random.default_rng(0)
+    file_names = []
+    for name, high in (("a", 3.0), ("b", 2.0)):
+        file_names.append("/vsimem/__test__/%s.tif" % name)
+        geo.create_raster(file_names[-1], rng.uniform(0.0, high, (200, 300)).astype(np.float32), epsg=2056,
+                          geo_info=(0, 1, 0, 0, 0, -1))
+    yield file_names
+    geo.remove_vsi_files("/vsimem/__test__/")
+
+
+@pytest.mark.parametrize("exponent", [1 / 3, 0.25, 0.5, 1.7, 2])
+def test_lazy_expression_matches_eager(operand_rasters, monkeypatch, exponent):
+    results = {}
+    for lazy in (True, False):
+        monkeypatch.setattr(raster, "lazy_rasters", lazy)
+        expression = ((Raster(operand_rasters[0]) * Raster(operand_rasters[1])) ** exponent) * 0.7
+        results[lazy] = np.array(expression.read_window(), dtype=np.float32)
+    # nested float32 buffers are calculated with the dtype of the eager path (float64)
+    np.testing.assert_array_equal(results[True], results[False])
+
+
+def test_quantized_policy_only_saves_hsi_values_quantized(operand_rasters):
+    from raster_hsi import HSIRaster
+    depth = Raster(operand_rasters[0], dtype_policy="uint8")
+    depth.save("/vsimem/__test__/depth.tif")
+    # parameter rasters (values beyond 1.0) are not clipped, but saved as float32
+    np.testing.assert_array_equal(geo.raster2array("/vsimem/__test__/depth.tif")[1],
+                                  geo.raster2array(operand_rasters[0])[1])
+    (depth * 2.0).save("/vsimem/__test__/depth2.tif")
+    assert np.nanmax(geo.raster2array("/vsimem/__test__/depth2.tif")[1]) > 1.0
+
+    hsi = HSIRaster(operand_rasters[0], [[0.0, 3.0], [0.0, 1.0]], dtype_policy="uint8")
+    hsi.save("/vsimem/__test__/hsi.tif")
+    raster, band = geo.open_raster("/vsimem/__test__/hsi.tif")
+    assert band.DataType == gdal.GDT_Byte
+
+
+def test_hsi_zero_stays_valid_with_nodata_masks(monkeypatch):
+    from raster_hsi import HSIRaster
+    import raster_hsi
+    monkeypatch.setattr(raster, "nodata_masks", True)
+    monkeypatch.setattr(raster_hsi, "nodata_masks", True)
+    geo.create_raster("/vsimem/__test__/par.tif", np.array([[0.5, 1.5], [5.0, 1.0]]), epsg=2056,
+                      geo_info=(0, 1, 0, 0, 0, -1))
+    try:
+        # HSI = 0.0 at 0.5 is valid, while 5.0 is beyond the curve (no-data)
+        hsi = HSIRaster("/vsimem/__test__/par.tif", [[0.1, 1.0, 2.0], [0.0, 0.0, 1.0]])
+        hsi.save("/vsimem/__test__/hsi.tif")
+        raster_dataset, band = geo.open_raster("/vsimem/__test__/hsi.tif")
+        np.testing.assert_array_equal(geo.get_valid_mask(band), [[True, True], [False, True]])
+        assert band.ReadAsArray()[0, 0] == 0.0
+    finally:
+        geo.remove_vsi_files("/vsimem/__test__/")
+
+
+def test_save_profile_none_ignores_config_profile(operand_rasters, monkeypatch):
+    import fun
+    monkeypatch.setattr(fun, "gtiff_profile", "deflate")
+    Raster(operand_rasters[0]).save("/vsimem/__test__/config.tif")
+    Raster(operand_rasters[0]).save("/vsimem/__test__/none.tif", profile=None)
+    compression = [gdal.Open("/vsimem/__test__/%s.tif" % name).GetMetadataItem("COMPRESSION", "IMAGE_STRUCTURE")
+                   for name in ("config", "none")]
+    assert compression == ["DEFLATE", None]
@@ -0,0 +1,275 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("gdal")
+
+import geo_utils as geo
+
+
+@pytest.fixture
+def vsi_folder():
+    yield "/vsimem/__test__/"
+    geo.remove_vsi_files("/vsimem/__test__/")
+
+
+def test_write_window_keeps_input_array(vsi_folder):
+    raster_array = np.array([[1.0, np.nan, 0.5], [np.nan, 0.25, 0.0]])
+    original = raster_array.copy()
+    geo.create_raster(vsi_folder + "nan.tif", raster_array, epsg=2056, geo_info=(0, 1, 0, 0, 0, -1))
+    np.testing.assert_array_equal(raster_array, original)
+
+
+def test_streamed_windows_match_entire_array(vsi_folder):
+    raster_array = np.random.default_rng(0).uniform(0.0, 1.0, (97, 61)).astype(np.float32)
+    raster_array[3, 5] = np.nan
+    geo.create_raster(vsi_folder + "full.tif", raster_array, epsg=2056, geo_info=(0, 1, 0, 0, 0, -1))
+    raster, band = geo.open_raster(vsi_folder + "full.tif")
+    streamed = np.full(raster_array.shape, -1.0)
+    for x_off, y_off, x_size, y_size in geo.get_block_windows(band, 500):
+        streamed[y_off:y_off + y_size, x_off:x_off + x_size] = geo.band2array(band, (x_off, y_off, x_size, y_size))
+    np.testing.assert_array_equal(streamed, geo.raster2array(vsi_folder + "full.tif")[1])
+
+
+def test_band2memmap_sidecar_is_complete(tmp_path, monkeypatch):
+    raster_array = np.arange(37 * 53, dtype=np.float32).reshape(37, 53)
+    file_name = str(tmp_path / "deflate.tif")
+    geo.create_raster(file_name, raster_array, epsg=2056, geo_info=(0, 1, 0, 0, 0, -1), profile="deflate")
+    raster = gdal.Open(file_name)
+
+    # an interrupted sidecar is neither kept nor mapped by later runs
+    def interrupt(band, *args, **kwargs):
+        raise RuntimeError("interrupted")
+    monkeypatch.setattr(geo.raster_mgmt, "get_block_windows", interrupt)
+    assert geo.band2memmap(raster, sidecar=True) is None
+    assert list(tmp_path.glob("deflate.tif.*")) == []
+
+    monkeypatch.undo()
+    mapped = geo.band2memmap(raster, sidecar=True)
+    np.testing.assert_array_equal(mapped, raster_array)
+    assert [path.suffix for path in tmp_path.glob("deflate.tif.*")] == [".npy"]
+
+
+def test_band2memmap_sidecar_falls_back_to_cache_folder(tmp_path, monkeypatch):
+    raster_dir = tmp_path / "read_only"
+    raster_dir.mkdir()
+    raster_array = np.arange(19 * 23, dtype=np.float32).reshape(19, 23)
+    file_name = str(raster_dir / "deflate.tif")
+    geo.create_raster(file_name, raster_array, epsg=2056, geo_info=(0, 1, 0, 0, 0, -1), profile="deflate")
+    raster = gdal.Open(file_name)
+    monkeypatch.setattr(geo.raster_mgmt, "memmap_cache_folder", str(tmp_path / "cache"))
+
+    # the raster directory is not writable (chmod does not apply to root)
+    mkstemp = geo.raster_mgmt.tempfile.mkstemp
+
+    def read_only_mkstemp(*args, dir=None, **kwargs):
+        if os.path.samefile(dir, str(raster_dir)):
+            raise PermissionError("read-only directory")
+        return mkstemp(*args, dir=dir, **kwargs)
+    monkeypatch.setattr(geo.raster_mgmt.tempfile, "mkstemp", read_only_mkstemp)
+
+    mapped = geo.band2memmap(raster, sidecar=True)
+    np.testing.assert_array_equal(mapped, raster_array)
+    assert os.listdir(str(raster_dir)) == ["deflate.tif"]
+    assert [path.suffix for path in (tmp_path / "cache").iterdir()] == [".npy"]
+
+
+@pytest.mark.parametrize("dtype_policy", ["uint8", "uint16"])
+def test_quantize_round_trip(dtype_policy):
+    hsi_array = np.concatenate((np.linspace(0.0, 1.0, 1001)[1:], [np.nan]))
+    codes = geo.quantize(hsi_array, dtype_policy)
+    assert codes.dtype == geo.dtype_policies[dtype_policy]["code_dtype"]
+    result = geo.dequantize(codes, dtype_policy, dtype=np.float64)
+    assert np.nanmax(np.abs(result - hsi_array)) <= geo.dtype_policies[dtype_policy]["scale"] / 2.0 + 1e-12
+    assert np.isnan(result[-1])
+
+
+@pytest.mark.parametrize("dtype_policy", ["uint8", "uint16"])
+def test_quantize_hsi_zero_is_nodata(dtype_policy):
+    # HSI = 0.0 is the nan_value (no-data) of rasters without nodata_masks
+    codes = geo.quantize(np.array([0.0, np.nan, 0.5]), dtype_policy)
+    assert codes[0] == codes[1] == geo.dtype_policies[dtype_policy]["nan_val"]
+    assert codes[2] != geo.dtype_policies[dtype_policy]["nan_val"]
+    # with nodata_masks, no-data pixels are np.nan and HSI = 0.0 gets the code 0
+    codes = geo.quantize(np.array([0.0, np.nan]), dtype_policy, nan_val=np.nan)
+    assert codes.tolist() == [0, geo.dtype_policies[dtype_policy]["nan_val"]]
+
+
+def slow_read(item):
+    # later items are read faster, which would reorder results that are not queued in order
+    time.sleep(0.002 * (item % 3))
+    return item * 10
+
+
+@pytest.mark.parametrize("max_in_flight", [0, 1, 3])
+def test_prefetch_keeps_order(max_in_flight):
+    items = list(range(20))
+    assert list(geo.prefetch(slow_read, items, max_in_flight=max_in_flight)) == [(i, i * 10) for i in items]
+
+
+@pytest.mark.parametrize("max_in_flight", [0, 2])
+def test_prefetch_raises_reader_error(max_in_flight):
+    def read(item):
+        if item == 3:
+            raise ValueError("cannot read %i" % item)
+        return item
+    results = []
+    with pytest.raises(ValueError, match="cannot read 3"):
+        for item, result in geo.prefetch(read, list(range(10)), max_in_flight=max_in_flight):
+            results.append(result)
+    assert results == [0, 1, 2]
+
+
+def test_prefetch_without_buffers_reads_synchronously():
+    threads = []
+    generator = geo.prefetch(lambda item: threads.append(threading.current_thread()), list(range(5)),
+                             max_in_flight=0)
+    assert threads == []
+    next(generator)
+    assert threads == [threading.current_thread()]
+    generator.close()
+
+
+def test_prefetch_stops_when_consumer_stops():
+    n_threads = threading.active_count()
+    reads = []
+    generator = geo.prefetch(reads.append, list(range(1000)), max_in_flight=2)
+    for i, (item, result) in enumerate(generator):
+        if i == 1:
+            break
+    generator.close()
+    # the reader thread is joined and reads at most the buffered items ahead
+    assert threading.active_count() == n_threads
+    n_reads = reads.__len__()
+    time.sleep(0.05)
+    assert reads.__len__() == n_reads <= 2 + 2 + 1
+
+
+@pytest.fixture
+def written(monkeypatch):
+    written = []
+
+    def write_window(band, raster_array, window=None, **kwargs):
+        time.sleep(0.001)
+        written.append((band, raster_array, threading.current_thread()))
+    monkeypatch.setattr(geo.raster_mgmt, "write_window", write_window)
+    return written
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 3])
+def test_write_behind_keeps_order(written, max_in_flight):
+    with geo.WriteBehind(max_in_flight=max_in_flight) as writer:
+        for i in range(20):
+            writer.write("band", i)
+    assert [array for band, array, thread in written] == list(range(20))
+    assert all([thread is not threading.current_thread() for band, array, thread in written])
+
+
+def test_write_behind_without_buffers_writes_synchronously(written):
+    with geo.WriteBehind(max_in_flight=0) as writer:
+        writer.write("band", 1)
+        assert [(array, thread) for band, array, thread in written] == [(1, threading.current_thread())]
+
+
+def test_write_behind_raises_writer_error(monkeypatch):
+    def write_window(band, raster_array, window=None, **kwargs):
+        if raster_array == 2:
+            raise ValueError("cannot write %i" % raster_array)
+    monkeypatch.setattr(geo.raster_mgmt, "write_window", write_window)
+    n_threads = threading.active_count()
+    with pytest.raises(ValueError, match="cannot write 2"):
+        with geo.WriteBehind(max_in_flight=2) as writer:
+            for i in range(5):
+                writer.write("band", i)
+    # the error is raised with a later write or on close, and the thread is stopped
+    assert threading.active_count() == n_threads
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 2, 4])
+def test_buffer_ring_never_hands_out_queued_buffers(monkeypatch, max_in_flight):
+    # same ring of cHSI buffers as batch_habitat.run_scenario (io_buffers + 2 buffers)
+    queued = set()
+    lock = threading.Lock()
+
+    def write_window(band, raster_array, window=None, **kwargs):
+        time.sleep(0.002)
+        with lock:
+            queued.discard(id(raster_array))
+    monkeypatch.setattr(geo.raster_mgmt, "write_window", write_window)
+
+    buffers = [np.empty((4, 4)) for i in range(max_in_flight + 2)]
+    with geo.WriteBehind(max_in_flight=max_in_flight) as writer:
+        for n_tiles, (item, tile) in enumerate(geo.prefetch(slow_read, list(range(50)),
+                                                            max_in_flight=max_in_flight)):
+            buffer = buffers[n_tiles % buffers.__len__()]
+            with lock:
+                assert id(buffer) not in queued
+                queued.add(id(buffer))
+            buffer[...] = tile
+            writer.write("band", buffer)
+    assert queued == set()
+
+
+def test_unpack_mask_windows():
+    valid_mask = np.random.default_rng(0).random((13, 37)) > 0.5
+    packed = geo.pack_mask(valid_mask)
+    np.testing.assert_array_equal(geo.unpack_mask(packed, 37), valid_mask)
+    for x_off, x_size in [(0, 37), (3, 5), (7, 2), (8, 8), (9, 17), (15, 22), (36, 1)]:
+        window = (x_off, 2, x_size, 9)
+        np.testing.assert_array_equal(geo.unpack_mask(packed, 37, window), valid_mask[2:11, x_off:x_off + x_size])
+
+
+class RecordingBand:
+    """
+    Stand-in of an osgeo.gdal.Band that records the written arrays
+    """
+    def __init__(self, mask_band=None):
+        self.arrays = []
+        self.mask_band = mask_band
+
+    def WriteArray(self, raster_array, xoff=0, yoff=0):
+        self.arrays.append(np.array(raster_array))
+
+    def GetMaskBand(self):
+        return self.mask_band
+
+
+@pytest.mark.parametrize("dtype_policy", [None, "uint8"])
+def test_write_window_does_not_modify_input(dtype_policy):
+    raster_array = np.array([[0.25, np.nan], [0.0, 1.0]])
+    valid_mask = np.array([[True, False], [True, True]])
+    original = raster_array.copy()
+    band = RecordingBand(mask_band=RecordingBand())
+    geo.write_window(band, raster_array, dtype_policy=dtype_policy)
+    geo.write_window(band, raster_array, dtype_policy=dtype_policy, valid_mask=valid_mask)
+    np.testing.assert_array_equal(raster_array, original)
+    assert not np.any(np.isnan(band.arrays[0].astype(float)))
+    np.testing.assert_array_equal(band.mask_band.arrays[0], [[255, 0], [255, 255]])
+
+
+@pytest.mark.parametrize("profile, rdtype, compression, predictor", [
+    ("deflate", gdal.GDT_Float32, "DEFLATE", "3"),
+    ("lzw", gdal.GDT_Int32, "LZW", "2"),
+    ("tiled", gdal.GDT_Float32, None, None),
+    (None, gdal.GDT_Float32, None, None)])
+def test_creation_profiles(tmp_path, profile, rdtype, compression, predictor):
+    tif = str(tmp_path / "profile.tif")
+    raster_array = np.arange(300 * 400).reshape(300, 400) % 7
+    assert geo.create_raster(tif, raster_array, epsg=2056, geo_info=(0, 1, 0, 0, 0, -1), rdtype=rdtype,
+                             profile=profile, overviews=profile is not None) == 0
+    raster = gdal.Open(tif)
+    band = raster.GetRasterBand(1)
+    assert raster.GetMetadataItem("COMPRESSION", "IMAGE_STRUCTURE") == compression
+    assert raster.GetMetadataItem("PREDICTOR", "IMAGE_STRUCTURE") == predictor
+    if profile is None:
+        # striped GeoTIFF without overviews
+        assert band.GetBlockSize()[0] == 400
+        assert band.GetOverviewCount() == 0
+    else:
+        assert band.GetBlockSize() == [256, 256]
+        # overview levels 2 to 32 (see overview_levels)
+        assert band.GetOverviewCount() == len(geo.overview_levels)
+    np.testing.assert_array_equal(band.ReadAsArray(), raster_array)
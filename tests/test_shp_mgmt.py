@@ -0,0 +1,37 @@
+import struct
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("gdal")
+
+import geo_utils as geo
+
+
+def get_square(x0, y0, size):
+    return [(x0, y0), (x0 + size, y0), (x0 + size, y0 + size), (x0, y0 + size), (x0, y0)]
+
+
+def get_polygon_wkb(rings):
+    wkb = struct.pack("<BII", 1, 3, len(rings))
+    for ring in rings:
+        wkb += struct.pack("<I", len(ring)) + b"".join(struct.pack("<dd", *point) for point in ring)
+    return wkb
+
+
+def test_polygon_areas():
+    # LV95 coordinates, a hole (clockwise), a multipolygon, a line, and a feature without geometry
+    polygon = get_polygon_wkb([get_square(2600000, 1200000, 10), get_square(2600002, 1200002, 2)[::-1]])
+    multi_polygon = (struct.pack("<BII", 1, 6, 2) + get_polygon_wkb([get_square(0, 0, 3)])
+                     + get_polygon_wkb([get_square(5, 5, 1)[::-1]]))
+    line = struct.pack("<BII", 1, 2, 2) + struct.pack("<dddd", 0, 0, 1, 1)
+    areas = geo.get_polygon_areas([polygon, None, multi_polygon, line])
+    np.testing.assert_array_equal(areas, [96.0, 0.0, 10.0, 0.0])
+
+
+def test_coordinate_blocks_keep_format():
+    polygon = get_polygon_wkb([get_square(0, 0, 1), get_square(0.2, 0.2, 0.5)])
+    ring_signs = []
+    blocks = geo.get_wkb_coordinate_blocks(polygon, ring_signs)
+    assert ring_signs == [1, -1]
+    assert [block[1:] for block in blocks] == [(5, 2, "<f8", False)] * 2
@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("gdal")
+ogr = pytest.importorskip("ogr")
+osr = pytest.importorskip("osr")
+
+import geo_utils as geo
+from geo_utils import srs_mgmt
+
+
+def test_make_prj_uses_the_registry(tmp_path, monkeypatch):
+    def no_osr(epsg):
+        raise AssertionError("osr resolution of a pre-warmed epsg code")
+
+    monkeypatch.setattr(srs_mgmt, "resolve_esriwkt", no_osr)
+    shp_file = str(tmp_path / "habitat.shp")
+    srs_mgmt.make_prj(shp_file, 2056)
+    with open(str(tmp_path / "habitat.prj")) as prj:
+        assert prj.read() == srs_mgmt.srs_registry["2056"]["esriwkt"]
+
+
+def test_make_prj_resolves_other_epsg_codes(tmp_path, monkeypatch):
+    monkeypatch.setattr(srs_mgmt, "resolve_esriwkt", lambda epsg: "WKT-%i" % epsg)
+    srs_mgmt.make_prj(str(tmp_path / "habitat.shp"), 3857)
+    with open(str(tmp_path / "habitat.prj")) as prj:
+        assert prj.read() == "WKT-3857"
+
+
+def create_source_layer(shp_file):
+    # in-memory source layer (the data source name defines the name of the reprojected shapefile)
+    dataset = ogr.GetDriverByName("Memory").CreateDataSource(shp_file)
+    source_srs = osr.SpatialReference()
+    source_srs.ImportFromEPSG(2056)
+    layer = dataset.CreateLayer("src", srs=source_srs, geom_type=ogr.wkbMultiPolygon)
+    for name, field_type in (("id", ogr.OFTInteger), ("depth", ogr.OFTReal), ("name", ogr.OFTString),
+                             ("survey", ogr.OFTDate)):
+        layer.CreateField(ogr.FieldDefn(name, field_type))
+    geometries = [
+        # polygon with a hole
+        "POLYGON ((2600000 1200000,2600100 1200000,2600100 1200100,2600000 1200100,2600000 1200000),"
+        "(2600020 1200020,2600020 1200040,2600040 1200040,2600040 1200020,2600020 1200020))",
+        "MULTIPOLYGON (((2601000 1201000,2601050 1201000,2601050 1201050,2601000 1201000)),"
+        "((2602000 1202000,2602050 1202000,2602050 1202050,2602000 1202000)))",
+        # 2.5D geometry
+        "POLYGON Z ((2603000 1203000 450,2603100 1203000 451,2603100 1203100 452,2603000 1203000 450))",
+        # feature without geometry
+        None,
+    ]
+    values = [(1, 0.25, "pool", "2020/06/01"), (2, None, "riffle", None), (3, 1.5, None, "2021/07/15"),
+              (4, 2.0, "run", "2022/08/30")]
+    for wkt, field_values in zip(geometries, values):
+        feature = ogr.Feature(layer.GetLayerDefn())
+        for name, value in zip(("id", "depth", "name", "survey"), field_values):
+            if value is not None:
+                feature.SetField(name, value)
+        if wkt is not None:
+            feature.SetGeometry(ogr.CreateGeometryFromWkt(wkt))
+        layer.CreateFeature(feature)
+    layer.ResetReading()
+    return dataset, layer, source_srs
+
+
+def read_features(shp_file):
+    dataset = ogr.Open(shp_file)
+    features = []
+    for feature in dataset.GetLayer():
+        geometry = feature.GetGeometryRef()
+        if geometry is None:
+            features.append((feature.items(), None, None))
+            continue
+        # rings of all polygon parts
+        polygons = ogr.ForceToMultiPolygon(geometry.Clone())
+        points = [polygons.GetGeometryRef(i).GetGeometryRef(j).GetPoints()
+                  for i in range(polygons.GetGeometryCount())
+                  for j in range(polygons.GetGeometryRef(i).GetGeometryCount())]
+        features.append((feature.items(), geometry.GetGeometryName(), points))
+    return features
+
+
+def test_bulk_reprojection_matches_feature_by_feature(tmp_path):
+    target_srs = osr.SpatialReference()
+    target_srs.ImportFromEPSG(4326)
+    shp_files = {}
+    for bulk in (True, False):
+        shp_dir = tmp_path / ("bulk" if bulk else "single")
+        shp_dir.mkdir()
+        dataset, layer, source_srs = create_source_layer(str(shp_dir / "src.shp"))
+        srs_mgmt.reproject_shapefile(dataset, layer, source_srs, target_srs, bulk=bulk)
+        shp_files[bulk] = str(shp_dir / "src_epsg4326.shp")
+
+    bulk_features, single_features = read_features(shp_files[True]), read_features(shp_files[False])
+    assert len(bulk_features) == len(single_features) == 4
+    for (bulk_fields, bulk_type, bulk_points), (fields, geometry_type, points) in zip(bulk_features,
+                                                                                      single_features):
+        assert bulk_fields == fields
+        assert bulk_type == geometry_type
+        if points is None:
+            assert bulk_points is None
+            continue
+        assert [len(ring) for ring in bulk_points] == [len(ring) for ring in points]
+        np.testing.assert_allclose(np.concatenate(bulk_points), np.concatenate(points), rtol=0.0, atol=1e-9)
+    # multipolygon parts and holes are kept
+    assert [len(feature[2]) for feature in bulk_features[0:2]] == [2, 2]
+
+
+def create_north_up_raster(tif, raster_array):
+    geo.create_raster(tif, raster_array, epsg=2056, geo_info=(2600000.0, 2.0, 0.0, 1200100.0, 0.0, -2.0))
+    dataset = gdal.Open(tif)
+    return dataset, srs_mgmt.get_srs(dataset)
+
+
+@pytest.mark.parametrize("warp", [False, True])
+def test_reproject_raster_keeps_north_up_grid(tmp_path, warp):
+    raster_array = np.random.default_rng(0).uniform(0.0, 2.0, (50, 40)).astype(np.float32)
+    dataset, srs = create_north_up_raster(str(tmp_path / "depth.tif"), raster_array)
+    tar_file_name = srs_mgmt.reproject_raster(dataset, srs, srs.Clone(), warp=warp)
+    assert tar_file_name == str(tmp_path / "depth_epsg2056.tif")
+    reprojected = gdal.Open(tar_file_name)
+    assert (reprojected.RasterXSize, reprojected.RasterYSize) == (40, 50)
+    np.testing.assert_allclose(reprojected.GetGeoTransform(), dataset.GetGeoTransform(), rtol=0.0, atol=1e-6)
+    np.testing.assert_allclose(reprojected.GetRasterBand(1).ReadAsArray(), raster_array, rtol=0.0, atol=1e-5)
+
+
+def test_warp_raster_keeps_nodata(tmp_path):
+    raster_array = np.random.default_rng(0).uniform(0.0, 2.0, (50, 40))
+    raster_array[10, 20] = np.nan
+    dataset, srs = create_north_up_raster(str(tmp_path / "depth.tif"), raster_array)
+    reprojected = gdal.Open(srs_mgmt.warp_raster(dataset, srs, srs.Clone()))
+    band = reprojected.GetRasterBand(1)
+    assert band.GetNoDataValue() == srs_mgmt.nan_value
+    warped_array = band.ReadAsArray()
+    assert warped_array[10, 20] == srs_mgmt.nan_value
+    valid = ~np.isnan(raster_array)
+    np.testing.assert_allclose(warped_array[valid], raster_array[valid], rtol=0.0, atol=1e-5)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("gdal")
+
+import geo_utils as geo
+import raster
+from calculate_habitat_area import calculate_uha
+from raster import Raster
+from uha_calculator import UHACalculator
+
+bin_edges = [0.0, 0.25, 0.5, 0.75, 1.0]
+chsi_values = np.array([[0.0, 0.1, 0.4, 0.5, np.nan],
+                        [0.95, 1.0, 0.39, np.nan, 0.7],
+                        [0.2, 0.4, 0.8, 0.3, 0.05]])
+
+
+def check_known_results(results):
+    # 7 of 13 valid pixels with cHSI >= 0.4 and a pixel area of 6
+    assert results["threshold"] == 7 * 6.0
+    assert results["weighted"] == pytest.approx(5.79 * 6.0)
+    assert results["valid_area"] == 13 * 6.0
+    np.testing.assert_array_equal(results["histogram"], [4, 4, 2, 3])
+    np.testing.assert_array_equal(results["class_area"], [24.0, 24.0, 12.0, 18.0])
+
+
+def test_uha_of_known_values():
+    uha = UHACalculator(6.0, threshold=0.4, bin_edges=bin_edges)
+    uha.add(chsi_values)
+    check_known_results(uha.get_results())
+
+
+@pytest.mark.parametrize("windows", [[(0, 0, 5, 1), (0, 1, 5, 2)], [(0, 0, 2, 3), (2, 0, 3, 2), (2, 2, 3, 1)]])
+def test_uha_of_split_windows(windows):
+    uha = UHACalculator(6.0, threshold=0.4, bin_edges=bin_edges)
+    for x_off, y_off, x_size, y_size in windows:
+        tile = chsi_values[y_off:y_off + y_size, x_off:x_off + x_size]
+        uha.add(tile, valid_mask=~np.isnan(tile))
+    check_known_results(uha.get_results())
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_calculate_uha_of_tiled_raster(tmp_path, monkeypatch, streaming):
+    rng = np.random.default_rng(0)
+    chsi_array = rng.uniform(0.0, 1.0, (35, 40))
+    chsi_array[rng.integers(0, 35, 60), rng.integers(0, 40, 60)] = np.nan
+    tif = str(tmp_path / "chsi.tif")
+    # 16x16 pixel tiles and windows of one tile (streaming)
+    geo.create_raster(tif, chsi_array, epsg=2056, geo_info=(2600000.0, 2.0, 0.0, 1200105.0, 0.0, -3.0),
+                      profile=["TILED=YES", "BLOCKXSIZE=16", "BLOCKYSIZE=16"])
+    monkeypatch.setattr(raster, "tile_budget", 256)
+    chsi_raster = Raster(tif, streaming=streaming)
+    assert len(chsi_raster.get_windows()) == (9 if streaming else 1)
+    results = calculate_uha(chsi_raster, 0.4, bin_edges=bin_edges)
+
+    # expected values of the float32 GeoTIFF pixels
+    valid = chsi_array[~np.isnan(chsi_array)].astype(np.float32).astype(np.float64)
+    assert results["threshold"] == np.count_nonzero(valid >= 0.4) * 6.0
+    assert results["weighted"] == pytest.approx(np.sum(valid) * 6.0, rel=1e-12)
+    assert results["valid_area"] == valid.size * 6.0
+    np.testing.assert_array_equal(results["histogram"], np.histogram(valid, bins=bin_edges)[0])
+    np.testing.assert_array_equal(results["class_area"], np.histogram(valid, bins=bin_edges)[0] * 6.0)
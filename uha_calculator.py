@@ -0,0 +1,47 @@
+from fun import *
+
+
+class UHACalculator:
+    def __init__(self, pixel_area, threshold=0.4, bin_edges=np.linspace(0.0, 1.0, 11)):
+        """
+        Accumulator of the usable habitat area (UHA) from cHSI arrays or tiles (no polygon conversion required)
+        :param pixel_area: FLOAT of the area of one pixel (squared units of the raster's spatial reference)
+        :param threshold: FLOAT of the min. cHSI value of usable habitat (threshold method) - default=0.4
+        :param bin_edges: numpy.ndarray of cHSI class edges for histograms - default=10 classes between 0.0 and 1.0
+        """
+        self.pixel_area = pixel_area
+        self.threshold = threshold
+        self.bin_edges = np.asarray(bin_edges, dtype=float)
+        self.n_habitat = 0
+        self.n_valid = 0
+        self.chsi_sum = 0.0
+        self.histogram = np.zeros(self.bin_edges.size - 1, dtype=np.int64)
+
+    def add(self, chsi_array, valid_mask=None):
+        """
+        Add the pixels of a cHSI array (or tile), where np.nan (no-data) pixels are ignored
+        :param chsi_array: numpy.ndarray of cHSI values
+        :param valid_mask: numpy.ndarray (bool) of valid pixels (e.g., Raster.get_valid_mask), which
+                            avoids the np.nan check - default=None
+        """
+        if valid_mask is None:
+            valid_mask = ~np.isnan(chsi_array)
+        valid = chsi_array[valid_mask]
+        self.n_valid += valid.size
+        self.n_habitat += np.count_nonzero(valid >= self.threshold)
+        self.chsi_sum += float(np.sum(valid, dtype=np.float64))
+        self.histogram += np.histogram(valid, bins=self.bin_edges)[0]
+
+    def get_results(self):
+        """
+        Get the usable habitat area with both the threshold and the cHSI-weighted method
+        :return: dictionary of "threshold" (UHA of pixels with cHSI >= threshold), "weighted" (sum of
+                    cHSI x pixel area), "valid_area" (area of non-nodata pixels), "bin_edges",
+                    "histogram" (pixel count per cHSI class), and "class_area" (area per cHSI class)
+        """
+        return {"threshold": self.n_habitat * self.pixel_area,
+                "weighted": self.chsi_sum * self.pixel_area,
+                "valid_area": self.n_valid * self.pixel_area,
+                "bin_edges": self.bin_edges,
+                "histogram": self.histogram.copy(),
+                "class_area": self.histogram * self.pixel_area}